@@ -0,0 +1,126 @@
+"""
+班表 CSV 範圍讀取效能比較
+====================
+
+以本機 HTTP 伺服器提供合成的大型班表，比較：
+- 原本的方式：完整下載並以 pd.read_csv 解析，再以 iloc 取 A1:CE36 範圍
+- 範圍讀取：SheetHttpCache.fetch 串流讀取，讀滿 Config.MAX_ROWS 筆、Config.MAX_COLS 欄即停止
+
+輸出解析的位元組數、實際自連線讀取的位元組數與執行時間（多次執行取最快），
+並確認兩種方式得到的 DataFrame 相同。
+
+執行方式：
+    python benchmarks/bench_bounded_csv.py [--runs 5]
+"""
+
+import argparse
+import http.server
+import io
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import finale_post_fixed as app
+import sheet_http_client
+
+# (列數, 欄數)：一般大小的班表，以及帶有大量備註列與欄的班表
+SHEET_SIZES = [(62, 100), (5003, 400)]
+
+
+def build_sheet(rows: int, cols: int) -> bytes:
+    """產生合成班表 CSV（第一列為標題，之後每列為一天或一筆備註）"""
+    lines = [",".join(f"欄{col}" for col in range(cols))]
+    shifts = ["D", "E", "N", "", "W6", "X1"]
+    for row in range(rows - 1):
+        lines.append(",".join(shifts[(row + col) % len(shifts)] for col in range(cols)))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def serve(bodies: dict) -> socketserver.ThreadingTCPServer:
+    """在背景執行緒啟動只回傳固定內容的 HTTP 伺服器（不帶驗證標頭，每次都回應 200）"""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # 標頭與內容分開送出時避免 Nagle 演算法造成的延遲
+        
+        def log_message(self, *args):
+            pass
+        
+        def do_GET(self):
+            body = bodies[self.path]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 範圍讀取提早關閉連線
+    
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def read_full(url: str):
+    """原本的方式：完整下載與解析後再取範圍"""
+    body = sheet_http_client.fetch_bytes(url)
+    df = pd.read_csv(io.BytesIO(body)).iloc[:app.Config.MAX_ROWS, :app.Config.MAX_COLS]
+    return df, len(body)
+
+
+def read_bounded(url: str):
+    """範圍讀取：串流讀取，讀滿範圍即停止"""
+    status = app.SourceFetchStatus(name="員工班表", url=url, max_rows=app.Config.MAX_ROWS, max_cols=app.Config.MAX_COLS)
+    app.SheetHttpCache.fetch(status)
+    return pd.read_csv(io.BytesIO(status.body)), len(status.body)
+
+
+def measure(reader, url: str, runs: int):
+    """多次執行取最快的一次，返回 (DataFrame, 解析位元組數, 自連線讀取的位元組數, 秒數)"""
+    best = None
+    for _ in range(runs):
+        transferred = sheet_http_client.get_stats()["bytes_transferred"]
+        start = time.perf_counter()
+        df, parsed = reader(url)
+        elapsed = time.perf_counter() - start
+        transferred = sheet_http_client.get_stats()["bytes_transferred"] - transferred
+        if best is None or elapsed < best[3]:
+            best = (df, parsed, transferred, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="每種方式執行次數（取最快）")
+    args = parser.parse_args()
+    
+    bodies = {f"/sheet-{rows}x{cols}.csv": build_sheet(rows, cols) for rows, cols in SHEET_SIZES}
+    server = serve(bodies)
+    
+    # HTTP 快取寫到暫存目錄，不影響本機的 .roster_cache
+    with tempfile.TemporaryDirectory() as cache_dir:
+        app.Config.HTTP_CACHE_DIR = cache_dir
+        try:
+            for path, body in bodies.items():
+                url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+                full_df, full_parsed, full_read, full_time = measure(read_full, url, args.runs)
+                bounded_df, bounded_parsed, bounded_read, bounded_time = measure(read_bounded, url, args.runs)
+                
+                print(f"{path[1:]} ({len(body):,} B)")
+                print(f"  完整讀取: 解析 {full_parsed:,} B，連線讀取 {full_read:,} B，{full_time * 1000:.1f} ms")
+                print(f"  範圍讀取: 解析 {bounded_parsed:,} B，連線讀取 {bounded_read:,} B，{bounded_time * 1000:.1f} ms")
+                print(f"  結果相同: {full_df.equals(bounded_df)}")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
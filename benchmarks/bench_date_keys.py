@@ -0,0 +1,120 @@
+"""
+日期鍵效能比較
+====================
+
+改為以當月日序為索引（DailyOvertime）之前，每日時數以 "YYYY/MM/DD" 字串為鍵，
+計算平日／假日總時數與收集可刪減的平日時，每筆都要 split('/')、int() 後再查日期類型。
+此腳本以相同的合成資料比較兩種作法：
+
+- 字串鍵：重現改版前 _calculate_weekday_weekend_hours 與 _reduce_excess_hours 收集平日的迴圈
+- 日序索引：OvertimeCalculator._calculate_weekday_weekend_hours 與陣列遮罩
+
+兩種作法的平日、假日總時數與可刪減的平日會先比對一致。
+
+執行方式：
+    python benchmarks/bench_date_keys.py [--people 50] [--runs 5]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import numpy as np
+
+import finale_post_fixed as app
+
+MONTHS = [(2025, month) for month in range(1, 13)]
+
+
+def build_months(people: int, rng: random.Random):
+    """每人每月的每日時數（約七成的日期有加班），返回 [(字串鍵字典, DailyOvertime)]"""
+    cases = []
+    for _ in range(people):
+        for year, month in MONTHS:
+            daily = app.DailyOvertime.for_month(year, month)
+            for slot in range(daily.days_in_month):
+                if rng.random() < 0.7:
+                    daily.add(slot, rng.choice([1.0, 2.0, 2.5, 3.0, 4.0]))
+            cases.append((daily.to_breakdown(), daily))
+    return cases
+
+
+def string_key_stage(breakdown):
+    """改版前的作法：每筆日期字串拆開並轉為整數後查日期類型"""
+    weekday_hours = 0.0
+    weekend_hours = 0.0
+    for date_str, total_hours in breakdown.items():
+        date_parts = date_str.split('/')
+        _, is_weekend = app.DateHelper.get_day_type(int(date_parts[0]), int(date_parts[1]), int(date_parts[2]))
+        if is_weekend:
+            weekend_hours += total_hours
+        else:
+            weekday_hours += total_hours
+    
+    # 收集可刪減的平日（再拆一次字串）
+    weekday_dates = []
+    for date_str, hours in breakdown.items():
+        if hours > 0:
+            date_parts = date_str.split('/')
+            _, is_weekend = app.DateHelper.get_day_type(int(date_parts[0]), int(date_parts[1]), int(date_parts[2]))
+            if not is_weekend:
+                weekday_dates.append((date_str, hours))
+    weekday_dates.sort(key=lambda item: item[1])
+    return weekday_hours, weekend_hours, [date_str for date_str, _ in weekday_dates]
+
+
+def ordinal_stage(daily):
+    """日序索引：以日期類型陣列與遮罩計算"""
+    weekday_hours, weekend_hours = app.OvertimeCalculator._calculate_weekday_weekend_hours(daily)
+    slots = np.flatnonzero((daily.hours > 0) & ~daily.is_weekend)
+    slots = slots[np.argsort(daily.hours[slots], kind='stable')]
+    return weekday_hours, weekend_hours, slots.tolist()
+
+
+def best_time(fn, inputs, runs: int) -> float:
+    """多次執行取最快的秒數"""
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        for item in inputs:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--people", type=int, default=50, help="人數（每人 12 個月）")
+    parser.add_argument("--runs", type=int, default=5, help="執行次數（取最快）")
+    args = parser.parse_args()
+    
+    app.SessionStateManager.initialize()
+    cases = build_months(args.people, random.Random(19))
+    breakdowns = [breakdown for breakdown, _ in cases]
+    dailies = [daily for _, daily in cases]
+    
+    mismatches = 0
+    for breakdown, daily in cases:
+        string_result = string_key_stage(breakdown)
+        ordinal_result = ordinal_stage(daily)
+        ordinal_dates = [daily.date_string(slot) for slot in ordinal_result[2]]
+        if string_result[:2] != ordinal_result[:2] or string_result[2] != ordinal_dates:
+            mismatches += 1
+    
+    string_seconds = best_time(string_key_stage, breakdowns, args.runs)
+    ordinal_seconds = best_time(ordinal_stage, dailies, args.runs)
+    
+    print(f"{len(cases):,} 個人月，{sum(len(breakdown) for breakdown in breakdowns):,} 筆每日時數，結果不同 {mismatches} 個")
+    print(f"  字串鍵: {string_seconds / len(cases) * 1e6:7.1f} us/人月")
+    print(f"  日序索引: {ordinal_seconds / len(cases) * 1e6:7.1f} us/人月")
+    print(f"  加速 {string_seconds / ordinal_seconds:.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+時間範圍批次解析效能比較
+====================
+
+比較 TimeCalculator.parse_time_ranges（整欄批次解析）與逐筆呼叫
+calculate_hours / parse_interval 的吞吐量。每種資料各測兩種欄位：
+- 重複值多：班種對照表常見的少數幾種寫法重複出現
+- 幾乎全部不同：每列都是不同的時間範圍（去重幾乎沒有幫助）
+
+逐筆解析每次執行前清除 calculate_hours 快取，與批次解析同樣從零開始。
+
+執行方式：
+    python benchmarks/bench_parse_time_ranges.py [--rows 100000] [--runs 3]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import pandas as pd
+
+from finale_post_fixed import TimeCalculator
+
+COMMON_VALUES = ["17:30-20:00", "1730-2000", "17-20", "23:30-01:30", "08:00-12:00", "2.5", "4", "", None, "臨床業務"]
+
+
+def build_repeated(rows: int, rng: random.Random) -> pd.Series:
+    """少數幾種寫法重複出現的欄位"""
+    return pd.Series([rng.choice(COMMON_VALUES) for _ in range(rows)], dtype=object)
+
+
+def build_unique(rows: int, rng: random.Random) -> pd.Series:
+    """幾乎每列都不同的時間範圍（HH:MM、HHMM、HH 與小數時數混合）"""
+    values = []
+    for row in range(rows):
+        start, end = rng.randrange(24 * 60), rng.randrange(24 * 60)
+        style = row % 4
+        if style == 0:
+            values.append(f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}")
+        elif style == 1:
+            values.append(f"{start // 60:02d}{start % 60:02d}-{end // 60:02d}{end % 60:02d}")
+        elif style == 2:
+            values.append(f"{start // 60}-{end // 60}")
+        else:
+            values.append(f"{rng.uniform(0, 24):.4f}")
+    return pd.Series(values, dtype=object)
+
+
+def scalar_parse(values: pd.Series):
+    """逐筆解析（與改為批次解析前的 build_shift_dictionary 相同）"""
+    TimeCalculator.clear_hours_cache()
+    return [(TimeCalculator.parse_interval(value), TimeCalculator.calculate_hours(value)) for value in values]
+
+
+def best_time(fn, values: pd.Series, runs: int) -> float:
+    """多次執行取最快的秒數"""
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(values)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="每種欄位的列數")
+    parser.add_argument("--runs", type=int, default=3, help="每種方式執行次數（取最快）")
+    args = parser.parse_args()
+    
+    rng = random.Random(15)
+    for label, values in (("重複值多", build_repeated(args.rows, rng)), ("幾乎全部不同", build_unique(args.rows, rng))):
+        scalar_seconds = best_time(scalar_parse, values, args.runs)
+        batch_seconds = best_time(TimeCalculator.parse_time_ranges, values, args.runs)
+        
+        batch = TimeCalculator.parse_time_ranges(values)
+        mismatches = sum(
+            1 for (interval, hours), start, end, batch_hours in zip(
+                scalar_parse(values), batch["start_minutes"], batch["end_minutes"], batch["hours"]
+            )
+            if (interval or (None, None)) != tuple(None if pd.isna(v) else v for v in (start, end))
+            or hours != (None if pd.isna(batch_hours) else batch_hours)
+        )
+        
+        print(f"{label}（{len(values):,} 列，{values.nunique(dropna=False):,} 種值）")
+        print(f"  逐筆解析: {scalar_seconds * 1000:8.1f} ms（{len(values) / scalar_seconds:,.0f} 列/秒）")
+        print(f"  批次解析: {batch_seconds * 1000:8.1f} ms（{len(values) / batch_seconds:,.0f} 列/秒）")
+        print(f"  加速 {scalar_seconds / batch_seconds:.1f} 倍，結果不同 {mismatches} 列")
+
+
+if __name__ == "__main__":
+    main()
@@ -118,6 +118,12 @@ def render_system_info():
     
     st.caption(f"🔄 快取版本: {st.session_state.cache_version}")
     
+    hours_stats = TimeCalculator.hours_cache_stats()
+    lookups = hours_stats['hits'] + hours_stats['misses']
+    hit_rate = hours_stats['hits'] / lookups * 100 if lookups else 0.0
+    st.caption(f"⏱️ 時數解析快取: 命中 {hours_stats['hits']} / 未命中 {hours_stats['misses']} ({hit_rate:.0f}%), "
+               f"{hours_stats['size']}/{hours_stats['max_size']} 筆")
+    
     # 清除快取按鈕
     if st.button("🗑️ 清除快取", type="secondary", help="清除所有快取資料，強制重新載入"):
         SessionStateManager.clear_cache()
@@ -717,6 +723,7 @@ if __name__ == "__main__":
 """
 
 import pandas as pd
+import sheet_http_client
 from datetime import datetime, date, timedelta
 from collections import defaultdict
 import openpyxl
@@ -729,6 +736,7 @@ import base64
 import re
 from typing import Dict, List, Tuple, Optional, Any, Union
 from dataclasses import dataclass
+from functools import lru_cache
 import time
 
 warnings.filterwarnings('ignore')
@@ -761,6 +769,9 @@ class Config:
     # 優先日期設定（週二、週四優先）
     HIGH_PRIORITY_WEEKDAYS = [1, 3]  # 週二、週四
     MEDIUM_PRIORITY_WEEKDAYS = [0, 2, 4]  # 週一、週三、週五
+    
+    # 快取設定
+    HOURS_CACHE_SIZE = 1024  # calculate_hours 快取的時間字串數
 
 @dataclass
 class ShiftInfo:
@@ -828,6 +839,7 @@ class SessionStateManager:
     def clear_cache():
         """清除快取並更新版本號"""
         st.cache_data.clear()
+        TimeCalculator.clear_hours_cache()
         st.session_state.cache_version += 1
         st.session_state.data_load_time = datetime.now()
     
@@ -943,14 +955,14 @@ class DataLoader:
             progress_bar.progress(30)
             
             # 讀取員工班表
-            df_full = pd.read_csv(main_csv_url)
+            df_full = sheet_http_client.read_csv(main_csv_url)
             df = df_full.iloc[:Config.MAX_ROWS, :Config.MAX_COLS]  # 選取指定範圍
             
             status_text.text("🔢 正在讀取班種對照表...")
             progress_bar.progress(60)
             
             # 讀取班種對照表
-            shift_df = pd.read_csv(shift_csv_url)
+            shift_df = sheet_http_client.read_csv(shift_csv_url)
             
             status_text.text("🔨 正在建立班種字典...")
             progress_bar.progress(80)
@@ -994,6 +1006,9 @@ class DataProcessor:
         """
         shift_dict = {}
         
+        # 舊班種表的時間字串不再需要
+        TimeCalculator.clear_hours_cache()
+        
         for index, row in shift_df.iterrows():
             try:
                 shift_type = str(row.iloc[0]).strip()
@@ -1126,8 +1141,12 @@ class TimeCalculator:
         if not time_range or pd.isna(time_range):
             return None
 
-        time_str = str(time_range).strip()
-
+        return TimeCalculator._calculate_hours_cached(str(time_range).strip())
+    
+    @staticmethod
+    @lru_cache(maxsize=Config.HOURS_CACHE_SIZE)
+    def _calculate_hours_cached(time_str: str) -> Optional[float]:
+        """計算正規化後時間字串的小時數（相同字串只解析一次）"""
         # 處理純數字（小時數）
         if TimeCalculator._is_pure_number(time_str):
             try:
@@ -1142,6 +1161,17 @@ class TimeCalculator:
 
         return TimeCalculator._parse_time_range(time_str)
     
+    @staticmethod
+    def hours_cache_stats() -> Dict[str, int]:
+        """calculate_hours 快取的命中統計"""
+        info = TimeCalculator._calculate_hours_cached.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize}
+    
+    @staticmethod
+    def clear_hours_cache():
+        """清除 calculate_hours 快取（班種表重新載入時呼叫）"""
+        TimeCalculator._calculate_hours_cached.cache_clear()
+    
     @staticmethod
     def _is_pure_number(time_str: str) -> bool:
         """檢查是否為純數字"""
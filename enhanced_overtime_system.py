@@ -1,5 +1,6 @@
 # 互動式員工班表加班時數統計系統 (Streamlit版) - 增強版
 import pandas as pd
+import sheet_http_client
 from datetime import datetime, date, timedelta
 from collections import defaultdict
 import openpyxl
@@ -9,6 +10,7 @@ import warnings
 import calendar
 import io
 import base64
+from functools import lru_cache
 warnings.filterwarnings('ignore')
 
 # ===== Streamlit 頁面配置 =====
@@ -70,11 +72,11 @@ def load_data_from_urls(main_sheet_url, version_name):
 
     try:
         # 讀取員工班表
-        df_full = pd.read_csv(main_csv_url)
+        df_full = sheet_http_client.read_csv(main_csv_url)
         df = df_full.iloc[:36, :83]  # 選取 A1:CE36 範圍
 
         # 讀取班種對照表
-        shift_df = pd.read_csv(shift_csv_url)
+        shift_df = sheet_http_client.read_csv(shift_csv_url)
 
         # 建立班種字典
         shift_dict = {}
@@ -95,13 +97,19 @@ def load_data_from_urls(main_sheet_url, version_name):
         return None, None, f"❌ 資料讀取失敗: {e}"
 
 def calculate_hours(time_range):
-    """計算時間範圍的小時數"""
+    """計算時間範圍的小時數（相同時間字串只解析一次）"""
     try:
         if not time_range or pd.isna(time_range):
             return None
+    except Exception as e:
+        return None
 
-        time_str = str(time_range).strip()
+    return _calculate_hours_cached(str(time_range).strip())
 
+@lru_cache(maxsize=1024)  # 班種表的時間字串種類有限
+def _calculate_hours_cached(time_str):
+    """計算正規化後時間字串的小時數"""
+    try:
         # 處理逗號作為小數點的情況
         if ',' in time_str and '-' not in time_str:
             try:
@@ -744,6 +752,7 @@ def load_data_page():
             
             # 清除快取
             st.cache_data.clear()
+            _calculate_hours_cached.cache_clear()
             
         else:
             st.error(message)
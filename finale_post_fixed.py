@@ -16,7 +16,8 @@
 """
 
 import pandas as pd
-from datetime import datetime, date, timedelta
+import numpy as np
+from datetime import datetime, date, timedelta, time as dt_time
 from collections import defaultdict
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
@@ -26,9 +27,26 @@ import calendar
 import io
 import base64
 import re
-from typing import Dict, List, Tuple, Optional, Any, Union
-from dataclasses import dataclass
+import bisect
+import heapq
+import math
+from typing import Dict, List, Tuple, Optional, Any, Union, Callable
+from dataclasses import dataclass, field
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import weakref
+from collections import OrderedDict
+import csv
+import codecs
+import hashlib
+import pickle
+import json
+import os
 import time
+import sys
+
+import sheet_http_client
 
 warnings.filterwarnings('ignore')
 
@@ -46,6 +64,36 @@ class Config:
     # 班表範圍設定
     MAX_ROWS = 36
     MAX_COLS = 83
+    SHIFT_TABLE_COLS = 4  # 班種、加班時數1、加班時數2、跨日時數
+    PERSONNEL_ROW = 1  # 人事號所在列
+    DAY_ROW_OFFSET = 2  # 第 N 日位於第 N + 2 列
+    MAX_DAYS_IN_MONTH = 31
+    
+    # 資料下載設定
+    FETCH_CHUNK_SIZE = 64 * 1024
+    
+    # 本機快照設定
+    SNAPSHOT_DIR = os.path.join(".roster_cache", "snapshots")
+    SNAPSHOT_FORMAT_VERSION = 2  # ShiftInfo 結構變更時遞增，舊快照不再讀取
+    SNAPSHOT_KEEP_PER_SHEET = 3
+    HTTP_CACHE_DIR = os.path.join(".roster_cache", "http")
+    
+    # 跨 session 共用班表設定
+    ROSTER_CACHE_TTL_SECONDS = 300  # 超過此時間重新向來源確認是否更新
+    ROSTER_REGISTRY_MAX_IDLE = 4  # 無 session 使用時最多保留的班表版本數
+    ROSTER_REGISTRY_MAX_IDLE_PERIODS = 60  # 無 session 使用時最多保留的月份班表數（與期間查詢月份上限相同）
+    MONTH_SHIFTS_CACHE_SIZE = 32  # 每個 session 保留的整月班次結果數
+    HOURS_CACHE_SIZE = 1024  # calculate_hours 快取的時間字串數（所有 session 共用）
+    QUERY_RESULT_CACHE_MAX_BYTES = 8 * 1024 * 1024  # 查詢結果快取的記憶體上限（所有 session 共用）
+    
+    # 本機班表匯入設定
+    LOCAL_ROSTER_EXTENSIONS = ('.csv', '.xlsx')
+    LOCAL_SHIFT_TABLE_KEYWORDS = ('班種', 'shift')  # 檔名含這些字的檔案視為班種對照表
+    LOCAL_INGEST_MAX_WORKERS = 4
+    
+    # 期間查詢設定
+    RANGE_QUERY_MAX_MONTHS = 60  # 單次期間查詢最多月份數
+    RANGE_QUERY_MAX_WORKERS = 4  # 實際不超過 CPU 核心數
     
     # 加班時數相關設定
     MAX_WEEKDAY_HOURS = 46.0
@@ -53,6 +101,11 @@ class Config:
     WEEKEND_MIN_HOURS_THRESHOLD = 3.0
     EARLY_MORNING_CUTOFF = 5  # 05:00
     
+    # 平日時數分配規則（見 AllocationEngine.POLICIES）
+    ALLOCATION_POLICY = 'priority'
+    MAX_DAILY_WEEKDAY_HOURS = 4.0  # 'capped' 規則的平日單日上限
+    ALLOCATION_STEP_HOURS = 0.5  # 'spread' 規則削平時的時數單位
+    
     # 日期相關設定
     MIN_YEAR = 2020
     MAX_YEAR = 2030
@@ -61,13 +114,184 @@ class Config:
     HIGH_PRIORITY_WEEKDAYS = [1, 3]  # 週二、週四
     MEDIUM_PRIORITY_WEEKDAYS = [0, 2, 4]  # 週一、週三、週五
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ShiftInfo:
-    """班次資訊資料類別"""
+    """
+    班次資訊資料類別
+    
+    建立班種字典時解析一次（見 DataProcessor.compile_shift_info），
+    計算與匯出只讀取解析後的欄位。
+    """
     shift_type: str
-    overtime_hours_1: Optional[str]
+    overtime_hours_1: Optional[str]  # 原始值（預覽與比對用）
     overtime_hours_2: Optional[str]
     cross_day_hours: Optional[str]
+    time_string_1: str = ""  # 顯示用時間字串（空字串表示無）
+    time_string_2: str = ""
+    cross_day_string: str = ""
+    hours_1: float = 0.0  # 時數（無法解析為 0）
+    hours_2: float = 0.0
+    cross_day_overtime: float = 0.0
+    interval_1: Optional[Tuple[int, int]] = None  # (開始分鐘, 結束分鐘)，跨午夜時結束分鐘大於 1440
+    interval_2: Optional[Tuple[int, int]] = None
+    cross_day_interval: Optional[Tuple[int, int]] = None
+
+@dataclass
+class SourceFetchStatus:
+    """單一資料來源的下載進度"""
+    name: str
+    url: str
+    max_rows: Optional[int] = None  # 只讀取標題列之後的前 N 筆資料
+    max_cols: Optional[int] = None  # 只保留前 N 欄
+    bytes_read: int = 0
+    elapsed: float = 0.0
+    done: bool = False
+    error: Optional[str] = None
+    content_hash: Optional[str] = None
+    body: Optional[bytes] = None
+    unchanged: bool = False  # 304 或內容與上次相同
+    frame: Optional[pd.DataFrame] = None
+
+@dataclass
+class LocalIngestResult:
+    """本機班表檔案匯入結果"""
+    name: str
+    period: Optional[str] = None  # YYYY-MM，由檔名判斷
+    sheet_id: Optional[str] = None
+    version: Optional[str] = None
+    shape: Optional[Tuple[int, int]] = None
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+@dataclass
+class RosterSnapshot:
+    """班表快照資料類別"""
+    sheet_id: str
+    content_hash: str
+    df: pd.DataFrame
+    shift_dict: Dict[str, Any]
+    saved_at: datetime
+    warnings: Tuple[str, ...] = ()  # 建立班種字典時的警告（可能在背景執行緒建立，由 session 顯示）
+
+@dataclass
+class RosterChange:
+    """兩個班表版本之間的差異"""
+    changed_cells: int = 0
+    affected: Dict[str, set] = field(default_factory=dict)  # 人事號 -> 受影響的日期
+    changed_shift_types: List[str] = field(default_factory=list)  # 班種對照表中有變更的班種
+    structural: bool = False  # 班表範圍不同，無法逐格比對（全部視為受影響）
+
+@dataclass
+class DailyOvertime:
+    """
+    整月每日加班時數
+    
+    以當月日序為索引（第 N 日為 N - 1），最後一格為隔月 1 日（月底班次的跨日時數；
+    跨日時段傳給隔月時為 0，見 RosterRegistry.carry_roster）；日期字串只在顯示與匯出時產生。
+    """
+    year: int
+    month: int
+    hours: np.ndarray  # float64 [當月天數 + 1]
+    is_weekend: np.ndarray  # bool [當月天數 + 1]
+    weekdays: np.ndarray  # int8 [當月天數 + 1]，0 為週一
+    day_types: List[str]  # 日期類型描述 [當月天數 + 1]
+    order: List[int] = field(default_factory=list)  # 有記錄的索引（依記錄先後；刪減超額時數時同時數依此順序）
+    
+    @staticmethod
+    def for_month(year: int, month: int) -> 'DailyOvertime':
+        """建立空白的整月時數表（含隔月 1 日）"""
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        day_types = DateHelper.get_month_day_types(year, month) + [DateHelper.get_day_type(next_year, next_month, 1)]
+        slots = len(day_types)
+        
+        return DailyOvertime(
+            year=year,
+            month=month,
+            hours=np.zeros(slots),
+            is_weekend=np.array([is_weekend for _, is_weekend in day_types], dtype=bool),
+            weekdays=((np.arange(slots) + calendar.weekday(year, month, 1)) % 7).astype(np.int8),
+            day_types=[day_type for day_type, _ in day_types]
+        )
+    
+    @property
+    def days_in_month(self) -> int:
+        return len(self.hours) - 1
+    
+    def add(self, slot: int, hours: float):
+        """累加某日時數"""
+        if slot not in self.order:
+            self.order.append(slot)
+        self.hours[slot] += hours
+    
+    def has(self, slot: int) -> bool:
+        """該日是否有記錄（含被刪減為 0 的日期）"""
+        return slot in self.order
+    
+    def date_string(self, slot: int) -> str:
+        """索引轉為 YYYY/MM/DD"""
+        current_date = date(self.year, self.month, 1) + timedelta(days=slot)
+        return f"{current_date.year}/{current_date.month:02d}/{current_date.day:02d}"
+    
+    def to_breakdown(self) -> Dict[str, float]:
+        """轉為 {YYYY/MM/DD: 時數}（依記錄先後）"""
+        return {self.date_string(slot): float(self.hours[slot]) for slot in self.order}
+
+@dataclass(frozen=True)
+class MonthCarry:
+    """
+    月底班次跨到隔月 1 日的時段（隔月計算的起始狀態）
+    
+    只取決於該月最後一日的有效班次，計算某月份時不需重算之前的月份。
+    只在上個月份另外登錄了月份班表時傳遞（見 RosterRegistry.carry_roster），否則為空。
+    """
+    shift: str = ""  # 該月最後一日的有效班次（空字串表示休假或無資料）
+    shift_info: Optional[ShiftInfo] = None  # 以該月班表的班種字典解析
+    
+    @staticmethod
+    def from_shift(shift: str, shift_dict: Dict[str, ShiftInfo]) -> 'MonthCarry':
+        """由最後一日的有效班次建立"""
+        return MonthCarry(shift=shift, shift_info=shift_dict.get(shift) if shift else None)
+    
+    @property
+    def hours(self) -> float:
+        """跨到隔月 1 日的時數（未與隔月 1 日的時段合併）"""
+        if self.shift_info and self.shift_info.cross_day_string:
+            return self.shift_info.cross_day_overtime
+        return 0.0
+
+@dataclass
+class MonthWorkingState:
+    """
+    單一人員整月的計算中間結果（46 小時規則調整前）
+    
+    手動修改單日班次時只重算該日與隔日（跨日時段）兩格，查詢時只需重新套用 46 小時規則。
+    """
+    personnel: str
+    year: int
+    month: int
+    source_key: Tuple[int, Tuple[int, ...], int]  # (id(班表), 匹配欄位, holiday_version)，不同即整月重建
+    template: DailyOvertime  # 空白時數表（日期類型）
+    original: List[str]  # 原始班次（索引 0 為第 1 日）
+    effective: List[str]  # 有效班次
+    overrides: Dict[str, str]  # 建立或更新時的手動設定 {YYYY/MM/DD: 班次}
+    carry_in: MonthCarry  # 上個月最後一日班次跨入第 1 日的時段（不傳遞時為空）
+    raw_hours: np.ndarray  # float64 [當月天數 + 1]，各日合併後時數（第 1 日含上月跨入，最後一格為跨到隔月 1 日的時數）
+    has_own: np.ndarray  # bool [當月天數 + 1]，當日班次本身有加班時段
+    worked_weekdays: set  # 有上班的平日（日序索引）
+    
+    @property
+    def spill_hours(self) -> float:
+        """月底班次跨到隔月 1 日的時數"""
+        return float(self.raw_hours[-1])
+
+@dataclass(frozen=True)
+class AllocationPolicy:
+    """平日加班時數上限規則的分配策略"""
+    name: str
+    label: str
+    trim: str  # 超過上限時的刪減方式：'smallest_first'（時數少的日期先刪）、'level_largest'（削平時數最多的日期）
+    fill: str  # 不足時的補足方式：'priority_days'（週二、週四優先）、'spread_weeks'（平均分散到各週）
+    daily_cap: Optional[float] = None  # 平日單日時數上限（None 表示不限）
 
 @dataclass
 class QueryResult:
@@ -76,10 +300,82 @@ class QueryResult:
     year: int
     month: int
     matching_columns: List[int]
-    daily_breakdown: Dict[str, float]
+    daily: DailyOvertime
     weekday_hours: float
     weekend_hours: float
     total_hours: float
+    allocation_policy: str = Config.ALLOCATION_POLICY
+    carry_in_hours: float = 0.0  # 上月月份班表最後一日班次跨入本月 1 日的時數（已計入 1 日）
+    carry_out_hours: float = 0.0  # 本月最後一日班次跨到隔月 1 日、傳給隔月計算的時數（不在本月統計中）
+    
+    @property
+    def daily_breakdown(self) -> Dict[str, float]:
+        """每日加班時數 {YYYY/MM/DD: 時數}"""
+        return self.daily.to_breakdown()
+
+@dataclass
+class TeamQueryResult:
+    """團隊查詢結果資料類別（同一月份所有人員）"""
+    year: int
+    month: int
+    results: Dict[str, QueryResult]  # 人事號 -> 個人查詢結果（依查詢順序）
+    missing: List[str]  # 班表中找不到的人事號
+    allocation_policy: str = Config.ALLOCATION_POLICY
+    
+    @property
+    def weekday_hours(self) -> float:
+        return sum(result.weekday_hours for result in self.results.values())
+    
+    @property
+    def weekend_hours(self) -> float:
+        return sum(result.weekend_hours for result in self.results.values())
+    
+    @property
+    def total_hours(self) -> float:
+        return sum(result.total_hours for result in self.results.values())
+
+@dataclass
+class RangeQueryResult:
+    """期間查詢結果資料類別（多個月份的團隊結果）"""
+    start: Tuple[int, int]
+    end: Tuple[int, int]
+    months: Dict[Tuple[int, int], TeamQueryResult]  # (年, 月) -> 當月團隊結果（依月份順序）
+    sources: Dict[Tuple[int, int], str]  # (年, 月) -> 使用的班表（試算表 ID）
+    allocation_policy: str = Config.ALLOCATION_POLICY
+    
+    def monthly_rows(self) -> List[Dict[str, Any]]:
+        """
+        每人每月一列，含累計時數
+        
+        相鄰月份使用不同的月份班表時，月底班次跨到隔月 1 日的時數計入隔月（與單月查詢相同），
+        分別列為「上月跨入時數」與「跨入次月時數」；同一份班表涵蓋兩個月份時留在當月。
+        同一段時數只計算一次，累計即為各月加總。
+        """
+        rows = []
+        cumulative = defaultdict(float)
+        for (year, month), team_result in self.months.items():
+            for personnel, result in team_result.results.items():
+                cumulative[personnel] += result.total_hours
+                rows.append({
+                    '月份': f"{year}-{month:02d}",
+                    '人事號': personnel,
+                    '平日時數': result.weekday_hours,
+                    '假日時數': result.weekend_hours,
+                    '總時數': result.total_hours,
+                    '上月跨入時數': result.carry_in_hours,
+                    '跨入次月時數': result.carry_out_hours,
+                    '累計總時數': cumulative[personnel],
+                })
+        return rows
+    
+    def personnel_totals(self) -> Dict[str, Tuple[float, float, float]]:
+        """各人整段期間的 (平日, 假日, 總) 時數"""
+        totals = {}
+        for team_result in self.months.values():
+            for personnel, result in team_result.results.items():
+                weekday, weekend, total = totals.get(personnel, (0.0, 0.0, 0.0))
+                totals[personnel] = (weekday + result.weekday_hours, weekend + result.weekend_hours, total + result.total_hours)
+        return totals
 
 @dataclass
 class PreviewData:
@@ -106,10 +402,15 @@ class SessionStateManager:
     def initialize():
         """初始化所有 session state"""
         default_states = {
-            'df': None,
-            'shift_dict': {},
+            'roster_handle': None,  # 共用班表的參照（資料本身存放於 RosterRegistry）
+            'roster_warnings_shown': None,  # 已顯示建立警告的班表版本 (試算表 ID, 版本)
             'custom_holidays': {},
+            'holiday_version': 0,  # 自定義假日每次變更時遞增
+            'holiday_overlay': None,  # 套用自定義假日後的日曆（HolidayOverlay，假日變更時清除）
+            'allocation_policy': Config.ALLOCATION_POLICY,  # 平日時數分配規則（AllocationEngine.POLICIES）
             'last_query_result': None,
+            'last_team_result': None,  # 團隊查詢結果（TeamQueryResult）
+            'last_range_result': None,  # 期間查詢結果（RangeQueryResult）
             'current_page': "載入班表資料",
             'preview_data': None,
             'data_load_time': None,
@@ -117,6 +418,11 @@ class SessionStateManager:
             'manual_shifts': {},  # 新增：手動修改的班次資料 {personnel_year_month: {date: shift}}
             'editing_mode': False,  # 新增：編輯模式標記
             'current_edit_key': None,  # 新增：當前編輯的key
+            'local_rosters': {},  # 本 session 匯入的本機班表 {顯示名稱: 試算表 ID}
+            'last_roster_change': None,  # 最近一次切換班表時的差異
+            'month_shifts_cache': OrderedDict(),  # 整月有效班次（查詢、預覽、編輯、匯出共用）
+            'month_working_states': OrderedDict(),  # 整月計算中間結果（手動修改時只更新受影響的日期）
+            'month_carries': OrderedDict(),  # 各月份月底跨到隔月的時段（隔月查詢的起始狀態）
         }
         
         for key, default_value in default_states.items():
@@ -125,11 +431,151 @@ class SessionStateManager:
     
     @staticmethod
     def clear_cache():
-        """清除快取並更新版本號"""
+        """清除快取並更新版本號（共用班表下次載入時會重新向來源確認）"""
         st.cache_data.clear()
+        TimeCalculator.clear_hours_cache()
+        QueryResultCache.instance().clear()
+        RosterRegistry.instance().expire_all()
+        SessionStateManager.mark_data_loaded()
+    
+    @staticmethod
+    def mark_data_loaded():
+        """更新快取版本號與資料載入時間"""
         st.session_state.cache_version += 1
         st.session_state.data_load_time = datetime.now()
     
+    @staticmethod
+    def get_roster() -> Optional['RosterEntry']:
+        """取得目前 session 使用的共用班表"""
+        handle = st.session_state.get('roster_handle')
+        if handle is None:
+            return None
+        return RosterRegistry.instance().get(handle)
+    
+    @staticmethod
+    def take_roster_warnings() -> List[str]:
+        """
+        取得目前班表版本建立時的警告（每個 session 每個版本只返回一次）
+        
+        班種字典可能在背景執行緒建立，警告由下一個開始查詢的 session 顯示。
+        
+        Returns:
+            尚未顯示的警告訊息
+        """
+        roster = SessionStateManager.get_roster()
+        if roster is None or not roster.warnings:
+            return []
+        shown_key = (roster.sheet_id, roster.version)
+        if st.session_state.roster_warnings_shown == shown_key:
+            return []
+        st.session_state.roster_warnings_shown = shown_key
+        return list(roster.warnings)
+    
+    @staticmethod
+    def sync_roster() -> bool:
+        """
+        背景更新完成後，將本 session 的參照切換到最新版本
+        
+        Returns:
+            是否切換了版本
+        """
+        handle = st.session_state.get('roster_handle')
+        if handle is None:
+            return False
+        
+        registry = RosterRegistry.instance()
+        current = registry.current(handle.sheet_id)
+        if current is None or current.version == handle.version:
+            return False
+        
+        SessionStateManager.switch_roster(registry.acquire(current))
+        return True
+    
+    @staticmethod
+    def switch_roster(handle: 'RosterHandle') -> Optional[RosterChange]:
+        """
+        切換本 session 使用的班表，並只讓受變更影響的查詢結果與預覽失效
+        
+        Args:
+            handle: 新班表的參照
+            
+        Returns:
+            與原班表的差異（原本未載入班表時為 None）
+        """
+        old_roster = SessionStateManager.get_roster()
+        st.session_state.roster_handle = handle
+        new_roster = SessionStateManager.get_roster()
+        
+        # 換用新的班表版本時清除時數解析快取（班種字典可能在背景執行緒建立，於此在主執行緒清除）
+        if new_roster is not None and new_roster is not old_roster:
+            TimeCalculator.clear_hours_cache()
+        
+        change = None
+        if old_roster is not None and new_roster is not None:
+            if old_roster is new_roster:
+                change = RosterChange()
+            else:
+                change = RosterDiff.compare(old_roster.df, old_roster.shift_dict, new_roster.df, new_roster.shift_dict)
+            SessionStateManager.invalidate_results(change)
+        
+        st.session_state.last_roster_change = change
+        st.session_state.month_shifts_cache.clear()
+        st.session_state.month_working_states.clear()
+        st.session_state.month_carries.clear()
+        SessionStateManager.mark_data_loaded()
+        return change
+    
+    @staticmethod
+    def invalidate_results(change: RosterChange):
+        """清除受班表變更影響的查詢結果與班表預覽（匯出以查詢結果為準，一併失效）"""
+        query_result = st.session_state.last_query_result
+        if query_result is not None and RosterDiff.affects(
+            change, query_result.target_personnel, query_result.year, query_result.month
+        ):
+            st.session_state.last_query_result = None
+        
+        team_result = st.session_state.last_team_result
+        if team_result is not None and any(
+            RosterDiff.affects(change, personnel, team_result.year, team_result.month)
+            for personnel in list(team_result.results) + team_result.missing
+        ):
+            st.session_state.last_team_result = None
+        
+        # 期間查詢可能包含多個月份與多份班表，有任何變更即重新查詢
+        if st.session_state.last_range_result is not None and (change.structural or change.affected):
+            st.session_state.last_range_result = None
+        
+        preview_data = st.session_state.preview_data
+        if preview_data is not None and RosterDiff.affects(
+            change, preview_data.personnel, preview_data.year, preview_data.month
+        ):
+            st.session_state.preview_data = None
+            st.session_state.editing_mode = False
+    
+    @staticmethod
+    def get_df() -> Optional[pd.DataFrame]:
+        """取得目前 session 使用的班表 DataFrame（共用唯讀，請勿修改）"""
+        roster = SessionStateManager.get_roster()
+        return roster.df if roster is not None else None
+    
+    @staticmethod
+    def get_shift_dict() -> Dict[str, ShiftInfo]:
+        """取得目前 session 使用的班種字典（共用唯讀，請勿修改）"""
+        roster = SessionStateManager.get_roster()
+        return roster.shift_dict if roster is not None else {}
+    
+    @staticmethod
+    def estimate_session_bytes() -> int:
+        """估算本 session 自有資料（手動班次、假日、預覽與查詢結果）的大小"""
+        overlay_keys = ['manual_shifts', 'custom_holidays', 'preview_data', 'last_query_result', 'last_team_result', 'last_range_result']
+        total = 0
+        for key in overlay_keys:
+            try:
+                total += len(pickle.dumps(st.session_state.get(key), protocol=5))
+            except (pickle.PicklingError, TypeError, AttributeError):
+                continue
+        return total
+    
     @staticmethod
     def get_manual_shift_key(personnel: str, year: int, month: int) -> str:
         """生成手動班次的key"""
@@ -145,6 +591,202 @@ class SessionStateManager:
                 return st.session_state.manual_shifts[key][date_str]
         return None
     
+    @staticmethod
+    def get_month_shifts(personnel: str, year: int, month: int, matching_columns: List[int]) -> 'MonthShifts':
+        """
+        取得整月有效班次（同一班表版本與手動設定下，查詢、預覽、編輯與匯出共用同一份結果）
+        
+        快取鍵包含該月手動設定的內容，手動設定被修改或刪除時自動重新計算。
+        
+        Args:
+            personnel: 人事號
+            year: 年份
+            month: 月份
+            matching_columns: 匹配的欄位列表
+            
+        Returns:
+            整月班次
+        """
+        df = SessionStateManager.get_df()
+        overrides = st.session_state.manual_shifts.get(SessionStateManager.get_manual_shift_key(personnel, year, month), {})
+        cache_key = (id(df), personnel, year, month, tuple(matching_columns), tuple(sorted(overrides.items())))
+        
+        cache = st.session_state.month_shifts_cache
+        month_shifts = cache.get(cache_key)
+        if month_shifts is None:
+            month_shifts = DataProcessor.resolve_month_shifts(df, personnel, year, month, matching_columns)
+            cache[cache_key] = month_shifts
+            while len(cache) > Config.MONTH_SHIFTS_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(cache_key)
+        return month_shifts
+    
+    @staticmethod
+    def get_team_month_shifts(team_columns: Dict[str, List[int]], year: int, month: int) -> Dict[str, 'MonthShifts']:
+        """
+        取得多位人員的整月有效班次（與 get_month_shifts 共用快取，未快取的人員一次以陣列運算取得）
+        
+        Args:
+            team_columns: {人事號: 匹配的欄位列表}
+            year: 年份
+            month: 月份
+            
+        Returns:
+            {人事號: 整月班次}（依 team_columns 順序）
+        """
+        df = SessionStateManager.get_df()
+        cache = st.session_state.month_shifts_cache
+        
+        cache_keys = {}
+        resolved = {}
+        for personnel, matching_columns in team_columns.items():
+            overrides = st.session_state.manual_shifts.get(SessionStateManager.get_manual_shift_key(personnel, year, month), {})
+            cache_key = (id(df), personnel, year, month, tuple(matching_columns), tuple(sorted(overrides.items())))
+            cache_keys[personnel] = cache_key
+            if cache_key in cache:
+                cache.move_to_end(cache_key)
+                resolved[personnel] = cache[cache_key]
+        
+        missing = {personnel: columns for personnel, columns in team_columns.items() if personnel not in resolved}
+        if missing:
+            for personnel, month_shifts in DataProcessor.resolve_team_month_shifts(df, missing, year, month).items():
+                cache[cache_keys[personnel]] = month_shifts
+                resolved[personnel] = month_shifts
+            while len(cache) > Config.MONTH_SHIFTS_CACHE_SIZE:
+                cache.popitem(last=False)
+        
+        return {personnel: resolved[personnel] for personnel in team_columns}
+    
+    @staticmethod
+    def get_month_carries(personnel_list: List[str], year: int, month: int) -> Dict[str, 'MonthCarry']:
+        """
+        取得多位人員該月份月底跨到隔月的時段（隔月計算的起始狀態）
+        
+        只在該月份另外登錄了月份班表時傳遞（RosterRegistry.carry_roster），其餘為空。
+        只需該月份班表最後一日的有效班次，不重算該月份；快取鍵包含月份班表版本，
+        並比對最後一日的手動設定，被修改或刪除時重新取得。
+        
+        Args:
+            personnel_list: 人事號列表
+            year: 年份
+            month: 月份
+            
+        Returns:
+            {人事號: 月底跨日時段}（依 personnel_list 順序；班表中找不到的人員為空）
+        """
+        roster = RosterRegistry.instance().carry_roster(year, month, SessionStateManager.get_roster())
+        if roster is None:
+            return {personnel: MonthCarry() for personnel in personnel_list}
+        
+        last_day = calendar.monthrange(year, month)[1]
+        cache = st.session_state.month_carries
+        
+        cache_keys = {}
+        carries = {}
+        for personnel in personnel_list:
+            cache_key = (roster.sheet_id, roster.version, personnel, year, month)
+            cache_keys[personnel] = cache_key
+            cached = cache.get(cache_key)
+            if cached is not None and cached[0] == SessionStateManager.get_manual_shift(personnel, year, month, last_day):
+                cache.move_to_end(cache_key)
+                carries[personnel] = cached[1]
+        
+        missing = [personnel for personnel in personnel_list if personnel not in carries]
+        if missing:
+            team_columns, _ = OvertimeCalculator._match_team_columns(roster.df, missing)
+            resolved = DataProcessor.resolve_team_month_carries(roster.df, roster.shift_dict, team_columns, year, month)
+            for personnel in missing:
+                carry = resolved.get(personnel, MonthCarry())
+                cache[cache_keys[personnel]] = (SessionStateManager.get_manual_shift(personnel, year, month, last_day), carry)
+                carries[personnel] = carry
+            while len(cache) > Config.MONTH_SHIFTS_CACHE_SIZE:
+                cache.popitem(last=False)
+        
+        return {personnel: carries[personnel] for personnel in personnel_list}
+    
+    @staticmethod
+    def get_month_working_state(personnel: str, year: int, month: int, matching_columns: List[int]) -> 'MonthWorkingState':
+        """
+        取得整月計算中間結果
+        
+        班表、匹配欄位或自定義假日變更時整月重建；只有手動設定不同時，
+        比對前後的手動設定，逐日更新有變更的日期；上月跨入的時段不同時只更新第 1 日。
+        
+        Args:
+            personnel: 人事號
+            year: 年份
+            month: 月份
+            matching_columns: 匹配的欄位列表
+            
+        Returns:
+            整月計算中間結果
+        """
+        source_key = (id(SessionStateManager.get_df()), tuple(matching_columns), st.session_state.holiday_version)
+        overrides = st.session_state.manual_shifts.get(SessionStateManager.get_manual_shift_key(personnel, year, month), {})
+        previous_year, previous_month = (year - 1, 12) if month == 1 else (year, month - 1)
+        carry_in = SessionStateManager.get_month_carries([personnel], previous_year, previous_month)[personnel]
+        
+        states = st.session_state.month_working_states
+        state_key = (personnel, year, month)
+        state = states.get(state_key)
+        
+        if state is None or state.source_key != source_key:
+            month_shifts = SessionStateManager.get_month_shifts(personnel, year, month, matching_columns)
+            state = OvertimeCalculator.build_working_state(month_shifts, SessionStateManager.get_shift_dict(), source_key,
+                                                           overrides, carry_in)
+            states[state_key] = state
+            while len(states) > Config.MONTH_SHIFTS_CACHE_SIZE:
+                states.popitem(last=False)
+        elif state.overrides != overrides:
+            shift_dict = SessionStateManager.get_shift_dict()
+            for date_str in set(state.overrides) | set(overrides):
+                if state.overrides.get(date_str) != overrides.get(date_str):
+                    day = int(date_str.rsplit("/", 1)[-1])
+                    if 1 <= day <= state.template.days_in_month:
+                        shift = overrides[date_str] if date_str in overrides else state.original[day - 1]
+                        OvertimeCalculator.update_working_state(state, day, shift, shift_dict)
+            state.overrides = dict(overrides)
+        
+        if state.carry_in != carry_in:
+            state.carry_in = carry_in
+            OvertimeCalculator.update_working_state(state, 1, state.effective[0], SessionStateManager.get_shift_dict())
+        
+        states.move_to_end(state_key)
+        return state
+    
+    @staticmethod
+    def set_custom_holiday(date_key: str, description: str):
+        """
+        設定自定義假日
+        
+        Args:
+            date_key: 日期（YYYY-MM-DD）
+            description: 日期類型描述（如 "補假(二)"）
+        """
+        st.session_state.custom_holidays[date_key] = description
+        SessionStateManager._holidays_changed()
+    
+    @staticmethod
+    def remove_custom_holiday(date_key: str) -> Optional[str]:
+        """移除自定義假日，返回原本的描述（不存在則為 None）"""
+        removed = st.session_state.custom_holidays.pop(date_key, None)
+        if removed is not None:
+            SessionStateManager._holidays_changed()
+        return removed
+    
+    @staticmethod
+    def _holidays_changed():
+        """自定義假日變更：遞增版本號並捨棄舊的假日日曆"""
+        st.session_state.holiday_version += 1
+        st.session_state.holiday_overlay = None
+    
+    @staticmethod
+    def clear_custom_holidays():
+        """清除所有自定義假日"""
+        st.session_state.custom_holidays.clear()
+        SessionStateManager._holidays_changed()
+    
     @staticmethod
     def set_manual_shift(personnel: str, year: int, month: int, day: int, shift: str):
         """設定手動班次"""
@@ -175,12 +817,27 @@ class DataLoader:
         Returns:
             CSV 格式的下載連結，如果格式不正確則返回 None
         """
+        sheet_id = DataLoader.extract_sheet_id(url)
+        if not sheet_id:
+            return None
+        return f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv"
+    
+    @staticmethod
+    def extract_sheet_id(url: str) -> Optional[str]:
+        """
+        從 Google Sheets URL 取出試算表 ID
+        
+        Args:
+            url: Google Sheets 分享連結
+            
+        Returns:
+            試算表 ID，如果格式不正確則返回 None
+        """
         if not url or '/d/' not in url:
             return None
             
         try:
-            sheet_id = url.split('/d/')[1].split('/')[0]
-            return f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv"
+            return url.split('/d/')[1].split('/')[0] or None
         except (IndexError, AttributeError):
             return None
     
@@ -207,155 +864,1498 @@ class DataLoader:
         return True, ""
     
     @staticmethod
-    @st.cache_data(ttl=300)  # 快取 5 分鐘
-    def load_data_from_urls(main_sheet_url: str, cache_version: int = 0) -> Tuple[Optional[pd.DataFrame], Optional[Dict], str]:
+    def fetch_csv_sources(sources: List[SourceFetchStatus], progress_bar=None, status_text=None) -> Dict[str, SourceFetchStatus]:
         """
-        從 URL 載入資料（帶快取功能）
+        並行下載多個 CSV 資料來源（條件式請求，內容有變更的來源會立即解析）
         
         Args:
-            main_sheet_url: 主要班表 URL
-            cache_version: 快取版本號（用於強制更新快取）
+            sources: 資料來源列表（含名稱、連結與讀取範圍）
+            progress_bar: 進度條元件（可選）
+            status_text: 狀態文字元件（可選）
             
         Returns:
-            (DataFrame, 班次字典, 狀態訊息)
+            {來源名稱: 下載結果}，未變更的來源不會預先解析
         """
+        statuses = {status.name: status for status in sources}
+        
+        with ThreadPoolExecutor(max_workers=max(1, len(statuses))) as executor:
+            pending = {executor.submit(DataLoader._download_and_parse, status) for status in statuses.values()}
+            
+            # 進度更新只在主執行緒進行（Streamlit 元件不可跨執行緒操作）
+            while pending:
+                finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                DataLoader._report_fetch_progress(statuses, progress_bar, status_text)
+        
+        return statuses
+    
+    @staticmethod
+    def combine_hashes(statuses: Dict[str, SourceFetchStatus]) -> str:
+        """計算所有來源內容的合併雜湊值"""
+        return hashlib.sha256(
+            "|".join(f"{name}:{statuses[name].content_hash}" for name in sorted(statuses)).encode()
+        ).hexdigest()
+    
+    @staticmethod
+    def parse_source(status: SourceFetchStatus) -> pd.DataFrame:
+        """取得來源的 DataFrame（未預先解析時才解析）"""
+        if status.frame is None:
+            status.frame = pd.read_csv(io.BytesIO(status.body))
+        return status.frame
+    
+    @staticmethod
+    def _download_and_parse(status: SourceFetchStatus):
+        """下載單一 CSV 來源，內容有變更時直接解析（於工作執行緒執行）"""
+        start_time = time.perf_counter()
         try:
-            # 進度條
-            progress_bar = st.progress(0)
-            status_text = st.empty()
+            SheetHttpCache.fetch(status)
+            if not status.unchanged:
+                DataLoader.parse_source(status)
+        except Exception as e:
+            status.error = str(e)
+            raise
+        finally:
+            status.elapsed = time.perf_counter() - start_time
+            status.done = True
+    
+    @staticmethod
+    def _report_fetch_progress(statuses: Dict[str, SourceFetchStatus], progress_bar=None, status_text=None):
+        """顯示各資料來源的實際下載進度"""
+        if progress_bar is None and status_text is None:
+            return
+        
+        finished_count = sum(1 for status in statuses.values() if status.done)
+        lines = []
+        for status in statuses.values():
+            size_kb = status.bytes_read / 1024
+            if status.error:
+                lines.append(f"❌ {status.name}: 失敗")
+            elif status.done and status.unchanged:
+                lines.append(f"✅ {status.name}: 未變更 ({status.elapsed:.2f}s)")
+            elif status.done:
+                lines.append(f"✅ {status.name}: {size_kb:.1f} KB ({status.elapsed:.2f}s)")
+            else:
+                lines.append(f"⏳ {status.name}: {size_kb:.1f} KB")
+        
+        if progress_bar is not None:
+            progress_bar.progress(int(finished_count / len(statuses) * 90))
+        if status_text is not None:
+            status_text.text("  ｜  ".join(lines))
+    
+    @staticmethod
+    def load_data_from_urls(main_sheet_url: str) -> Tuple[Optional['RosterHandle'], str]:
+        """
+        從 URL 載入資料（所有 session 共用同一份班表，員工班表與班種對照表並行下載）
+        
+        Args:
+            main_sheet_url: 主要班表 URL
             
+        Returns:
+            (共用班表參照, 狀態訊息)
+        """
+        try:
             # 驗證 URL
             is_valid, error_msg = DataLoader.validate_url_format(main_sheet_url)
             if not is_valid:
-                return None, None, f"❌ URL 驗證失敗: {error_msg}"
-            
-            status_text.text("🔄 正在轉換 URL...")
-            progress_bar.progress(10)
+                return None, f"❌ URL 驗證失敗: {error_msg}"
             
             main_csv_url = DataLoader.convert_google_sheet_url(main_sheet_url)
             shift_csv_url = DataLoader.convert_google_sheet_url(Config.DEFAULT_SHIFT_SHEET_URL)
             
             if not main_csv_url or not shift_csv_url:
-                return None, None, "❌ URL 轉換失敗"
-            
-            status_text.text("📊 正在讀取員工班表...")
-            progress_bar.progress(30)
-            
-            # 讀取員工班表
-            df_full = pd.read_csv(main_csv_url)
-            df = df_full.iloc[:Config.MAX_ROWS, :Config.MAX_COLS]  # 選取指定範圍
+                return None, "❌ URL 轉換失敗"
             
-            status_text.text("🔢 正在讀取班種對照表...")
-            progress_bar.progress(60)
+            sheet_id = DataLoader.extract_sheet_id(main_sheet_url)
+            registry = RosterRegistry.instance()
+            current = registry.current(sheet_id)
             
-            # 讀取班種對照表
-            shift_df = pd.read_csv(shift_csv_url)
+            # 冷啟動時先使用本機快照（視為已過期，下面會在背景更新）
+            if current is None:
+                snapshot = RosterSnapshotStore.load_latest(sheet_id)
+                if snapshot is not None:
+                    current = registry.publish(snapshot, verified=False)
             
-            status_text.text("🔨 正在建立班種字典...")
-            progress_bar.progress(80)
+            # 已有班表時立即使用；過期則在背景更新，更新失敗仍保留舊資料
+            if current is not None:
+                if not registry.is_expired(sheet_id):
+                    return registry.acquire(current), DataLoader._loaded_message(current.df, "✅ 已使用共用班表")
+                
+                DataLoader.refresh_in_background(sheet_id, main_csv_url, shift_csv_url)
+                return registry.acquire(current), DataLoader._loaded_message(
+                    current.df, f"✅ 已使用 {current.loaded_at.strftime('%Y-%m-%d %H:%M:%S')} 的班表，背景更新中。"
+                )
             
-            # 建立班種字典
-            shift_dict = DataProcessor.build_shift_dictionary(shift_df)
+            # 進度條
+            progress_bar = st.progress(0)
+            status_text = st.empty()
             
-            status_text.text("✅ 資料載入完成！")
-            progress_bar.progress(100)
+            # 同一試算表同時有多個載入時，只有第一個實際下載，其餘等待並共用結果
+            (entry, changed), shared = SingleFlight.instance().do(
+                ("roster", sheet_id),
+                lambda: DataLoader._revalidate(registry, sheet_id, main_csv_url, shift_csv_url, progress_bar, status_text)
+            )
             
-            # 清理進度顯示
-            time.sleep(0.5)
             progress_bar.empty()
             status_text.empty()
             
-            # 資料驗證
-            personnel_count = DataValidator.count_allowed_personnel(df)
-            
-            return df, shift_dict, f"✅ 資料讀取成功！班表: {df.shape}, 指定人員: {personnel_count} 人"
+            if shared:
+                prefix = "✅ 已共用同時進行的載入結果"
+            elif changed:
+                prefix = "✅ 資料讀取成功！"
+            else:
+                prefix = "✅ 資料未變更"
+            return registry.acquire(entry), DataLoader._loaded_message(entry.df, prefix)
             
         except pd.errors.EmptyDataError:
-            return None, None, "❌ 資料檔案為空或格式不正確"
+            return None, "❌ 資料檔案為空或格式不正確"
         except pd.errors.ParserError as e:
-            return None, None, f"❌ 資料解析失敗: 檔案格式可能有問題"
+            return None, f"❌ 資料解析失敗: 檔案格式可能有問題"
         except Exception as e:
-            return None, None, f"❌ 資料讀取失敗: {str(e)}"
-
-class DataProcessor:
-    """資料處理相關功能"""
+            return None, f"❌ 資料讀取失敗: {str(e)}"
     
     @staticmethod
-    def build_shift_dictionary(shift_df: pd.DataFrame) -> Dict[str, ShiftInfo]:
+    def _loaded_message(df: pd.DataFrame, prefix: str) -> str:
+        """產生載入結果訊息"""
+        personnel_count = DataValidator.count_allowed_personnel(df)
+        return f"{prefix} 班表: {df.shape}, 指定人員: {personnel_count} 人"
+    
+    @staticmethod
+    def _fetch_and_build(sheet_id: str, main_csv_url: str, shift_csv_url: str, progress_bar=None, status_text=None,
+                         known_hash: Optional[str] = None) -> Optional[RosterSnapshot]:
         """
-        建立班種字典
+        並行下載兩張表並建立班表與班種字典
+        
+        內容雜湊值與既有快照相同時（304 或內容未變），直接使用快照，
+        完全略過 CSV 解析與 build_shift_dictionary。
         
         Args:
-            shift_df: 班種對照表 DataFrame
+            sheet_id: 試算表 ID
+            main_csv_url: 員工班表 CSV 連結
+            shift_csv_url: 班種對照表 CSV 連結
+            progress_bar: 進度條元件（可選）
+            status_text: 狀態文字元件（可選）
+            known_hash: 呼叫端已持有版本的雜湊值（相同時返回 None）
             
         Returns:
-            班種字典
+            班表快照，內容與 known_hash 相同則返回 None
         """
-        shift_dict = {}
+        statuses = DataLoader.fetch_csv_sources([
+            SourceFetchStatus(name="員工班表", url=main_csv_url, max_rows=Config.MAX_ROWS, max_cols=Config.MAX_COLS),
+            SourceFetchStatus(name="班種對照表", url=shift_csv_url, max_cols=Config.SHIFT_TABLE_COLS),
+        ], progress_bar, status_text)
+        content_hash = DataLoader.combine_hashes(statuses)
         
-        for index, row in shift_df.iterrows():
-            try:
-                shift_type = str(row.iloc[0]).strip()
-                if not shift_type or shift_type == 'nan':
-                    continue
-                    
-                overtime_hours_1 = row.iloc[1] if len(row) > 1 else None
-                overtime_hours_2 = row.iloc[2] if len(row) > 2 else None
-                cross_day_hours = row.iloc[3] if len(row) > 3 else None
-                
-                shift_dict[shift_type] = ShiftInfo(
-                    shift_type=shift_type,
-                    overtime_hours_1=overtime_hours_1,
-                    overtime_hours_2=overtime_hours_2,
-                    cross_day_hours=cross_day_hours
-                )
-            except (IndexError, ValueError) as e:
-                st.warning(f"⚠️ 班種資料第 {index+1} 行格式異常，已跳過")
-                continue
+        if content_hash == known_hash:
+            return None
+        
+        snapshot = RosterSnapshotStore.load(sheet_id, content_hash)
+        if snapshot is not None:
+            return snapshot
+        
+        df = DataLoader.parse_source(statuses["員工班表"]).iloc[:Config.MAX_ROWS, :Config.MAX_COLS]  # 下載時已限制範圍
+        
+        if status_text is not None:
+            status_text.text("🔨 正在建立班種字典...")
+        
+        shift_dict, warnings = DataProcessor.build_shift_dictionary(DataLoader.parse_source(statuses["班種對照表"]))
         
-        return shift_dict
+        snapshot = RosterSnapshot(
+            sheet_id=sheet_id,
+            content_hash=content_hash,
+            df=df,
+            shift_dict=shift_dict,
+            saved_at=datetime.now(),
+            warnings=tuple(warnings)
+        )
+        RosterSnapshotStore.save(snapshot)
+        return snapshot
     
     @staticmethod
-    def find_matching_personnel_columns(df: pd.DataFrame, target_personnel: str) -> List[int]:
+    def _revalidate(registry: 'RosterRegistry', sheet_id: str, main_csv_url: str, shift_csv_url: str,
+                    progress_bar=None, status_text=None) -> Tuple['RosterEntry', bool]:
         """
-        查找匹配的人事號欄位
+        向來源確認班表是否更新，有變更時登錄新版本
         
         Args:
-            df: 班表 DataFrame
-            target_personnel: 目標人事號
+            registry: 共用班表庫
+            sheet_id: 試算表 ID
+            main_csv_url: 員工班表 CSV 連結
+            shift_csv_url: 班種對照表 CSV 連結
+            progress_bar: 進度條元件（可選）
+            status_text: 狀態文字元件（可選）
             
         Returns:
-            匹配的欄位索引列表
+            (最新的共用班表, 是否有變更)
         """
-        personnel_numbers = df.iloc[1, :].tolist()
-        matching_columns = []
+        current = registry.current(sheet_id)
+        snapshot = DataLoader._fetch_and_build(
+            sheet_id, main_csv_url, shift_csv_url, progress_bar, status_text,
+            known_hash=current.version if current is not None else None
+        )
         
-        for col_idx, personnel_num in enumerate(personnel_numbers):
-            if pd.notna(personnel_num) and str(personnel_num).strip() == target_personnel:
-                matching_columns.append(col_idx)
+        if snapshot is None:
+            # 來源內容未變更，沿用現有共用班表
+            registry.touch(sheet_id)
+            return current, False
         
-        return matching_columns
+        return registry.publish(snapshot), True
     
     @staticmethod
-    def get_personnel_options(df: pd.DataFrame) -> List[str]:
+    def refresh_in_background(sheet_id: str, main_csv_url: str, shift_csv_url: str):
         """
-        取得指定人事號選項列表
+        在背景執行緒向來源確認班表是否更新，有變更時寫入新的快照並登錄新版本
+        （stale-while-revalidate：更新期間與更新失敗時都繼續提供舊版本）
         
         Args:
-            df: 班表 DataFrame
-            
-        Returns:
-            指定人事號選項列表
+            sheet_id: 試算表 ID
+            main_csv_url: 員工班表 CSV 連結
+            shift_csv_url: 班種對照表 CSV 連結
         """
-        personnel_numbers = df.iloc[1, :].tolist()
-        personnel_options = []
+        # 背景執行緒沒有 Streamlit 執行環境，先在主執行緒取得共用物件
+        registry = RosterRegistry.instance()
+        single_flight = SingleFlight.instance()
+        key = ("roster", sheet_id)
+        if single_flight.in_flight(key):
+            return
         
-        for i, num in enumerate(personnel_numbers):
-            if pd.notna(num) and str(num).strip() in Config.ALLOWED_PERSONNEL:
-                col_name = DataProcessor.get_column_name(i)
-                personnel_options.append(f"{num} (Column {col_name})")
+        def refresh():
+            try:
+                single_flight.do(
+                    key, lambda: DataLoader._revalidate(registry, sheet_id, main_csv_url, shift_csv_url)
+                )
+            except Exception as e:
+                # 背景更新失敗時保留舊版本，只記錄錯誤
+                registry.record_refresh_error(sheet_id, str(e))
+        
+        threading.Thread(target=refresh, name=f"snapshot-refresh-{sheet_id}", daemon=True).start()
+
+class SingleFlight:
+    """
+    合併同時進行的相同工作：同一個 key 只執行一次，
+    其他呼叫者等待並共用結果（含例外）
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Any, Dict[str, Any]] = {}
+        self._stats = {'calls': 0, 'executions': 0, 'coalesced': 0}
+    
+    @staticmethod
+    @st.cache_resource
+    def instance() -> 'SingleFlight':
+        """取得行程內唯一的合併器"""
+        return SingleFlight()
+    
+    def in_flight(self, key: Any) -> bool:
+        """指定 key 是否正在執行"""
+        with self._lock:
+            return key in self._in_flight
+    
+    def do(self, key: Any, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        執行工作，同一 key 已在執行時等待其結果
+        
+        Args:
+            key: 工作識別鍵
+            fn: 實際執行的工作
+            
+        Returns:
+            (工作結果, 是否為共用他人的結果)
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._in_flight.get(key)
+            if call is not None:
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._in_flight[key] = call
+                self._stats['executions'] += 1
+                leader = True
         
-        return personnel_options
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+        
+        try:
+            call['result'] = fn()
+            return call['result'], False
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call['done'].set()
+    
+    def stats(self) -> Dict[str, int]:
+        """呼叫次數、實際執行次數與被合併的次數"""
+        with self._lock:
+            return dict(self._stats)
+
+class RosterSnapshotStore:
+    """班表本機快照（以試算表 ID 與內容雜湊值為鍵，伺服器重啟後仍可使用）"""
+    
+    @staticmethod
+    def _snapshot_path(sheet_id: str, content_hash: str) -> str:
+        return os.path.join(Config.SNAPSHOT_DIR, f"{sheet_id}-v{Config.SNAPSHOT_FORMAT_VERSION}-{content_hash}.pkl")
+    
+    @staticmethod
+    def _index_path(sheet_id: str) -> str:
+        return os.path.join(Config.SNAPSHOT_DIR, f"{sheet_id}.json")
+    
+    @staticmethod
+    def load_latest(sheet_id: Optional[str]) -> Optional[RosterSnapshot]:
+        """
+        讀取指定試算表的最新快照
+        
+        Args:
+            sheet_id: 試算表 ID
+            
+        Returns:
+            快照物件，沒有可用快照則返回 None
+        """
+        if not sheet_id:
+            return None
+        
+        try:
+            with open(RosterSnapshotStore._index_path(sheet_id), encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("format_version") != Config.SNAPSHOT_FORMAT_VERSION:
+                return None
+        except (OSError, ValueError):
+            return None
+        
+        return RosterSnapshotStore.load(sheet_id, index.get("latest"))
+    
+    @staticmethod
+    def load(sheet_id: Optional[str], content_hash: Optional[str]) -> Optional[RosterSnapshot]:
+        """
+        讀取指定內容雜湊值的快照
+        
+        Args:
+            sheet_id: 試算表 ID
+            content_hash: 兩張表內容的合併雜湊值
+            
+        Returns:
+            快照物件，不存在則返回 None
+        """
+        if not sheet_id or not content_hash:
+            return None
+        
+        try:
+            with open(RosterSnapshotStore._snapshot_path(sheet_id, content_hash), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, AttributeError, EOFError):
+            return None
+    
+    @staticmethod
+    def save(snapshot: RosterSnapshot) -> bool:
+        """
+        寫入快照並更新最新版本索引（先寫暫存檔再替換，避免讀到寫一半的檔案）
+        
+        Args:
+            snapshot: 班表快照
+            
+        Returns:
+            是否寫入成功
+        """
+        sheet_id, content_hash = snapshot.sheet_id, snapshot.content_hash
+        if not sheet_id:
+            return False
+        
+        try:
+            os.makedirs(Config.SNAPSHOT_DIR, exist_ok=True)
+            snapshot_path = RosterSnapshotStore._snapshot_path(sheet_id, content_hash)
+            RosterSnapshotStore._atomic_write(snapshot_path, pickle.dumps(snapshot, protocol=5))
+            
+            index_path = RosterSnapshotStore._index_path(sheet_id)
+            history = []
+            try:
+                with open(index_path, encoding="utf-8") as f:
+                    history = json.load(f).get("history", [])
+            except (OSError, ValueError):
+                pass
+            
+            history = [h for h in history if h != content_hash] + [content_hash]
+            for old_hash in history[:-Config.SNAPSHOT_KEEP_PER_SHEET]:
+                try:
+                    os.remove(RosterSnapshotStore._snapshot_path(sheet_id, old_hash))
+                except OSError:
+                    pass
+            history = history[-Config.SNAPSHOT_KEEP_PER_SHEET:]
+            
+            index = {
+                "format_version": Config.SNAPSHOT_FORMAT_VERSION,
+                "latest": content_hash,
+                "history": history,
+            }
+            RosterSnapshotStore._atomic_write(index_path, json.dumps(index).encode("utf-8"))
+            return True
+        except (OSError, pickle.PicklingError):
+            return False
+    
+    @staticmethod
+    def _atomic_write(path: str, data: bytes):
+        """寫入暫存檔後以 os.replace 原子替換"""
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+class SheetHttpCache:
+    """條件式 HTTP 下載（保存 ETag / Last-Modified 與上次內容，未變更時不重新下載）"""
+    
+    @staticmethod
+    def _entry_paths(status: SourceFetchStatus) -> Tuple[str, str]:
+        # 讀取範圍不同時保存的內容也不同，因此納入快取鍵
+        key_source = f"{status.url}|{status.max_rows}|{status.max_cols}"
+        key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()[:32]
+        return (os.path.join(Config.HTTP_CACHE_DIR, f"{key}.json"),
+                os.path.join(Config.HTTP_CACHE_DIR, f"{key}.body"))
+    
+    @staticmethod
+    def _load_entry(status: SourceFetchStatus) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        """讀取已保存的驗證資訊與內容"""
+        meta_path, body_path = SheetHttpCache._entry_paths(status)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return {}, None
+    
+    @staticmethod
+    def _store_entry(status: SourceFetchStatus, meta: Dict[str, Any], body: bytes):
+        """保存驗證資訊與內容（失敗不影響本次下載結果）"""
+        meta_path, body_path = SheetHttpCache._entry_paths(status)
+        try:
+            os.makedirs(Config.HTTP_CACHE_DIR, exist_ok=True)
+            RosterSnapshotStore._atomic_write(body_path, body)
+            RosterSnapshotStore._atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+        except OSError:
+            pass
+    
+    @staticmethod
+    def load_cached(status: SourceFetchStatus) -> bool:
+        """
+        不連線，直接使用上次下載保存的內容
+        
+        Args:
+            status: 資料來源下載狀態
+            
+        Returns:
+            是否有保存的內容
+        """
+        meta, cached_body = SheetHttpCache._load_entry(status)
+        if cached_body is None:
+            return False
+        status.body = cached_body
+        status.content_hash = meta.get("content_hash") or hashlib.sha256(cached_body).hexdigest()
+        status.unchanged = True
+        status.done = True
+        return True
+    
+    @staticmethod
+    def fetch(status: SourceFetchStatus):
+        """
+        以條件式請求下載資料來源，結果寫回 status
+        
+        收到 304，或 200 但內容雜湊值與上次相同時，status.unchanged 為 True，
+        status.body 為保存在磁碟上的上次內容。
+        
+        Args:
+            status: 資料來源下載狀態
+        """
+        meta, cached_body = SheetHttpCache._load_entry(status)
+        
+        headers = {}
+        if cached_body is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        
+        def read_body(response) -> Tuple[Optional[bytes], Any]:
+            if response.status_code == 304 and cached_body is not None:
+                return None, response.headers
+            status.bytes_read = 0  # 讀取中斷重新下載時重新計算
+            if status.max_rows is None and status.max_cols is None:
+                return b"".join(SheetHttpCache._iter_chunks(response, status)), response.headers
+            return SheetHttpCache._read_bounded_csv(response, status), response.headers
+        
+        body, headers = sheet_http_client.stream_body(status.url, read_body, headers=headers)
+        if body is None:
+            status.body = cached_body
+            status.content_hash = meta.get("content_hash") or hashlib.sha256(cached_body).hexdigest()
+            status.unchanged = True
+            return
+        
+        status.body = body
+        status.content_hash = hashlib.sha256(status.body).hexdigest()
+        status.unchanged = status.content_hash == meta.get("content_hash")
+        
+        SheetHttpCache._store_entry(status, {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "content_hash": status.content_hash,
+            "fetched_at": datetime.now().isoformat(timespec="seconds"),
+        }, status.body)
+    
+    @staticmethod
+    def _iter_chunks(response, status: SourceFetchStatus):
+        """逐塊讀取回應內容並累計已下載位元組數"""
+        for chunk in response.iter_content(Config.FETCH_CHUNK_SIZE):
+            status.bytes_read += len(chunk)
+            yield chunk
+    
+    @staticmethod
+    def _iter_lines(response, status: SourceFetchStatus):
+        """將回應內容逐行解碼（保留換行字元，供 csv.reader 處理跨行欄位）"""
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        pending = ""
+        for chunk in SheetHttpCache._iter_chunks(response, status):
+            pending += decoder.decode(chunk)
+            # 只以 \n 分行（欄位內可能含其他換行類字元），最後一段可能尚未完整，保留到下一塊
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                yield line + "\n"
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield pending
+    
+    @staticmethod
+    def _read_bounded_csv(response, status: SourceFetchStatus) -> bytes:
+        """
+        串流讀取 CSV，只保留標題列、前 max_rows 筆資料與前 max_cols 欄，
+        讀滿後立即停止，不再下載剩餘內容
+        
+        空白行與 pd.read_csv 相同不計入筆數。
+        
+        Args:
+            response: HTTP 回應
+            status: 資料來源下載狀態（含讀取範圍）
+            
+        Returns:
+            範圍內的 CSV 內容
+        """
+        return SheetHttpCache.write_bounded_records(
+            csv.reader(SheetHttpCache._iter_lines(response, status)), status.max_rows, status.max_cols
+        )
+    
+    @staticmethod
+    def write_bounded_records(records, max_rows: Optional[int], max_cols: Optional[int]) -> bytes:
+        """
+        將 CSV 記錄寫回 CSV 內容，只保留標題列、前 max_rows 筆資料與前 max_cols 欄
+        
+        Args:
+            records: CSV 記錄（每筆為字串列表），讀滿後不再取用
+            max_rows: 資料筆數上限（None 表示不限）
+            max_cols: 欄數上限（None 表示不限）
+            
+        Returns:
+            範圍內的 CSV 內容
+        """
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        row_limit = None if max_rows is None else max_rows + 1  # 含標題列
+        rows_written = 0
+        
+        for record in records:
+            if not record:
+                continue
+            writer.writerow(record if max_cols is None else record[:max_cols])
+            rows_written += 1
+            if row_limit is not None and rows_written >= row_limit:
+                break
+        
+        return output.getvalue().encode("utf-8")
+
+class LocalRosterIngest:
+    """
+    離線匯入本機班表檔案（CSV / XLSX），可一次匯入多個月份
+    
+    每個檔案以「local-<年月>」登錄為共用班表庫中的一個版本，不需連線；
+    XLSX 以 openpyxl 唯讀串流模式讀取，讀到班表範圍為止。
+    """
+    
+    PERIOD_PATTERN = re.compile(r'(20\d{2})\D{0,2}?(1[0-2]|0?[1-9])(?!\d)')
+    
+    @staticmethod
+    def is_shift_table(name: str) -> bool:
+        """檔名是否為班種對照表"""
+        lowered = name.lower()
+        return any(keyword in lowered for keyword in Config.LOCAL_SHIFT_TABLE_KEYWORDS)
+    
+    @staticmethod
+    def parse_period(name: str) -> Optional[str]:
+        """
+        由檔名判斷班表月份（如 2025-01、202501、2025年1月）
+        
+        Args:
+            name: 檔名
+            
+        Returns:
+            YYYY-MM，無法判斷時返回 None
+        """
+        match = LocalRosterIngest.PERIOD_PATTERN.search(os.path.splitext(os.path.basename(name))[0])
+        if match is None:
+            return None
+        return f"{match.group(1)}-{int(match.group(2)):02d}"
+    
+    @staticmethod
+    def directory_sources(directory: str) -> List[Tuple[str, Callable[[], bytes]]]:
+        """
+        列出資料夾內的班表檔案（依檔名排序）
+        
+        Args:
+            directory: 資料夾路徑
+            
+        Returns:
+            [(檔名, 讀取函式)]，檔案內容在匯入的工作執行緒中才讀取
+        """
+        sources = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and name.lower().endswith(Config.LOCAL_ROSTER_EXTENSIONS):
+                sources.append((name, lambda path=path: LocalRosterIngest._read_file(path)))
+        return sources
+    
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        """讀取檔案內容"""
+        with open(path, "rb") as f:
+            return f.read()
+    
+    @staticmethod
+    def read_frame(name: str, data: bytes, max_rows: Optional[int], max_cols: Optional[int]) -> pd.DataFrame:
+        """
+        讀取 CSV / XLSX 的指定範圍
+        
+        兩種格式都先轉為與雲端下載相同的 CSV 內容再由 pd.read_csv 解析，
+        欄位型別與欄名處理與雲端班表一致。
+        
+        Args:
+            name: 檔名（依副檔名判斷格式）
+            data: 檔案內容
+            max_rows: 資料筆數上限（None 表示不限）
+            max_cols: 欄數上限（None 表示不限）
+            
+        Returns:
+            範圍內的 DataFrame
+        """
+        if name.lower().endswith(".xlsx"):
+            records = LocalRosterIngest._iter_xlsx_records(data, max_rows, max_cols)
+        else:
+            records = csv.reader(LocalRosterIngest._decode_text(data))
+        return pd.read_csv(io.BytesIO(SheetHttpCache.write_bounded_records(records, max_rows, max_cols)))
+    
+    @staticmethod
+    def _decode_text(data: bytes) -> io.StringIO:
+        """解碼 CSV 內容（UTF-8，Excel 另存的 Big5 檔案亦可）"""
+        try:
+            text = data.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            text = data.decode("cp950")
+        return io.StringIO(text, newline="")
+    
+    @staticmethod
+    def _iter_xlsx_records(data: bytes, max_rows: Optional[int], max_cols: Optional[int]):
+        """以唯讀串流模式逐列讀取第一個工作表（含標題列），只讀到範圍為止"""
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        try:
+            worksheet = workbook.worksheets[0]
+            max_row = None if max_rows is None else max_rows + 1
+            for row in worksheet.iter_rows(max_row=max_row, max_col=max_cols, values_only=True):
+                yield [LocalRosterIngest._format_cell(value) for value in row]
+        finally:
+            workbook.close()
+    
+    @staticmethod
+    def _format_cell(value: Any) -> str:
+        """將儲存格值轉為與 Google Sheets CSV 匯出相近的文字"""
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return "TRUE" if value else "FALSE"
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        if isinstance(value, datetime):
+            if value.time() == dt_time.min:
+                return value.strftime("%Y/%m/%d")
+            return value.strftime("%Y/%m/%d %H:%M:%S")
+        if isinstance(value, dt_time):
+            return value.strftime("%H:%M:%S" if value.second else "%H:%M")
+        return str(value)
+    
+    @staticmethod
+    def load_shift_dictionary(shift_sources: List[Tuple[str, Callable[[], bytes]]]
+                              ) -> Tuple[Optional[Dict[str, ShiftInfo]], Optional[str], str, List[str]]:
+        """
+        取得班種字典：優先使用一併匯入的班種對照表，否則使用上次下載保存的預設班種對照表
+        
+        Args:
+            shift_sources: 檔名判斷為班種對照表的檔案
+            
+        Returns:
+            (班種字典, 內容雜湊值, 來源說明, 警告訊息列表)，找不到班種對照表時字典為 None
+        """
+        if shift_sources:
+            name, read = shift_sources[-1]
+            data = read()
+            shift_df = LocalRosterIngest.read_frame(name, data, None, Config.SHIFT_TABLE_COLS)
+            shift_dict, warnings = DataProcessor.build_shift_dictionary(shift_df)
+            return shift_dict, hashlib.sha256(data).hexdigest(), name, warnings
+        
+        status = SourceFetchStatus(
+            name="班種對照表",
+            url=DataLoader.convert_google_sheet_url(Config.DEFAULT_SHIFT_SHEET_URL),
+            max_cols=Config.SHIFT_TABLE_COLS
+        )
+        if not SheetHttpCache.load_cached(status):
+            return None, None, "", []
+        shift_dict, warnings = DataProcessor.build_shift_dictionary(DataLoader.parse_source(status))
+        return shift_dict, status.content_hash, "上次下載的預設班種對照表", warnings
+    
+    @staticmethod
+    def ingest(sources: List[Tuple[str, Callable[[], bytes]]], progress_bar=None, status_text=None) -> Tuple[List[LocalIngestResult], str]:
+        """
+        並行匯入多個班表檔案，每個檔案登錄為共用班表庫的一個版本
+        
+        Args:
+            sources: [(檔名, 讀取函式)]
+            progress_bar: 進度條元件（可選）
+            status_text: 狀態文字元件（可選）
+            
+        Returns:
+            (依月份排序的匯入結果, 狀態訊息)
+        """
+        shift_sources = [source for source in sources if LocalRosterIngest.is_shift_table(source[0])]
+        roster_sources = [source for source in sources if not LocalRosterIngest.is_shift_table(source[0])]
+        if not roster_sources:
+            return [], "❌ 沒有可匯入的班表檔案"
+        
+        # 班種字典只建立一次，所有月份共用
+        shift_dict, shift_hash, shift_label, shift_warnings = LocalRosterIngest.load_shift_dictionary(shift_sources)
+        if shift_dict is None:
+            return [], "❌ 找不到班種對照表：請一併匯入檔名含「班種」的檔案，或先載入一次雲端班表"
+        
+        registry = RosterRegistry.instance()
+        results = [LocalIngestResult(name=name, period=LocalRosterIngest.parse_period(name)) for name, _ in roster_sources]
+        
+        with ThreadPoolExecutor(max_workers=min(Config.LOCAL_INGEST_MAX_WORKERS, len(roster_sources))) as executor:
+            pending = {
+                executor.submit(LocalRosterIngest._ingest_one, registry, result, read, shift_dict, shift_hash, shift_warnings)
+                for result, (_, read) in zip(results, roster_sources)
+            }
+            while pending:
+                finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                done_count = len(results) - len(pending)
+                if progress_bar is not None:
+                    progress_bar.progress(int(done_count / len(results) * 100))
+                if status_text is not None:
+                    status_text.text(f"📂 已匯入 {done_count} / {len(results)} 個檔案")
+        
+        results.sort(key=lambda result: (result.period or "", result.name))
+        success_count = sum(1 for result in results if result.error is None)
+        return results, f"✅ 已匯入 {success_count} / {len(results)} 個班表檔案（班種對照表: {shift_label}）"
+    
+    @staticmethod
+    def _ingest_one(registry: 'RosterRegistry', result: LocalIngestResult, read: Callable[[], bytes],
+                    shift_dict: Dict[str, ShiftInfo], shift_hash: str, shift_warnings: List[str]):
+        """讀取單一班表檔案並登錄（於工作執行緒執行，錯誤記錄在 result）"""
+        start_time = time.perf_counter()
+        try:
+            data = read()
+            df = LocalRosterIngest.read_frame(result.name, data, Config.MAX_ROWS, Config.MAX_COLS)
+            stem = os.path.splitext(result.name)[0]
+            snapshot = RosterSnapshot(
+                sheet_id=f"local-{result.period or stem}",
+                content_hash=hashlib.sha256(f"{hashlib.sha256(data).hexdigest()}|{shift_hash}".encode()).hexdigest(),
+                df=df,
+                shift_dict=shift_dict,
+                saved_at=datetime.now(),
+                warnings=tuple(shift_warnings)
+            )
+            entry = registry.publish(snapshot, period=result.period)
+            result.sheet_id = entry.sheet_id
+            result.version = entry.version
+            result.shape = df.shape
+        except Exception as e:
+            result.error = str(e)
+        finally:
+            result.elapsed = time.perf_counter() - start_time
+
+@dataclass(frozen=True)
+class RosterIndex:
+    """班表人事號索引（每個班表版本只建立一次）"""
+    columns: Dict[str, Tuple[int, ...]]  # 人事號 -> 欄位索引
+    personnel_options: Tuple[str, ...]  # 指定人員選項（依欄位順序，如 "A30825 (Column D)"）
+    allowed_column_count: int  # 人事號屬於指定人員的欄位數
+
+@dataclass(frozen=True)
+class ShiftMatrix:
+    """班表班次代碼矩陣（每個班表版本只建立一次）"""
+    codes: np.ndarray  # int32 [日期 - 1, 欄位]，0 表示空白（休假）
+    code_table: Tuple[str, ...]  # 代碼 -> 班次（代碼 0 為空字串）
+    code_ids: Dict[str, int]  # 班次 -> 代碼
+    memory_bytes: int
+
+@dataclass(frozen=True)
+class MonthShifts:
+    """單一人員整月的班次（索引 0 為第 1 日）"""
+    personnel: str
+    year: int
+    month: int
+    original_codes: np.ndarray  # 班表原始班次代碼（int32，0 表示休假）
+    effective_codes: np.ndarray  # 套用手動設定後的班次代碼
+    manual_mask: np.ndarray  # 該日是否有手動設定（bool）
+    code_table: Tuple[str, ...]  # 代碼 -> 班次
+    original: Tuple[str, ...]  # 原始班次（空字串表示休假）
+    effective: Tuple[str, ...]  # 有效班次（空字串表示休假）
+
+@dataclass(frozen=True)
+class CalendarTable:
+    """預先計算的日曆（Config.MIN_YEAR 至 MAX_YEAR，每日一格）"""
+    first_year: int
+    month_offsets: np.ndarray  # int32 [(年 - first_year) * 12 + 月 - 1] -> 該月 1 日的格位
+    month_lengths: np.ndarray  # int8 同上 -> 該月天數
+    weekdays: np.ndarray  # int8 [格位] -> 星期（0 為週一）
+    is_weekend: np.ndarray  # bool [格位]
+    labels: np.ndarray  # object [格位] -> 日期類型描述（如 "平日(一)"）
+
+@dataclass(frozen=True)
+class HolidayOverlay:
+    """套用 session 自定義假日後的日曆（自定義假日變更後重建）"""
+    version: int  # 建立時的 holiday_version
+    table: CalendarTable
+    is_weekend: np.ndarray
+    labels: np.ndarray
+
+@dataclass
+class RosterEntry:
+    """共用班表資料類別（所有 session 唯讀共用）"""
+    sheet_id: str
+    version: str
+    df: pd.DataFrame
+    shift_dict: Dict[str, ShiftInfo]
+    loaded_at: datetime
+    refcount: int = 0
+    memory_bytes: int = 0
+    index: Optional[RosterIndex] = None
+    matrix: Optional[ShiftMatrix] = None
+    shift_table_hash: str = ""  # 班種對照表內容的雜湊值
+    warnings: Tuple[str, ...] = ()  # 建立班種字典時的警告（各 session 下次查詢時顯示一次）
+
+class RosterHandle:
+    """session 持有的共用班表參照，session 被回收時自動釋放引用計數"""
+    
+    def __init__(self, registry: 'RosterRegistry', sheet_id: str, version: str):
+        self.sheet_id = sheet_id
+        self.version = version
+        weakref.finalize(self, registry.release, (sheet_id, version))
+
+class RosterRegistry:
+    """
+    跨 session 共用的班表庫（以試算表 ID 與版本為鍵）
+    
+    各 session 只保存 RosterHandle 與自己的手動班次、假日設定；
+    沒有 session 使用的舊版本依最近使用順序淘汰。月份班表（本機匯入）永遠是最新版本，
+    沒有 session 使用的超過 Config.ROSTER_REGISTRY_MAX_IDLE_PERIODS 份時連同月份登錄一起淘汰，
+    也可以 unregister 移除。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, str], RosterEntry]' = OrderedDict()
+        self._current: Dict[str, str] = {}  # 試算表 ID -> 最新版本
+        self._checked_at: Dict[str, datetime] = {}  # 試算表 ID -> 最後向來源確認的時間
+        self._refresh_errors: Dict[str, str] = {}  # 試算表 ID -> 最近一次背景更新的錯誤
+        self._expired_at: Optional[datetime] = None  # 此時間之前的確認一律視為過期
+        self._periods: Dict[str, str] = {}  # 班表月份 (YYYY-MM) -> 試算表 ID
+        self._frames: Dict[int, RosterEntry] = {}  # id(班表 DataFrame) -> 共用班表（供以 DataFrame 取得索引）
+    
+    @staticmethod
+    @st.cache_resource
+    def instance() -> 'RosterRegistry':
+        """取得行程內唯一的共用班表庫"""
+        return RosterRegistry()
+    
+    def publish(self, snapshot: RosterSnapshot, verified: bool = True, period: Optional[str] = None) -> RosterEntry:
+        """
+        登錄新版本並以單一步驟切換為該試算表的最新版本
+        
+        Args:
+            snapshot: 班表快照
+            verified: 是否剛向來源確認過（本機快照為 False，會視為已過期）
+            period: 班表月份 YYYY-MM（可選，供依月份查找班表）
+            
+        Returns:
+            共用班表資料
+        """
+        key = (snapshot.sheet_id, snapshot.content_hash)
+        index = DataProcessor.build_roster_index(snapshot.df)
+        matrix = DataProcessor.build_shift_matrix(snapshot.df, snapshot.shift_dict)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = RosterEntry(
+                    sheet_id=snapshot.sheet_id,
+                    version=snapshot.content_hash,
+                    df=snapshot.df,
+                    shift_dict=snapshot.shift_dict,
+                    loaded_at=datetime.now(),
+                    memory_bytes=int(snapshot.df.memory_usage(deep=True).sum()),
+                    index=index,
+                    matrix=matrix,
+                    shift_table_hash=DataProcessor.shift_table_hash(snapshot.shift_dict),
+                    warnings=tuple(snapshot.warnings)
+                )
+                self._entries[key] = entry
+                self._frames[id(entry.df)] = entry
+            self._entries.move_to_end(key)
+            self._current[snapshot.sheet_id] = snapshot.content_hash
+            if period is not None:
+                self._periods[period] = snapshot.sheet_id
+            if verified:
+                self._checked_at[snapshot.sheet_id] = datetime.now()
+                self._refresh_errors.pop(snapshot.sheet_id, None)
+            self._evict_locked()
+            return entry
+    
+    def current(self, sheet_id: Optional[str]) -> Optional[RosterEntry]:
+        """取得試算表的最新版本（視為最近使用）"""
+        with self._lock:
+            version = self._current.get(sheet_id)
+            entry = self._entries.get((sheet_id, version)) if version else None
+            if entry is not None:
+                self._entries.move_to_end((sheet_id, version))
+            return entry
+    
+    def entry_for(self, df: pd.DataFrame) -> Optional[RosterEntry]:
+        """以 DataFrame 取得已登錄的共用班表（不是共用班表時返回 None）"""
+        with self._lock:
+            return self._frames.get(id(df))
+    
+    def periods(self) -> Dict[str, str]:
+        """已登錄月份的班表 {YYYY-MM: 試算表 ID}（依月份排序）"""
+        with self._lock:
+            return dict(sorted(self._periods.items()))
+    
+    def carry_roster(self, year: int, month: int, fallback: Optional[RosterEntry]) -> Optional[RosterEntry]:
+        """
+        該月份月底的跨日時段是否傳給下個月份計算
+        
+        一份班表沒有自己的月份，第 N 列同時是每個月份的第 N 日；只有該月份另外登錄了月份班表，
+        且下個月份使用不同的班表時，才以該月份班表的最後一日作為下個月份的起始狀態，
+        本月不再計算這段時數。其餘情況跨日時數留在當月，下個月份沒有跨入時段。
+        單月、團隊與期間查詢都以此判斷，同一段時數只計算一次。
+        
+        Args:
+            year: 年份
+            month: 月份
+            fallback: 沒有月份班表的月份使用的班表（目前 session 的班表）
+            
+        Returns:
+            提供最後一日班次的月份班表，不傳遞時為 None
+        """
+        periods = self.periods()
+        roster = self.current(periods.get(f"{year}-{month:02d}"))
+        if roster is None:
+            return None
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        next_roster = self.current(periods.get(f"{next_year}-{next_month:02d}")) or fallback
+        if next_roster is None or next_roster.sheet_id == roster.sheet_id:
+            return None
+        return roster
+    
+    def is_expired(self, sheet_id: str) -> bool:
+        """最新版本是否超過有效期（需要重新向來源確認）"""
+        with self._lock:
+            checked_at = self._checked_at.get(sheet_id)
+            expired_at = self._expired_at
+        if checked_at is None or (expired_at is not None and checked_at <= expired_at):
+            return True
+        return (datetime.now() - checked_at).total_seconds() > Config.ROSTER_CACHE_TTL_SECONDS
+    
+    def touch(self, sheet_id: str):
+        """來源確認未變更，重設有效期"""
+        with self._lock:
+            self._checked_at[sheet_id] = datetime.now()
+            self._refresh_errors.pop(sheet_id, None)
+    
+    def record_refresh_error(self, sheet_id: str, message: str):
+        """記錄背景更新失敗（繼續使用舊版本）"""
+        with self._lock:
+            self._refresh_errors[sheet_id] = message
+    
+    def refresh_status(self, sheet_id: str) -> Tuple[Optional[datetime], Optional[str]]:
+        """取得 (最後向來源確認的時間, 最近一次背景更新錯誤)"""
+        with self._lock:
+            return self._checked_at.get(sheet_id), self._refresh_errors.get(sheet_id)
+    
+    def expire_all(self):
+        """讓所有試算表在下次載入時重新向來源確認"""
+        with self._lock:
+            self._expired_at = datetime.now()
+    
+    def acquire(self, entry: RosterEntry) -> RosterHandle:
+        """增加引用計數並返回 session 用的參照"""
+        with self._lock:
+            entry.refcount += 1
+            self._entries.move_to_end((entry.sheet_id, entry.version))
+        return RosterHandle(self, entry.sheet_id, entry.version)
+    
+    def release(self, key: Tuple[str, str]):
+        """減少引用計數（RosterHandle 被回收時呼叫）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refcount = max(0, entry.refcount - 1)
+            self._evict_locked()
+    
+    def get(self, handle: RosterHandle) -> Optional[RosterEntry]:
+        """以參照取得共用班表"""
+        with self._lock:
+            return self._entries.get((handle.sheet_id, handle.version))
+    
+    def unregister(self, sheet_id: str) -> bool:
+        """
+        移除試算表的月份登錄與最新版本（如不再需要的本機月份班表）
+        
+        沒有 session 使用的版本立即釋放；使用中的版本在 session 釋放後依一般規則淘汰。
+        
+        Args:
+            sheet_id: 試算表 ID
+            
+        Returns:
+            是否有登錄此試算表
+        """
+        with self._lock:
+            if sheet_id not in self._current:
+                return False
+            self._remove_sheet_locked(sheet_id)
+            return True
+    
+    def _remove_sheet_locked(self, sheet_id: str):
+        """移除試算表的登錄資訊與沒有 session 使用的版本（需持有鎖）"""
+        for period in [period for period, period_sheet_id in self._periods.items() if period_sheet_id == sheet_id]:
+            del self._periods[period]
+        self._current.pop(sheet_id, None)
+        self._checked_at.pop(sheet_id, None)
+        self._refresh_errors.pop(sheet_id, None)
+        for key in [key for key, entry in self._entries.items() if key[0] == sheet_id and entry.refcount == 0]:
+            entry = self._entries.pop(key)
+            self._frames.pop(id(entry.df), None)
+    
+    def _period_entries_locked(self) -> List[RosterEntry]:
+        """已登錄月份的班表最新版本（依最近使用順序，需持有鎖）"""
+        period_sheets = set(self._periods.values())
+        return [
+            entry for key, entry in self._entries.items()
+            if key[0] in period_sheets and self._current.get(key[0]) == key[1]
+        ]
+    
+    def _evict_locked(self):
+        """淘汰沒有 session 使用且不是最新版本的班表，以及超過上限的閒置月份班表（需持有鎖）"""
+        idle_keys = [
+            key for key, entry in self._entries.items()
+            if entry.refcount == 0 and self._current.get(key[0]) != key[1]
+        ]
+        for key in idle_keys[:max(0, len(idle_keys) - Config.ROSTER_REGISTRY_MAX_IDLE)]:
+            entry = self._entries.pop(key)
+            self._frames.pop(id(entry.df), None)
+        
+        # 月份班表一直是最新版本，不會被上面淘汰；連同月份登錄移除，該月份改用目前班表（與未匯入相同）
+        idle_periods = [entry for entry in self._period_entries_locked() if entry.refcount == 0]
+        for entry in idle_periods[:max(0, len(idle_periods) - Config.ROSTER_REGISTRY_MAX_IDLE_PERIODS)]:
+            self._remove_sheet_locked(entry.sheet_id)
+    
+    def stats(self) -> Dict[str, int]:
+        """共用班表庫統計（版本數、使用中的參照數、記憶體用量，以及月份班表數與其記憶體用量）"""
+        with self._lock:
+            period_entries = self._period_entries_locked()
+            return {
+                'entries': len(self._entries),
+                'handles': sum(entry.refcount for entry in self._entries.values()),
+                'memory_bytes': sum(entry.memory_bytes for entry in self._entries.values()),
+                'matrix_bytes': sum(entry.matrix.memory_bytes for entry in self._entries.values() if entry.matrix is not None),
+                'periods': len(self._periods),
+                'period_memory_bytes': sum(
+                    entry.memory_bytes + (entry.matrix.memory_bytes if entry.matrix is not None else 0)
+                    for entry in period_entries
+                ),
+            }
+
+class QueryResultCache:
+    """
+    跨 session 共用的查詢結果快取（依最近使用順序淘汰，總大小不超過 Config.QUERY_RESULT_CACHE_MAX_BYTES）
+    
+    鍵包含所有影響結果的輸入：人事號、年月、匹配欄位、分配規則、班表版本、班種表雜湊，
+    以及該月的自定義假日與手動設定雜湊；輸入改變即為不同的鍵，不需主動失效。
+    快取的 QueryResult 由多個 session 共用，請勿修改。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple, Tuple[QueryResult, int]]' = OrderedDict()
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    @staticmethod
+    @st.cache_resource
+    def instance() -> 'QueryResultCache':
+        """取得行程內唯一的查詢結果快取"""
+        return QueryResultCache()
+    
+    @staticmethod
+    def make_key(roster: RosterEntry, personnel: str, year: int, month: int, matching_columns: List[int], policy: str) -> Tuple:
+        """
+        產生查詢結果的快取鍵
+        
+        Args:
+            roster: 使用的共用班表
+            personnel: 人事號
+            year: 年份
+            month: 月份
+            matching_columns: 匹配的欄位列表
+            policy: 平日時數分配規則名稱
+            
+        Returns:
+            快取鍵
+        """
+        overrides = st.session_state.manual_shifts.get(SessionStateManager.get_manual_shift_key(personnel, year, month), {})
+        
+        # 跨月時段：跨入第 1 日的月份班表版本與其最後一日的手動設定，以及月底時段是否傳給隔月
+        registry = RosterRegistry.instance()
+        previous_year, previous_month = (year - 1, 12) if month == 1 else (year, month - 1)
+        carry_roster = registry.carry_roster(previous_year, previous_month, roster)
+        carry_in = None
+        if carry_roster is not None:
+            carry_in = (carry_roster.sheet_id, carry_roster.version, SessionStateManager.get_manual_shift(
+                personnel, previous_year, previous_month, calendar.monthrange(previous_year, previous_month)[1]
+            ))
+        carry_out = registry.carry_roster(year, month, roster) is not None
+        
+        # 影響該月的假日：當月各日與隔月 1 日（時數表包含隔月 1 日的日期類型）
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        month_prefix = f"{year}-{month:02d}-"
+        next_first = f"{next_year}-{next_month:02d}-01"
+        holidays = sorted(
+            (date_key, description) for date_key, description in st.session_state.custom_holidays.items()
+            if date_key.startswith(month_prefix) or date_key == next_first
+        )
+        
+        return (personnel, year, month, tuple(matching_columns), policy,
+                roster.sheet_id, roster.version, roster.shift_table_hash,
+                QueryResultCache.fingerprint(holidays), QueryResultCache.fingerprint(sorted(overrides.items())),
+                carry_in, carry_out)
+    
+    @staticmethod
+    def fingerprint(items: List[Tuple[str, str]]) -> str:
+        """內容雜湊值（空內容為空字串）"""
+        return hashlib.sha256(repr(items).encode()).hexdigest() if items else ""
+    
+    @staticmethod
+    def estimate_bytes(query_result: QueryResult) -> int:
+        """估算查詢結果佔用的記憶體"""
+        daily = query_result.daily
+        return (daily.hours.nbytes + daily.is_weekend.nbytes + daily.weekdays.nbytes
+                + sys.getsizeof(daily.order) + sys.getsizeof(daily.day_types)
+                + 512)  # QueryResult、DailyOvertime 物件本身
+    
+    def get(self, key: Tuple) -> Optional[QueryResult]:
+        """取得快取的查詢結果（沒有時返回 None）"""
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return cached[0]
+    
+    def put(self, key: Tuple, query_result: QueryResult):
+        """加入查詢結果，超過記憶體上限時淘汰最久未使用的結果"""
+        size = QueryResultCache.estimate_bytes(query_result)
+        if size > Config.QUERY_RESULT_CACHE_MAX_BYTES:
+            return
+        
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (query_result, size)
+            self._bytes += size
+            
+            while self._bytes > Config.QUERY_RESULT_CACHE_MAX_BYTES:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats['evictions'] += 1
+    
+    def clear(self):
+        """清除所有快取的查詢結果"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self) -> Dict[str, int]:
+        """命中、未命中、淘汰次數與目前筆數、大小"""
+        with self._lock:
+            return {**self._stats, 'entries': len(self._entries), 'bytes': self._bytes}
+
+class DataProcessor:
+    """資料處理相關功能"""
+    
+    @staticmethod
+    def build_shift_dictionary(shift_df: pd.DataFrame) -> Tuple[Dict[str, ShiftInfo], List[str]]:
+        """
+        建立班種字典
+        
+        不呼叫 Streamlit 元件、不清除共用快取，可在背景執行緒執行；
+        格式異常的列以警告訊息返回，由呼叫端的 session 顯示。
+        
+        Args:
+            shift_df: 班種對照表 DataFrame
+            
+        Returns:
+            (班種字典, 警告訊息列表)
+        """
+        shift_dict = {}
+        warnings = []
+        
+        # 三個時間欄位整欄批次解析，逐列只組合結果
+        parsed_columns = [
+            TimeCalculator.parse_time_ranges(shift_df.iloc[:, col_idx]) if shift_df.shape[1] > col_idx else None
+            for col_idx in (1, 2, 3)
+        ]
+        
+        for position, (index, row) in enumerate(shift_df.iterrows()):
+            try:
+                shift_type = str(row.iloc[0]).strip()
+                if not shift_type or shift_type == 'nan':
+                    continue
+                    
+                overtime_hours_1 = row.iloc[1] if len(row) > 1 else None
+                overtime_hours_2 = row.iloc[2] if len(row) > 2 else None
+                cross_day_hours = row.iloc[3] if len(row) > 3 else None
+                
+                shift_dict[shift_type] = DataProcessor.compile_shift_info(
+                    shift_type, overtime_hours_1, overtime_hours_2, cross_day_hours,
+                    parsed_rows=[None if parsed is None else parsed.iloc[position] for parsed in parsed_columns]
+                )
+            except (IndexError, ValueError) as e:
+                warnings.append(f"⚠️ 班種資料第 {index+1} 行格式異常，已跳過")
+                continue
+        
+        return shift_dict, warnings
+    
+    @staticmethod
+    def build_roster_index(df: pd.DataFrame) -> RosterIndex:
+        """
+        掃描人事號列一次，建立人事號 -> 欄位與指定人員選項的索引
+        
+        Args:
+            df: 班表 DataFrame
+            
+        Returns:
+            人事號索引
+        """
+        columns = defaultdict(list)
+        personnel_options = []
+        
+        personnel_numbers = df.iloc[Config.PERSONNEL_ROW, :].tolist() if len(df) > Config.PERSONNEL_ROW else []
+        for col_idx, personnel_num in enumerate(personnel_numbers):
+            if pd.isna(personnel_num):
+                continue
+            personnel = str(personnel_num).strip()
+            columns[personnel].append(col_idx)
+            if personnel in Config.ALLOWED_PERSONNEL:
+                col_name = DataProcessor.get_column_name(col_idx)
+                personnel_options.append(f"{personnel_num} (Column {col_name})")
+        
+        return RosterIndex(
+            columns={personnel: tuple(col_list) for personnel, col_list in columns.items()},
+            personnel_options=tuple(personnel_options),
+            allowed_column_count=len(personnel_options)
+        )
+    
+    @staticmethod
+    def shift_table_hash(shift_dict: Dict[str, ShiftInfo]) -> str:
+        """
+        班種對照表內容的雜湊值（以各班種的原始時間欄位計算）
+        
+        Args:
+            shift_dict: 班種字典
+            
+        Returns:
+            雜湊值
+        """
+        return hashlib.sha256(repr(sorted(
+            (shift_type, str(info.overtime_hours_1), str(info.overtime_hours_2), str(info.cross_day_hours))
+            for shift_type, info in shift_dict.items()
+        )).encode()).hexdigest()
+    
+    @staticmethod
+    def get_roster_index(df: pd.DataFrame) -> RosterIndex:
+        """
+        取得班表的人事號索引（共用班表在登錄時已建立，直接取用）
+        
+        Args:
+            df: 班表 DataFrame
+            
+        Returns:
+            人事號索引
+        """
+        entry = RosterRegistry.instance().entry_for(df)
+        if entry is not None and entry.index is not None:
+            return entry.index
+        return DataProcessor.build_roster_index(df)
+    
+    @staticmethod
+    def build_shift_matrix(df: pd.DataFrame, shift_dict: Dict[str, ShiftInfo]) -> ShiftMatrix:
+        """
+        將班表轉為 [日期, 欄位] 的整數代碼矩陣（向量化處理整張班表）
+        
+        空值判斷與字串正規化與原本逐格讀取相同：NaN、空白、"nan"、"none" 視為休假，
+        其餘以 str().strip() 後的字串為班次。代碼表另包含班種字典的所有班種。
+        
+        Args:
+            df: 班表 DataFrame
+            shift_dict: 班種字典
+            
+        Returns:
+            班次代碼矩陣
+        """
+        first_row = Config.DAY_ROW_OFFSET + 1
+        values = df.to_numpy(dtype=object)[first_row:first_row + Config.MAX_DAYS_IN_MONTH]
+        cells = np.full((Config.MAX_DAYS_IN_MONTH, df.shape[1]), None, dtype=object)
+        cells[:len(values)] = values
+        
+        text = np.char.strip(cells.astype(str))
+        blank = pd.isna(cells) | np.isin(np.char.lower(text), ['', 'nan', 'none'])
+        
+        shifts = text[~blank]
+        code_table = ("",) + tuple(sorted(set(shifts.tolist()) | set(shift_dict)))
+        codes = np.zeros(cells.shape, dtype=np.int32)
+        codes[~blank] = np.searchsorted(np.array(code_table[1:]), shifts) + 1
+        
+        return ShiftMatrix(
+            codes=codes,
+            code_table=code_table,
+            code_ids={code: code_id for code_id, code in enumerate(code_table)},
+            memory_bytes=int(codes.nbytes + sum(sys.getsizeof(code) for code in code_table))
+        )
+    
+    @staticmethod
+    def get_shift_matrix(df: pd.DataFrame) -> ShiftMatrix:
+        """
+        取得班表的班次代碼矩陣（共用班表在登錄時已建立，直接取用）
+        
+        Args:
+            df: 班表 DataFrame
+            
+        Returns:
+            班次代碼矩陣
+        """
+        entry = RosterRegistry.instance().entry_for(df)
+        if entry is not None and entry.matrix is not None:
+            return entry.matrix
+        return DataProcessor.build_shift_matrix(df, {})
+    
+    @staticmethod
+    def compile_shift_info(shift_type: str, overtime_hours_1: Any, overtime_hours_2: Any, cross_day_hours: Any,
+                           parsed_rows: Optional[List[Optional[pd.Series]]] = None) -> ShiftInfo:
+        """
+        解析班種的時間欄位（每個班種只解析一次）
+        
+        Args:
+            shift_type: 班種
+            overtime_hours_1: 加班時數1 原始值
+            overtime_hours_2: 加班時數2 原始值
+            cross_day_hours: 跨日時數原始值
+            parsed_rows: 三個欄位的批次解析結果（parse_time_ranges 的列，可選；未提供時逐筆解析）
+            
+        Returns:
+            班次資訊
+        """
+        raw_values = (overtime_hours_1, overtime_hours_2, cross_day_hours)
+        fields = [
+            DataProcessor._compile_time_field(raw_value, parsed_rows[i] if parsed_rows else None)
+            for i, raw_value in enumerate(raw_values)
+        ]
+        (time_string_1, hours_1, interval_1), (time_string_2, hours_2, interval_2), (cross_day_string, cross_hours, cross_interval) = fields
+        
+        return ShiftInfo(
+            shift_type=shift_type,
+            overtime_hours_1=overtime_hours_1,
+            overtime_hours_2=overtime_hours_2,
+            cross_day_hours=cross_day_hours,
+            time_string_1=time_string_1,
+            time_string_2=time_string_2,
+            cross_day_string=cross_day_string,
+            hours_1=hours_1,
+            hours_2=hours_2,
+            cross_day_overtime=cross_hours,
+            interval_1=interval_1,
+            interval_2=interval_2,
+            cross_day_interval=cross_interval
+        )
+    
+    @staticmethod
+    def _compile_time_field(raw_value: Any, parsed_row: Optional[pd.Series]) -> Tuple[str, float, Optional[Tuple[int, int]]]:
+        """解析單一時間欄位為 (顯示字串, 時數, 分鐘區間)"""
+        time_string = DataProcessor._clean_time_value(raw_value)
+        if not time_string:
+            return "", 0.0, None
+        
+        if parsed_row is None:
+            return time_string, TimeCalculator.calculate_hours(time_string) or 0.0, TimeCalculator.parse_interval(time_string)
+        
+        hours = 0.0 if pd.isna(parsed_row['hours']) else float(parsed_row['hours'])
+        interval = None
+        if not pd.isna(parsed_row['start_minutes']):
+            interval = (int(parsed_row['start_minutes']), int(parsed_row['end_minutes']))
+        return time_string, hours, interval
+    
+    @staticmethod
+    def _clean_time_value(value: Any) -> str:
+        """將班種時間欄位轉為字串（空值為空字串）"""
+        if value is None or pd.isna(value):
+            return ""
+        return str(value).strip()
+    
+    @staticmethod
+    def find_matching_personnel_columns(df: pd.DataFrame, target_personnel: str) -> List[int]:
+        """
+        查找匹配的人事號欄位
+        
+        Args:
+            df: 班表 DataFrame
+            target_personnel: 目標人事號
+            
+        Returns:
+            匹配的欄位索引列表
+        """
+        return list(DataProcessor.get_roster_index(df).columns.get(target_personnel, ()))
+    
+    @staticmethod
+    def get_personnel_options(df: pd.DataFrame) -> List[str]:
+        """
+        取得指定人事號選項列表
+        
+        Args:
+            df: 班表 DataFrame
+            
+        Returns:
+            指定人事號選項列表
+        """
+        return list(DataProcessor.get_roster_index(df).personnel_options)
     
     @staticmethod
     def get_column_name(index: int) -> str:
@@ -396,28 +2396,382 @@ class DataProcessor:
             return manual_shift  # 可能是空字串（表示手動設為休假）
         
         # 使用原始班次
-        for col_idx in matching_columns:
-            column_data = df.iloc[:, col_idx]
-            row_idx = day + 2
+        return DataProcessor.get_original_shift(df, day, matching_columns)
+    
+    @staticmethod
+    def resolve_month_shifts(df: pd.DataFrame, personnel: str, year: int, month: int, matching_columns: List[int]) -> MonthShifts:
+        """
+        一次取得單一人員整月的有效班次
+        
+        Args:
+            df: 班表 DataFrame
+            personnel: 人事號
+            year: 年份
+            month: 月份
+            matching_columns: 匹配的欄位列表
             
-            if row_idx < len(column_data):
-                value = column_data.iloc[row_idx]
-                
-                # 更嚴格的空值檢查
-                if pd.isna(value) or value is None:
+        Returns:
+            整月班次
+        """
+        return DataProcessor.resolve_team_month_shifts(df, {personnel: matching_columns}, year, month)[personnel]
+    
+    @staticmethod
+    def resolve_team_month_shifts(df: pd.DataFrame, team_columns: Dict[str, List[int]], year: int, month: int) -> Dict[str, MonthShifts]:
+        """
+        以陣列運算一次取得多位人員整月的有效班次
+        
+        原始班次為各日在匹配欄位中第一個非空白班次（與 get_original_shift 相同），
+        手動設定以遮罩覆蓋（空字串表示手動設為休假）。
+        
+        Args:
+            df: 班表 DataFrame
+            team_columns: {人事號: 匹配的欄位列表}
+            year: 年份
+            month: 月份
+            
+        Returns:
+            {人事號: 整月班次}
+        """
+        matrix = DataProcessor.get_shift_matrix(df)
+        days_in_month = len(DateHelper.get_month_date_range(year, month))
+        personnel_list = list(team_columns)
+        width = max((len(columns) for columns in team_columns.values()), default=0)
+        
+        # 原始班次：[人員, 欄位] 的欄位索引表（不足補 -1），取出 [日, 人員, 欄位] 後找第一個非零代碼
+        original_codes = np.zeros((len(personnel_list), days_in_month), dtype=np.int32)
+        if width:
+            column_table = np.full((len(personnel_list), width), -1, dtype=np.intp)
+            for person_idx, personnel in enumerate(personnel_list):
+                columns = team_columns[personnel]
+                column_table[person_idx, :len(columns)] = columns
+            
+            gathered = matrix.codes[:days_in_month][:, np.maximum(column_table, 0)]
+            gathered = np.where(column_table >= 0, gathered, 0)
+            first_filled = (gathered != 0).argmax(axis=2)
+            original_codes = np.take_along_axis(gathered, first_filled[..., None], axis=2)[..., 0].T
+        
+        # 手動設定：以遮罩覆蓋，代碼表沒有的班次另外加入
+        code_table = list(matrix.code_table)
+        code_ids = matrix.code_ids
+        manual_mask = np.zeros(original_codes.shape, dtype=bool)
+        manual_codes = np.zeros(original_codes.shape, dtype=np.int32)
+        manual_shifts = st.session_state.manual_shifts
+        for person_idx, personnel in enumerate(personnel_list):
+            key = SessionStateManager.get_manual_shift_key(personnel, year, month)
+            for date_str, shift in manual_shifts.get(key, {}).items():
+                day = int(date_str.rsplit("/", 1)[-1])
+                if not 1 <= day <= days_in_month:
                     continue
-                    
-                shift_value = str(value).strip()
-                
-                # 檢查是否為有效的班次值
-                if shift_value and shift_value.lower() not in ['nan', 'none', '']:
-                    return shift_value
+                if shift not in code_ids:
+                    if code_ids is matrix.code_ids:
+                        code_ids = dict(code_ids)
+                    code_ids[shift] = len(code_table)
+                    code_table.append(shift)
+                manual_mask[person_idx, day - 1] = True
+                manual_codes[person_idx, day - 1] = code_ids[shift]
+        
+        effective_codes = np.where(manual_mask, manual_codes, original_codes)
+        code_table = tuple(code_table)
+        
+        return {
+            personnel: MonthShifts(
+                personnel=personnel,
+                year=year,
+                month=month,
+                original_codes=original_codes[person_idx],
+                effective_codes=effective_codes[person_idx],
+                manual_mask=manual_mask[person_idx],
+                code_table=code_table,
+                original=tuple(code_table[code_id] for code_id in original_codes[person_idx].tolist()),
+                effective=tuple(code_table[code_id] for code_id in effective_codes[person_idx].tolist())
+            )
+            for person_idx, personnel in enumerate(personnel_list)
+        }
+    
+    @staticmethod
+    def resolve_team_month_carries(df: pd.DataFrame, shift_dict: Dict[str, ShiftInfo], team_columns: Dict[str, List[int]],
+                                   year: int, month: int) -> Dict[str, MonthCarry]:
+        """
+        取得多位人員該月份月底跨到隔月的時段（只讀取最後一日的有效班次）
+        
+        Args:
+            df: 班表 DataFrame
+            shift_dict: 該班表的班種字典
+            team_columns: {人事號: 匹配的欄位列表}
+            year: 年份
+            month: 月份
+            
+        Returns:
+            {人事號: 月底跨日時段}
+        """
+        last_day = calendar.monthrange(year, month)[1]
+        matrix = DataProcessor.get_shift_matrix(df)
+        day_codes = matrix.codes[last_day - 1].tolist()
+        
+        carries = {}
+        for personnel, matching_columns in team_columns.items():
+            # 與 get_effective_shift 相同：手動設定優先，否則取匹配欄位中第一個非空白班次
+            shift = SessionStateManager.get_manual_shift(personnel, year, month, last_day)
+            if shift is None:
+                code_id = next((day_codes[col_idx] for col_idx in matching_columns if day_codes[col_idx]), 0)
+                shift = matrix.code_table[code_id] if code_id else ""
+            carries[personnel] = MonthCarry.from_shift(shift, shift_dict)
+        return carries
+    
+    @staticmethod
+    def get_original_shift(df: pd.DataFrame, day: int, matching_columns: List[int]) -> str:
+        """
+        取得班表上的原始班次（不含手動設定），依欄位順序取第一個非空白班次
+        
+        Args:
+            df: 班表 DataFrame
+            day: 日期
+            matching_columns: 匹配的欄位列表
+            
+        Returns:
+            原始班次（空字串表示休假）
+        """
+        if not 1 <= day <= Config.MAX_DAYS_IN_MONTH:
+            return ""
+        
+        matrix = DataProcessor.get_shift_matrix(df)
+        day_codes = matrix.codes[day - 1]
+        for col_idx in matching_columns:
+            code_id = day_codes[col_idx]
+            if code_id:
+                return matrix.code_table[code_id]
         
         return ""  # 沒有找到有效班次，返回空字串表示休假
 
+class RosterDiff:
+    """
+    比對兩個班表版本，找出受影響的 (人事號, 日期)
+    
+    重新載入後只讓受影響人員的查詢結果、預覽失效，其他人的結果繼續使用。
+    """
+    
+    WHOLE_MONTH = frozenset(range(1, Config.MAX_DAYS_IN_MONTH + 1))
+    
+    @staticmethod
+    def compare(old_df: pd.DataFrame, old_shift_dict: Dict[str, ShiftInfo],
+                new_df: pd.DataFrame, new_shift_dict: Dict[str, ShiftInfo]) -> RosterChange:
+        """
+        逐格比對兩個班表（向量化比較，只對有變更的儲存格逐一處理）
+        
+        班種對照表有變更時，使用該班種的儲存格也視為變更。
+        
+        Args:
+            old_df: 舊班表
+            old_shift_dict: 舊班種字典
+            new_df: 新班表
+            new_shift_dict: 新班種字典
+            
+        Returns:
+            班表差異
+        """
+        changed_shift_types = sorted(
+            shift_type for shift_type in old_shift_dict.keys() | new_shift_dict.keys()
+            if RosterDiff._shift_signature(old_shift_dict.get(shift_type)) != RosterDiff._shift_signature(new_shift_dict.get(shift_type))
+        )
+        
+        if old_df.shape != new_df.shape:
+            return RosterChange(changed_shift_types=changed_shift_types, structural=True)
+        
+        # 與 get_effective_shift 相同以 str().strip() 比較，只有空白不同不算變更
+        old_values = np.char.strip(old_df.to_numpy().astype(str))
+        new_values = np.char.strip(new_df.to_numpy().astype(str))
+        changed = old_values != new_values
+        
+        if changed_shift_types:
+            day_rows = np.arange(len(old_values))[:, None] > Config.DAY_ROW_OFFSET
+            uses_changed_shift = np.isin(old_values, changed_shift_types) | np.isin(new_values, changed_shift_types)
+            changed |= uses_changed_shift & day_rows
+        
+        old_personnel = old_values[Config.PERSONNEL_ROW] if len(old_values) > Config.PERSONNEL_ROW else []
+        new_personnel = new_values[Config.PERSONNEL_ROW] if len(new_values) > Config.PERSONNEL_ROW else []
+        
+        affected = defaultdict(set)
+        rows, cols = np.nonzero(changed)
+        for row_idx, col_idx in zip(rows.tolist(), cols.tolist()):
+            if row_idx == Config.PERSONNEL_ROW:
+                # 人事號變更：新舊人員整月都受影響
+                days = RosterDiff.WHOLE_MONTH
+            elif row_idx - Config.DAY_ROW_OFFSET in RosterDiff.WHOLE_MONTH:
+                days = {row_idx - Config.DAY_ROW_OFFSET}
+            else:
+                continue
+            
+            for personnel in {old_personnel[col_idx], new_personnel[col_idx]}:
+                if personnel and personnel.lower() not in ('nan', 'none'):
+                    affected[personnel] |= days
+        
+        return RosterChange(
+            changed_cells=int(changed.sum()),
+            affected=dict(affected),
+            changed_shift_types=changed_shift_types
+        )
+    
+    @staticmethod
+    def _shift_signature(shift_info: Optional[ShiftInfo]) -> Optional[Tuple[str, ...]]:
+        """班種內容的比較用簽章（NaN 視為相同）"""
+        if shift_info is None:
+            return None
+        return tuple(str(value) for value in (shift_info.overtime_hours_1, shift_info.overtime_hours_2, shift_info.cross_day_hours))
+    
+    @staticmethod
+    def affects(change: RosterChange, personnel: str, year: int, month: int) -> bool:
+        """
+        變更是否影響該人員該月份的結果
+        
+        平日時數會在整月間重新分配，因此當月任一天變更，整月結果都需重新計算。
+        （跨入第 1 日的時段來自上個月份另外登錄的月份班表，見 RosterRegistry.carry_roster）
+        
+        Args:
+            change: 班表差異
+            personnel: 人事號
+            year: 年份
+            month: 月份
+            
+        Returns:
+            是否受影響
+        """
+        if change.structural:
+            return True
+        days = change.affected.get(personnel)
+        if not days:
+            return False
+        return min(days) <= calendar.monthrange(year, month)[1]
+    
+    @staticmethod
+    def describe(change: RosterChange) -> str:
+        """產生變更摘要文字"""
+        if change.structural:
+            return "班表範圍已變更，所有結果需重新計算"
+        if not change.changed_cells:
+            return "班表內容未變更"
+        
+        parts = []
+        for personnel in sorted(change.affected, key=lambda p: (p not in Config.ALLOWED_PERSONNEL, p)):
+            days = change.affected[personnel]
+            if days >= RosterDiff.WHOLE_MONTH:
+                parts.append(f"{personnel} (整月)")
+            else:
+                parts.append(f"{personnel} ({'、'.join(str(day) for day in sorted(days))} 日)")
+        
+        summary = f"{change.changed_cells} 格變更，影響 {len(change.affected)} 位人員"
+        if change.changed_shift_types:
+            summary += f"（班種對照表變更: {', '.join(change.changed_shift_types)}）"
+        if parts:
+            summary += ": " + "；".join(parts)
+        return summary
+
 class TimeCalculator:
     """時間計算相關功能"""
     
+    # 批次解析用：時間組件（HH:MM、HHMM、HH、小數點）與純數字
+    _COMPONENT_PATTERN = r'([0-9]{1,2}):([0-9]{1,2})|([0-9]{4})|([0-9]{1,2})|([0-9]*\.[0-9]+|[0-9]+\.)'
+    RANGE_PATTERN = re.compile(rf'^(?:{_COMPONENT_PATTERN})-(?:{_COMPONENT_PATTERN})$')
+    PURE_NUMBER_PATTERN = re.compile(r'^(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)$')
+    
+    @staticmethod
+    def parse_time_ranges(values: Union[pd.Series, List[Any]]) -> pd.DataFrame:
+        """
+        批次解析整欄時間範圍（結果與逐筆呼叫 calculate_hours / parse_interval 相同）
+        
+        相同字串只解析一次；常見格式以正規表示式與向量化字串運算一次處理，
+        其餘少見寫法（全形數字、逗號小數、欄位內 Tab 等）逐筆交給原本的解析函式。
+        
+        Args:
+            values: 時間範圍字串或數值
+            
+        Returns:
+            DataFrame（與輸入同索引）：start_minutes、end_minutes、hours，
+            無法解析為 NaN；純時數沒有開始與結束分鐘
+        """
+        series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+        series = series.astype(object)
+        
+        columns = ['start_minutes', 'end_minutes', 'hours']
+        result = np.full((len(series), len(columns)), np.nan)
+        
+        # 與 calculate_hours 相同：空值與 0、空字串等視為無資料，其餘只取決於 str().strip() 的結果
+        missing = series.isna()
+        filled = series.where(~missing, True).astype(bool).to_numpy() & ~missing.to_numpy()
+        if filled.any():
+            text = series[filled].astype(str).str.strip()
+            codes, unique_texts = pd.factorize(text)
+            result[filled] = TimeCalculator._parse_unique_texts(pd.Series(unique_texts, dtype=object))[codes]
+        
+        return pd.DataFrame(result, index=series.index, columns=columns)
+    
+    @staticmethod
+    def _parse_unique_texts(text: pd.Series) -> np.ndarray:
+        """解析不重複的時間字串，返回 [開始分鐘, 結束分鐘, 時數] 陣列"""
+        result = np.full((len(text), 3), np.nan)
+        
+        # 純數字（時數）
+        pure = text.str.match(TimeCalculator.PURE_NUMBER_PATTERN).to_numpy(dtype=bool)
+        pure_hours = pd.to_numeric(text[pure], errors='coerce').to_numpy(dtype=float)
+        result[pure, 2] = np.where((pure_hours >= 0) & (pure_hours <= 24), pure_hours, np.nan)
+        
+        # 時間範圍：去除空白與逗號後擷取兩端的時間組件
+        candidates = ~pure & text.str.contains('-', regex=False).to_numpy(dtype=bool)
+        cleaned = text[candidates].str.replace(' ', '', regex=False).str.replace(',', '', regex=False)
+        groups = cleaned.str.extract(TimeCalculator.RANGE_PATTERN)
+        start_hour, start_min = TimeCalculator._components_to_hour_minute(groups.iloc[:, 0:5])
+        end_hour, end_min = TimeCalculator._components_to_hour_minute(groups.iloc[:, 5:10])
+        
+        valid = (
+            (start_hour >= 0) & (start_hour <= 23) & (start_min >= 0) & (start_min <= 59) &
+            (end_hour >= 0) & (end_hour <= 23) & (end_min >= 0) & (end_min <= 59)
+        )
+        start_minutes = start_hour * 60 + start_min
+        end_minutes = end_hour * 60 + end_min
+        end_minutes = np.where(end_minutes <= start_minutes, end_minutes + 24 * 60, end_minutes)
+        
+        fast_rows = np.flatnonzero(candidates)[valid]
+        result[fast_rows, 0] = start_minutes[valid]
+        result[fast_rows, 1] = end_minutes[valid]
+        result[fast_rows, 2] = (end_minutes[valid] - start_minutes[valid]) / 60
+        
+        # 其餘字串逐筆解析（確保與原本的解析結果一致）
+        handled = pure.copy()
+        handled[fast_rows] = True
+        for row in np.flatnonzero(~handled):
+            value = text.iat[row]
+            hours = TimeCalculator.calculate_hours(value)
+            interval = TimeCalculator.parse_interval(value)
+            if hours is not None:
+                result[row, 2] = hours
+            if interval is not None:
+                result[row, 0:2] = interval
+        
+        return result
+    
+    @staticmethod
+    def _components_to_hour_minute(groups: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """將擷取出的時間組件（HH:MM、HHMM、HH、小數點）轉為小時與分鐘，無法匹配為 NaN"""
+        colon_hour, colon_min, four_digits, hour_only, decimal = (
+            pd.to_numeric(groups.iloc[:, i], errors='coerce').to_numpy(dtype=float) for i in range(5)
+        )
+        
+        # 小數點格式與 _parse_time_component 相同：整數部分為小時，餘數換算分鐘後捨去小數
+        decimal = np.where((decimal >= 0) & (decimal <= 24), decimal, np.nan)
+        decimal_hour = np.trunc(decimal)
+        decimal_min = np.trunc((decimal - decimal_hour) * 60)
+        
+        hour = np.select(
+            [~np.isnan(colon_hour), ~np.isnan(four_digits), ~np.isnan(hour_only)],
+            [colon_hour, four_digits // 100, hour_only],
+            default=decimal_hour
+        )
+        minute = np.select(
+            [~np.isnan(colon_hour), ~np.isnan(four_digits), ~np.isnan(hour_only)],
+            [colon_min, four_digits % 100, np.zeros_like(hour_only)],
+            default=decimal_min
+        )
+        return hour, minute
+    
     @staticmethod
     def calculate_hours(time_range: Union[str, float, None]) -> Optional[float]:
         """
@@ -432,8 +2786,12 @@ class TimeCalculator:
         if not time_range or pd.isna(time_range):
             return None
 
-        time_str = str(time_range).strip()
-
+        return TimeCalculator._calculate_hours_cached(str(time_range).strip())
+    
+    @staticmethod
+    @lru_cache(maxsize=Config.HOURS_CACHE_SIZE)
+    def _calculate_hours_cached(time_str: str) -> Optional[float]:
+        """計算正規化後時間字串的小時數（相同字串只解析一次）"""
         # 處理純數字（小時數）
         if TimeCalculator._is_pure_number(time_str):
             try:
@@ -448,6 +2806,17 @@ class TimeCalculator:
 
         return TimeCalculator._parse_time_range(time_str)
     
+    @staticmethod
+    def hours_cache_stats() -> Dict[str, int]:
+        """calculate_hours 快取的命中統計"""
+        info = TimeCalculator._calculate_hours_cached.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize}
+    
+    @staticmethod
+    def clear_hours_cache():
+        """清除 calculate_hours 快取（session 換用新的班表版本時呼叫）"""
+        TimeCalculator._calculate_hours_cached.cache_clear()
+    
     @staticmethod
     def _is_pure_number(time_str: str) -> bool:
         """檢查是否為純數字"""
@@ -462,6 +2831,39 @@ class TimeCalculator:
     @staticmethod
     def _parse_time_range(time_str: str) -> Optional[float]:
         """解析時間範圍字串"""
+        interval = TimeCalculator._parse_interval_text(time_str)
+        if interval is None:
+            return None
+        
+        # 計算小時數
+        start_minutes, end_minutes = interval
+        hours = (end_minutes - start_minutes) / 60
+        
+        return hours if hours > 0 else None
+    
+    @staticmethod
+    def parse_interval(time_range: Union[str, float, None]) -> Optional[Tuple[int, int]]:
+        """
+        將時間範圍解析為分鐘區間
+        
+        Args:
+            time_range: 時間範圍字串（如 "17:30-20:00"）
+            
+        Returns:
+            (開始分鐘, 結束分鐘)，跨午夜時結束分鐘加 1440；純時數或無法解析返回 None
+        """
+        if not time_range or pd.isna(time_range):
+            return None
+        
+        time_str = str(time_range).strip()
+        if '-' not in time_str or TimeCalculator._is_pure_number(time_str):
+            return None
+        
+        return TimeCalculator._parse_interval_text(time_str)
+    
+    @staticmethod
+    def _parse_interval_text(time_str: str) -> Optional[Tuple[int, int]]:
+        """解析時間範圍字串為分鐘區間"""
         try:
             # 清理時間字串
             time_str = time_str.replace(' ', '').replace(',', '')
@@ -479,7 +2881,7 @@ class TimeCalculator:
             if start_hour is None or end_hour is None:
                 return None
             
-            # 轉換為分鐘並計算時差
+            # 轉換為分鐘
             start_minutes = start_hour * 60 + start_min
             end_minutes = end_hour * 60 + end_min
             
@@ -487,11 +2889,7 @@ class TimeCalculator:
             if end_minutes <= start_minutes:
                 end_minutes += 24 * 60
             
-            # 計算小時數
-            total_minutes = end_minutes - start_minutes
-            hours = total_minutes / 60
-            
-            return hours if hours > 0 else None
+            return start_minutes, end_minutes
             
         except Exception:
             return None
@@ -556,6 +2954,82 @@ class TimeCalculator:
 class DateHelper:
     """日期處理相關功能"""
     
+    WEEKDAY_NAMES = ["一", "二", "三", "四", "五", "六", "日"]
+    
+    @staticmethod
+    @st.cache_resource
+    def calendar_table() -> CalendarTable:
+        """取得共用日曆（所有 session 共用，只建立一次）"""
+        return DateHelper.build_calendar_table(Config.MIN_YEAR, Config.MAX_YEAR)
+    
+    @staticmethod
+    def build_calendar_table(first_year: int, last_year: int) -> CalendarTable:
+        """
+        建立指定年份範圍的日曆
+        
+        Args:
+            first_year: 起始年份
+            last_year: 結束年份（含）
+            
+        Returns:
+            日曆表
+        """
+        month_lengths = np.array([
+            calendar.monthrange(year, month)[1]
+            for year in range(first_year, last_year + 1) for month in range(1, 13)
+        ], dtype=np.int8)
+        month_offsets = np.concatenate(([0], np.cumsum(month_lengths[:-1], dtype=np.int32))).astype(np.int32)
+        
+        first_weekday = date(first_year, 1, 1).weekday()
+        weekdays = ((np.arange(int(month_lengths.sum())) + first_weekday) % 7).astype(np.int8)
+        is_weekend = weekdays >= 5
+        
+        label_table = np.array([f"平日({name})" for name in DateHelper.WEEKDAY_NAMES[:5]] + ["假日(六)", "假日(日)"], dtype=object)
+        labels = label_table[weekdays]
+        
+        return CalendarTable(
+            first_year=first_year,
+            month_offsets=month_offsets,
+            month_lengths=month_lengths,
+            weekdays=weekdays,
+            is_weekend=is_weekend,
+            labels=labels
+        )
+    
+    @staticmethod
+    def _day_slot(table: CalendarTable, year: int, month: int, day: int) -> Optional[int]:
+        """日期在日曆中的格位（超出範圍或無效日期為 None）"""
+        if not 1 <= month <= 12:
+            return None
+        month_index = (year - table.first_year) * 12 + month - 1
+        if not 0 <= month_index < len(table.month_lengths) or not 1 <= day <= table.month_lengths[month_index]:
+            return None
+        return int(table.month_offsets[month_index]) + day - 1
+    
+    @staticmethod
+    def get_holiday_overlay() -> HolidayOverlay:
+        """取得套用本 session 自定義假日的日曆（假日變更後才重建）"""
+        overlay = st.session_state.holiday_overlay
+        if overlay is not None:
+            return overlay
+        
+        table = DateHelper.calendar_table()
+        is_weekend = table.is_weekend.copy()
+        labels = table.labels.copy()
+        for date_key, description in st.session_state.custom_holidays.items():
+            try:
+                year, month, day = (int(part) for part in date_key.split('-'))
+            except ValueError:
+                continue
+            slot = DateHelper._day_slot(table, year, month, day)
+            if slot is not None:
+                is_weekend[slot] = True
+                labels[slot] = description
+        
+        overlay = HolidayOverlay(version=st.session_state.holiday_version, table=table, is_weekend=is_weekend, labels=labels)
+        st.session_state.holiday_overlay = overlay
+        return overlay
+    
     @staticmethod
     def get_day_type(year: int, month: int, day: int) -> Tuple[str, bool]:
         """
@@ -569,6 +3043,36 @@ class DateHelper:
         Returns:
             (日期類型描述, 是否為假日)
         """
+        overlay = DateHelper.get_holiday_overlay()
+        slot = DateHelper._day_slot(overlay.table, year, month, day)
+        if slot is None:
+            return DateHelper._compute_day_type(year, month, day)
+        
+        return overlay.labels[slot], bool(overlay.is_weekend[slot])
+    
+    @staticmethod
+    def get_month_day_types(year: int, month: int) -> List[Tuple[str, bool]]:
+        """
+        取得整月每日的日期類型（含自定義假日）
+        
+        Args:
+            year: 年份
+            month: 月份
+            
+        Returns:
+            [(日期類型描述, 是否為假日)]，索引 0 為第 1 日
+        """
+        overlay = DateHelper.get_holiday_overlay()
+        first = DateHelper._day_slot(overlay.table, year, month, 1)
+        if first is None:
+            return [DateHelper._compute_day_type(year, month, day) for day in DateHelper.get_month_date_range(year, month)]
+        
+        last = first + calendar.monthrange(year, month)[1]
+        return list(zip(overlay.labels[first:last].tolist(), overlay.is_weekend[first:last].tolist()))
+    
+    @staticmethod
+    def _compute_day_type(year: int, month: int, day: int) -> Tuple[str, bool]:
+        """逐筆判斷日期類型（日曆範圍外的日期使用）"""
         try:
             # 檢查自定義假日
             date_key = f"{year}-{month:02d}-{day:02d}"
@@ -584,12 +3088,27 @@ class DateHelper:
             elif weekday == 6:  # 星期日
                 return "假日(日)", True
             else:  # 平日
-                weekdays = ["一", "二", "三", "四", "五"]
-                return f"平日({weekdays[weekday]})", False
+                return f"平日({DateHelper.WEEKDAY_NAMES[weekday]})", False
                 
         except ValueError:
             return "無效日期", False
     
+    @staticmethod
+    def get_month_span(start: Tuple[int, int], end: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """
+        取得期間內的所有月份
+        
+        Args:
+            start: 起始 (年, 月)
+            end: 結束 (年, 月)（含）
+            
+        Returns:
+            [(年, 月), ...]（起始晚於結束時為空列表）
+        """
+        first = start[0] * 12 + start[1] - 1
+        last = end[0] * 12 + end[1] - 1
+        return [(index // 12, index % 12 + 1) for index in range(first, last + 1)]
+    
     @staticmethod
     def get_month_date_range(year: int, month: int) -> List[int]:
         """
@@ -612,301 +3131,924 @@ class DataValidator:
     """資料驗證相關功能"""
     
     @staticmethod
-    def count_allowed_personnel(df: pd.DataFrame) -> int:
-        """計算指定的人事號數量"""
-        if df is None or df.empty:
-            return 0
+    def count_allowed_personnel(df: pd.DataFrame) -> int:
+        """計算指定的人事號數量"""
+        if df is None or df.empty:
+            return 0
+        
+        return DataProcessor.get_roster_index(df).allowed_column_count
+    
+    @staticmethod
+    def validate_query_parameters(personnel: str, year: int, month: int) -> Tuple[bool, str]:
+        """
+        驗證查詢參數
+        
+        Args:
+            personnel: 人事號
+            year: 年份
+            month: 月份
+            
+        Returns:
+            (是否有效, 錯誤訊息)
+        """
+        if not personnel or not personnel.strip():
+            return False, "請選擇人事號"
+        
+        return DataValidator.validate_year_month(year, month)
+    
+    @staticmethod
+    def validate_year_month(year: int, month: int) -> Tuple[bool, str]:
+        """
+        驗證查詢年月（不指定人員的查詢，如團隊查詢）
+        
+        Args:
+            year: 年份
+            month: 月份
+            
+        Returns:
+            (是否有效, 錯誤訊息)
+        """
+        if not (Config.MIN_YEAR <= year <= Config.MAX_YEAR):
+            return False, f"年份必須在 {Config.MIN_YEAR} 到 {Config.MAX_YEAR} 之間"
+        
+        if not (1 <= month <= 12):
+            return False, "月份必須在 1 到 12 之間"
+        
+        return True, ""
+
+@dataclass
+class DayTimeline:
+    """
+    單日加班時段
+    
+    分鐘以當日 00:00 為 0，跨午夜的部分大於 1440；
+    重疊或重複的時段合併後只計算一次。
+    """
+    segments: List[Tuple[int, int]] = field(default_factory=list)  # 合併後的時段（已排序且互不重疊）
+    entries: List[Tuple[str, Optional[Tuple[int, int]]]] = field(default_factory=list)  # (時間字串, 區間)，依加入順序
+    loose_hours: float = 0.0  # 無法定位的時數（如純時數）
+    
+    MINUTES_PER_DAY = 24 * 60
+    
+    def add(self, label: str, interval: Optional[Tuple[int, int]], hours: float):
+        """加入一個時間欄位（有區間則合併進時段，否則累加為無法定位的時數）"""
+        self.entries.append((label, interval))
+        if interval is not None:
+            self.add_interval(*interval)
+        else:
+            self.loose_hours += hours
+    
+    def add_interval(self, start: int, end: int):
+        """聯集加入 [start, end) 分鐘區間"""
+        if end <= start:
+            return
+        
+        # 找出所有與新區間重疊或相鄰的時段並合併
+        lo = bisect.bisect_left(self.segments, (start, start))
+        if lo > 0 and self.segments[lo - 1][1] >= start:
+            lo -= 1
+        hi = lo
+        while hi < len(self.segments) and self.segments[hi][0] <= end:
+            start = min(start, self.segments[hi][0])
+            end = max(end, self.segments[hi][1])
+            hi += 1
+        self.segments[lo:hi] = [(start, end)]
+    
+    def overlaps(self, start: int, end: int) -> bool:
+        """檢查 [start, end) 是否與已有時段重疊"""
+        i = bisect.bisect_left(self.segments, (end, end))
+        return i > 0 and self.segments[i - 1][1] > start
+    
+    def find_gap(self, duration: int, preferred_start: int) -> Optional[int]:
+        """
+        尋找可放入指定長度的空檔
+        
+        Args:
+            duration: 所需分鐘數
+            preferred_start: 優先的開始分鐘
+            
+        Returns:
+            最接近優先位置的可用開始分鐘；當日與隔日凌晨皆無空檔則返回 None
+        """
+        if not self.overlaps(preferred_start, preferred_start + duration):
+            return preferred_start
+        
+        lower = min(preferred_start, 0)
+        upper = max(preferred_start + duration, 2 * self.MINUTES_PER_DAY)
+        best = None
+        gap_start = lower
+        for seg_start, seg_end in self.segments + [(upper, upper)]:
+            if seg_start - gap_start >= duration:
+                candidate = min(max(preferred_start, gap_start), seg_start - duration)
+                if best is None or abs(candidate - preferred_start) < abs(best - preferred_start):
+                    best = candidate
+            gap_start = max(gap_start, seg_end)
+        return best
+    
+    @property
+    def anchor(self) -> Optional[Tuple[int, int]]:
+        """第一個時間字串的區間（無法定位為 None）"""
+        return self.entries[0][1] if self.entries else None
+    
+    @property
+    def labels(self) -> List[str]:
+        return [label for label, _ in self.entries if label]
+    
+    @property
+    def hours(self) -> float:
+        """合併重疊時段後的總時數"""
+        return sum(end - start for start, end in self.segments) / 60 + self.loose_hours
+    
+    @staticmethod
+    def format_minutes(minutes: int) -> str:
+        """分鐘轉為 HH:MM（跨午夜取餘數）"""
+        minutes %= DayTimeline.MINUTES_PER_DAY
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+class AllocationEngine:
+    """
+    平日加班時數上限規則的分配引擎
+    
+    直接在 DailyOvertime 的陣列上運作，以優先佇列決定刪減或補足的日期；
+    規則由 AllocationPolicy 決定。
+    """
+    
+    POLICIES = {
+        'priority': AllocationPolicy(
+            name='priority', label='時數少的日期先刪、週二四優先補足',
+            trim='smallest_first', fill='priority_days'
+        ),
+        'spread': AllocationPolicy(
+            name='spread', label='削平時數最多的日期、補足平均分散到各週',
+            trim='level_largest', fill='spread_weeks'
+        ),
+        'capped': AllocationPolicy(
+            name='capped', label=f'平日單日最多 {Config.MAX_DAILY_WEEKDAY_HOURS:g} 小時',
+            trim='smallest_first', fill='priority_days', daily_cap=Config.MAX_DAILY_WEEKDAY_HOURS
+        ),
+    }
+    
+    @staticmethod
+    def get_policy(name: Optional[str] = None) -> AllocationPolicy:
+        """取得分配規則（未指定或不存在時使用 Config.ALLOCATION_POLICY）"""
+        return AllocationEngine.POLICIES.get(name or Config.ALLOCATION_POLICY, AllocationEngine.POLICIES[Config.ALLOCATION_POLICY])
+    
+    @staticmethod
+    def weekday_totals(hours: np.ndarray, is_weekend: np.ndarray) -> np.ndarray:
+        """平日總時數（一維為單人，二維時每列一人）"""
+        return np.where(is_weekend, 0.0, hours).sum(axis=-1)
+    
+    @staticmethod
+    def rebalance(daily: DailyOvertime, weekday_hours: float, worked_weekdays: set, policy: AllocationPolicy) -> float:
+        """
+        套用平日時數上限規則（直接修改 daily）
+        
+        Args:
+            daily: 整月每日時數
+            weekday_hours: 目前平日總時數
+            worked_weekdays: 有上班的平日（日序索引），不補足時數
+            policy: 分配規則
+            
+        Returns:
+            調整後的平日總時數
+        """
+        if policy.daily_cap is not None:
+            weekday_hours = AllocationEngine._apply_cap(daily, weekday_hours, policy.daily_cap)
+        
+        # 超過46小時則減少
+        if weekday_hours > Config.MAX_WEEKDAY_HOURS:
+            if policy.trim == 'level_largest':
+                weekday_hours = AllocationEngine._trim_level_largest(daily, weekday_hours)
+            else:
+                weekday_hours = AllocationEngine._trim_smallest_first(daily, weekday_hours)
+        
+        # 少於46小時則自動補足
+        elif weekday_hours < Config.MAX_WEEKDAY_HOURS:
+            if policy.fill == 'spread_weeks':
+                weekday_hours = AllocationEngine._fill_spread_weeks(daily, weekday_hours, worked_weekdays, policy.daily_cap)
+            else:
+                weekday_hours = AllocationEngine._fill_priority_days(daily, weekday_hours, worked_weekdays, policy.daily_cap)
+        
+        return weekday_hours
+    
+    @staticmethod
+    def rebalance_team(dailies: Dict[str, DailyOvertime], worked_weekdays: Dict[str, set], policy: AllocationPolicy) -> Dict[str, float]:
+        """
+        一次套用整個團隊同一月份的平日時數上限規則（直接修改各人的 daily）
+        
+        Args:
+            dailies: 人事號 -> 整月每日時數（需為同一月份）
+            worked_weekdays: 人事號 -> 有上班的平日
+            policy: 分配規則
+            
+        Returns:
+            人事號 -> 調整後的平日總時數
+        """
+        if not dailies:
+            return {}
+        
+        personnel = list(dailies)
+        totals = AllocationEngine.weekday_totals(
+            np.vstack([dailies[p].hours for p in personnel]),
+            np.vstack([dailies[p].is_weekend for p in personnel])
+        )
+        
+        return {
+            p: AllocationEngine.rebalance(dailies[p], float(total), worked_weekdays.get(p, set()), policy)
+            for p, total in zip(personnel, totals)
+        }
+    
+    @staticmethod
+    def _day_priority(weekday: int) -> int:
+        """補足時數的星期優先級（數字小者優先）"""
+        if weekday in Config.HIGH_PRIORITY_WEEKDAYS:
+            return 1
+        if weekday in Config.MEDIUM_PRIORITY_WEEKDAYS:
+            return 2
+        return 3
+    
+    @staticmethod
+    def _fill_candidates(daily: DailyOvertime, worked_weekdays: set) -> List[int]:
+        """可補足時數的日期：當月沒有上班的平日"""
+        is_weekend = daily.is_weekend.tolist()
+        return [slot for slot in range(daily.days_in_month)
+                if not is_weekend[slot] and slot not in worked_weekdays]
+    
+    @staticmethod
+    def _block_hours(daily: DailyOvertime, slot: int, daily_cap: Optional[float]) -> float:
+        """可補入該日的時數（不超過單日上限）"""
+        if daily_cap is None:
+            return Config.AUTO_ADD_HOURS
+        return min(Config.AUTO_ADD_HOURS, daily_cap - float(daily.hours[slot]))
+    
+    @staticmethod
+    def _apply_cap(daily: DailyOvertime, weekday_hours: float, daily_cap: float) -> float:
+        """平日單日時數超過上限的部分刪除"""
+        hours_list, is_weekend = daily.hours.tolist(), daily.is_weekend.tolist()
+        for slot in daily.order:
+            hours = hours_list[slot]
+            if not is_weekend[slot] and hours > daily_cap:
+                daily.hours[slot] = daily_cap
+                weekday_hours -= hours - daily_cap
+        return weekday_hours
+    
+    @staticmethod
+    def _trim_smallest_first(daily: DailyOvertime, weekday_hours: float) -> float:
+        """刪減超額時數：時數少的日期先刪（同時數依記錄先後）"""
+        hours_list, is_weekend = daily.hours.tolist(), daily.is_weekend.tolist()
+        heap = [
+            (hours_list[slot], rank, slot) for rank, slot in enumerate(daily.order)
+            if hours_list[slot] > 0 and not is_weekend[slot]
+        ]
+        heapq.heapify(heap)
+        
+        excess_hours = weekday_hours - Config.MAX_WEEKDAY_HOURS
+        removed_hours = 0.0
+        
+        while heap:
+            hours, _, slot = heapq.heappop(heap)
+            if removed_hours + hours <= excess_hours:
+                # 完全移除這一天
+                daily.hours[slot] = 0.0
+                removed_hours += hours
+                weekday_hours -= hours
+                
+                if removed_hours >= excess_hours:
+                    break
+            elif removed_hours < excess_hours:
+                # 部分移除
+                remaining_to_remove = excess_hours - removed_hours
+                daily.hours[slot] -= remaining_to_remove
+                weekday_hours -= remaining_to_remove
+                break
+        
+        return weekday_hours
+    
+    @staticmethod
+    def _trim_level_largest(daily: DailyOvertime, weekday_hours: float) -> float:
+        """刪減超額時數：把時數最多的幾天削平到同一水位（以 Config.ALLOCATION_STEP_HOURS 為單位）"""
+        hours_list, is_weekend = daily.hours.tolist(), daily.is_weekend.tolist()
+        heap = [
+            (-hours_list[slot], rank, slot) for rank, slot in enumerate(daily.order)
+            if hours_list[slot] > 0 and not is_weekend[slot]
+        ]
+        heapq.heapify(heap)
+        
+        excess_hours = weekday_hours - Config.MAX_WEEKDAY_HOURS
+        lowered = []
+        lowered_total = 0.0
+        level = 0.0
+        
+        while heap:
+            neg_hours, _, slot = heapq.heappop(heap)
+            lowered.append(slot)
+            lowered_total -= neg_hours
+            next_hours = -heap[0][0] if heap else 0.0
+            
+            # 削平到下一天的時數即足夠時，求出實際水位
+            if lowered_total - next_hours * len(lowered) >= excess_hours:
+                level = (lowered_total - excess_hours) / len(lowered)
+                break
+        
+        # 水位取整到時數單位，餘數由原本時數較多的日期依序各多分一個單位
+        step = Config.ALLOCATION_STEP_HOURS
+        base = math.floor(level / step) * step
+        remainder = lowered_total - excess_hours - base * len(lowered)
+        for slot in lowered:
+            extra = min(step, max(remainder, 0.0))
+            daily.hours[slot] = base + extra
+            remainder -= extra
+        
+        return weekday_hours - excess_hours
+    
+    @staticmethod
+    def _fill_priority_days(daily: DailyOvertime, weekday_hours: float, worked_weekdays: set, daily_cap: Optional[float]) -> float:
+        """補足時數：週二、週四優先，其次週一、三、五，同優先級依日期先後"""
+        weekdays = daily.weekdays.tolist()
+        heap = [(AllocationEngine._day_priority(weekdays[slot]), slot)
+                for slot in AllocationEngine._fill_candidates(daily, worked_weekdays)]
+        heapq.heapify(heap)
+        
+        remaining = Config.MAX_WEEKDAY_HOURS - weekday_hours
+        while heap and remaining > 0:
+            _, slot = heapq.heappop(heap)
+            block = AllocationEngine._block_hours(daily, slot, daily_cap)
+            if block <= 0:
+                continue
+            daily.add(slot, block)
+            weekday_hours += block
+            remaining -= block
+        
+        return weekday_hours
+    
+    @staticmethod
+    def _fill_spread_weeks(daily: DailyOvertime, weekday_hours: float, worked_weekdays: set, daily_cap: Optional[float]) -> float:
+        """補足時數：優先補到已補最少的那一週，同週內依星期優先級"""
+        weekdays = daily.weekdays.tolist()
+        first_weekday = weekdays[0]
+        week_counts = defaultdict(int)
+        heap = [(0, AllocationEngine._day_priority(weekdays[slot]), slot)
+                for slot in AllocationEngine._fill_candidates(daily, worked_weekdays)]
+        heapq.heapify(heap)
+        
+        remaining = Config.MAX_WEEKDAY_HOURS - weekday_hours
+        while heap and remaining > 0:
+            count, priority, slot = heapq.heappop(heap)
+            week = (slot + first_weekday) // 7
+            if count != week_counts[week]:
+                # 該週在此期間已補入其他日期，依新的週次數重新排隊
+                heapq.heappush(heap, (week_counts[week], priority, slot))
+                continue
+            
+            block = AllocationEngine._block_hours(daily, slot, daily_cap)
+            if block <= 0:
+                continue
+            daily.add(slot, block)
+            weekday_hours += block
+            remaining -= block
+            week_counts[week] += 1
+        
+        return weekday_hours
+
+class OvertimeCalculator:
+    """加班時數計算功能（內部以當月日序為索引，見 DailyOvertime）"""
+    
+    @staticmethod
+    def calculate_overtime_summary(target_personnel: str, year: int, month: int, matching_columns: List[int],
+                                   policy: Optional[str] = None) -> QueryResult:
+        """
+        計算指定人員的加班時數統計（支援手動班次）
+        
+        Args:
+            target_personnel: 目標人事號
+            year: 年份
+            month: 月份
+            matching_columns: 匹配的欄位列表
+            policy: 平日時數分配規則名稱（預設 Config.ALLOCATION_POLICY）
+            
+        Returns:
+            查詢結果物件
+        """
+        allocation_policy = AllocationEngine.get_policy(policy)
+        
+        # 所有輸入都相同時直接使用快取的結果
+        roster = SessionStateManager.get_roster()
+        cache = QueryResultCache.instance()
+        cache_key = None
+        if roster is not None:
+            cache_key = QueryResultCache.make_key(roster, target_personnel, year, month, matching_columns, allocation_policy.name)
+            query_result = cache.get(cache_key)
+            if query_result is not None:
+                return query_result
+        
+        state = SessionStateManager.get_month_working_state(target_personnel, year, month, matching_columns)
+        carry_out = RosterRegistry.instance().carry_roster(year, month, roster) is not None
+        query_result = OvertimeCalculator.summarize_working_state(state, matching_columns, allocation_policy.name, carry_out)
+        if cache_key is not None:
+            cache.put(cache_key, query_result)
+        return query_result
+    
+    @staticmethod
+    def build_working_state(month_shifts: MonthShifts, shift_dict: Dict[str, ShiftInfo],
+                            source_key: Tuple[int, Tuple[int, ...], int], overrides: Dict[str, str],
+                            carry_in: MonthCarry) -> MonthWorkingState:
+        """
+        由整月班次建立計算中間結果
+        
+        Args:
+            month_shifts: 整月有效班次
+            shift_dict: 班種字典
+            source_key: (id(班表), 匹配欄位, holiday_version)
+            overrides: 該月的手動設定 {YYYY/MM/DD: 班次}
+            carry_in: 上個月最後一日班次跨入第 1 日的時段
+            
+        Returns:
+            整月計算中間結果
+        """
+        year, month = month_shifts.year, month_shifts.month
+        template = DailyOvertime.for_month(year, month)
+        state = MonthWorkingState(
+            personnel=month_shifts.personnel,
+            year=year,
+            month=month,
+            source_key=source_key,
+            template=template,
+            original=list(month_shifts.original),
+            effective=list(month_shifts.effective),
+            overrides=dict(overrides),
+            carry_in=carry_in,
+            raw_hours=np.zeros(len(template.hours)),
+            has_own=np.zeros(len(template.hours), dtype=bool),
+            # 記錄有上班的平日
+            worked_weekdays={
+                slot for slot, shift in enumerate(month_shifts.effective)
+                if shift and not template.is_weekend[slot]
+            }
+        )
         
-        personnel_numbers = df.iloc[1, :].tolist()
-        return sum(1 for num in personnel_numbers 
-                  if pd.notna(num) and str(num).strip() in Config.ALLOWED_PERSONNEL)
+        # 各日加班時段（重疊時段只計算一次）
+        for slot, timeline in OvertimeCalculator.build_month_timelines(month_shifts, shift_dict, year, month, carry_in).items():
+            state.raw_hours[slot] = timeline.hours
+        for slot, shift in enumerate(month_shifts.effective):
+            state.has_own[slot] = OvertimeCalculator._own_hours(shift_dict.get(shift) if shift else None) > 0
+        return state
     
     @staticmethod
-    def validate_query_parameters(personnel: str, year: int, month: int) -> Tuple[bool, str]:
+    def update_working_state(state: MonthWorkingState, day: int, shift: str, shift_dict: Dict[str, ShiftInfo]):
         """
-        驗證查詢參數
+        單日班次變更：只重算該日與隔日（跨日時段）的時數
         
         Args:
-            personnel: 人事號
-            year: 年份
-            month: 月份
-            
-        Returns:
-            (是否有效, 錯誤訊息)
+            state: 整月計算中間結果（直接修改）
+            day: 日期
+            shift: 新的有效班次（空字串表示休假）
+            shift_dict: 班種字典
         """
-        if not personnel or not personnel.strip():
-            return False, "請選擇人事號"
+        slot = day - 1
+        state.effective[slot] = shift
         
-        if not (Config.MIN_YEAR <= year <= Config.MAX_YEAR):
-            return False, f"年份必須在 {Config.MIN_YEAR} 到 {Config.MAX_YEAR} 之間"
+        if shift and not state.template.is_weekend[slot]:
+            state.worked_weekdays.add(slot)
+        else:
+            state.worked_weekdays.discard(slot)
         
-        if not (1 <= month <= 12):
-            return False, "月份必須在 1 到 12 之間"
+        def shift_info(index: int) -> Optional[ShiftInfo]:
+            if index < 0:
+                return state.carry_in.shift_info  # 上個月最後一日
+            if index < len(state.effective) and state.effective[index]:
+                return shift_dict.get(state.effective[index])
+            return None
         
-        return True, ""
-
-class OvertimeCalculator:
-    """加班時數計算功能"""
+        current_info = shift_info(slot)
+        state.has_own[slot] = OvertimeCalculator._own_hours(current_info) > 0
+        state.raw_hours[slot] = OvertimeCalculator._pair_hours(shift_info(slot - 1), current_info)
+        state.raw_hours[slot + 1] = OvertimeCalculator._pair_hours(current_info, shift_info(slot + 1))
     
     @staticmethod
-    def calculate_overtime_summary(target_personnel: str, year: int, month: int, matching_columns: List[int]) -> QueryResult:
+    def summarize_working_state(state: MonthWorkingState, matching_columns: List[int],
+                                policy: Optional[str] = None, carry_out: bool = False) -> QueryResult:
         """
-        計算指定人員的加班時數統計（支援手動班次）
+        由計算中間結果產生查詢結果（只重新套用 46 小時規則）
         
         Args:
-            target_personnel: 目標人事號
-            year: 年份
-            month: 月份
+            state: 整月計算中間結果
             matching_columns: 匹配的欄位列表
+            policy: 平日時數分配規則名稱（預設 Config.ALLOCATION_POLICY）
+            carry_out: 月底跨到隔月 1 日的時段是否傳給隔月計算（見 RosterRegistry.carry_roster）
             
         Returns:
             查詢結果物件
         """
-        df = st.session_state.df
-        shift_dict = st.session_state.shift_dict
-        
-        # 初始化變數
-        daily_records = []
-        cross_day_records = defaultdict(float)
-        worked_weekdays = set()
-        
-        # 收集所有班次資料（優先使用手動設定的班次）
-        for day in DateHelper.get_month_date_range(year, month):
-            try:
-                current_date = date(year, month, day)
-                date_str = f"{year}/{month:02d}/{day:02d}"
-                day_type, is_weekend = DateHelper.get_day_type(year, month, day)
-                
-                # 取得有效班次（手動或原始）
-                effective_shift = DataProcessor.get_effective_shift(
-                    df, target_personnel, year, month, day, matching_columns
-                )
-                
-                # 記錄有上班的平日
-                if effective_shift and not is_weekend:
-                    worked_weekdays.add(date_str)
-                
-                # 處理班次資料
-                if effective_shift in shift_dict and effective_shift:
-                    overtime_data = OvertimeCalculator._calculate_daily_overtime(
-                        shift_dict[effective_shift], current_date, date_str, day_type, is_weekend
-                    )
-                    
-                    if overtime_data:
-                        daily_records.append(overtime_data)
-                        
-                        # 處理跨天時數
-                        if overtime_data['cross_day_overtime'] > 0:
-                            next_date = current_date + timedelta(days=1)
-                            next_date_str = f"{next_date.year}/{next_date.month:02d}/{next_date.day:02d}"
-                            cross_day_records[next_date_str] += overtime_data['cross_day_overtime']
-            
-            except ValueError:
-                continue
-        
-        # 建立每日加班時數統計
-        final_daily_overtime = OvertimeCalculator._build_daily_overtime_summary(daily_records, cross_day_records)
+        template = state.template
+        # 月底跨到隔月 1 日的時數傳給隔月時，不列入本月統計
+        hours = state.raw_hours.copy()
+        if carry_out:
+            hours[template.days_in_month] = 0.0
+        recorded = hours > 0
+        daily = DailyOvertime(
+            year=state.year,
+            month=state.month,
+            hours=hours,
+            is_weekend=template.is_weekend,
+            weekdays=template.weekdays,
+            day_types=template.day_types,
+            # 當日有加班的日期在前，只有跨日時段的日期在後（與 build_month_timelines 相同）
+            order=np.flatnonzero(recorded & state.has_own).tolist() + np.flatnonzero(recorded & ~state.has_own).tolist()
+        )
         
         # 計算平日和假日時數
-        weekday_hours, weekend_hours = OvertimeCalculator._calculate_weekday_weekend_hours(final_daily_overtime, year, month)
+        weekday_hours, weekend_hours = OvertimeCalculator._calculate_weekday_weekend_hours(daily)
         
         # 調整平日時數（46小時限制和自動補足）
-        final_daily_overtime, weekday_hours = OvertimeCalculator._adjust_weekday_hours(
-            final_daily_overtime, weekday_hours, worked_weekdays, year, month
-        )
+        allocation_policy = AllocationEngine.get_policy(policy)
+        weekday_hours = AllocationEngine.rebalance(daily, weekday_hours, set(state.worked_weekdays), allocation_policy)
         
         total_hours = weekday_hours + weekend_hours
         
         return QueryResult(
-            target_personnel=target_personnel,
-            year=year,
-            month=month,
+            target_personnel=state.personnel,
+            year=state.year,
+            month=state.month,
             matching_columns=matching_columns,
-            daily_breakdown=dict(final_daily_overtime),
+            daily=daily,
             weekday_hours=weekday_hours,
             weekend_hours=weekend_hours,
-            total_hours=total_hours
+            total_hours=total_hours,
+            allocation_policy=allocation_policy.name,
+            carry_in_hours=state.carry_in.hours,
+            carry_out_hours=state.spill_hours if carry_out else 0.0
         )
     
     @staticmethod
-    def _calculate_daily_overtime(shift_info: ShiftInfo, current_date: date, date_str: str, day_type: str, is_weekend: bool) -> Optional[Dict]:
-        """計算單日加班時數"""
-        current_day_overtime = 0.0
-        next_day_overtime = 0.0
-        
-        # 計算當天加班時數
-        if pd.notna(shift_info.overtime_hours_1) and str(shift_info.overtime_hours_1).strip():
-            hours_1 = TimeCalculator.calculate_hours(str(shift_info.overtime_hours_1))
-            if hours_1:
-                current_day_overtime += hours_1
-        
-        if pd.notna(shift_info.overtime_hours_2) and str(shift_info.overtime_hours_2).strip():
-            hours_2 = TimeCalculator.calculate_hours(str(shift_info.overtime_hours_2))
-            if hours_2:
-                current_day_overtime += hours_2
+    def calculate_team_overtime_summary(year: int, month: int, personnel_list: Optional[List[str]] = None,
+                                        policy: Optional[str] = None) -> TeamQueryResult:
+        """
+        一次計算多位人員同一月份的加班時數（結果與逐一呼叫 calculate_overtime_summary 相同）
         
-        # 計算跨天時數
-        if pd.notna(shift_info.cross_day_hours) and str(shift_info.cross_day_hours).strip():
-            cross_hours = TimeCalculator.calculate_hours(str(shift_info.cross_day_hours))
-            if cross_hours:
-                next_day_overtime = cross_hours
+        各人整月班次以陣列一次取得，每日時數由「前一日班次 × 當日班次」的時數表查出，
+        平日總時數與 46 小時規則以 AllocationEngine.rebalance_team 一次套用。
         
-        # 只有當有加班時數時才返回記錄
-        if current_day_overtime > 0 or next_day_overtime > 0:
-            return {
-                'date': date_str,
-                'day_type': day_type,
-                'is_weekend': is_weekend,
-                'shift': shift_info.shift_type,
-                'current_day_overtime': current_day_overtime,
-                'cross_day_overtime': next_day_overtime
-            }
+        Args:
+            year: 年份
+            month: 月份
+            personnel_list: 人事號列表（預設 Config.ALLOWED_PERSONNEL）
+            policy: 平日時數分配規則名稱（預設 Config.ALLOCATION_POLICY）
+            
+        Returns:
+            團隊查詢結果物件
+        """
+        roster = SessionStateManager.get_roster()
+        team_columns, missing = OvertimeCalculator._match_team_columns(roster.df, personnel_list)
+        team_shifts = SessionStateManager.get_team_month_shifts(team_columns, year, month) if team_columns else {}
+        previous_year, previous_month = (year - 1, 12) if month == 1 else (year, month - 1)
+        carry_in = SessionStateManager.get_month_carries(list(team_columns), previous_year, previous_month)
+        carry_out = RosterRegistry.instance().carry_roster(year, month, roster) is not None
+        
+        team_result = OvertimeCalculator._compute_team_month(
+            year, month, team_columns, missing, team_shifts, carry_in, carry_out, roster.shift_dict,
+            DailyOvertime.for_month(year, month), AllocationEngine.get_policy(policy)
+        )
         
-        return None
+        # 個人結果與單人查詢相同，一併放入快取
+        cache = QueryResultCache.instance()
+        for personnel, result in team_result.results.items():
+            cache.put(QueryResultCache.make_key(roster, personnel, year, month, result.matching_columns,
+                                                result.allocation_policy), result)
+        return team_result
     
     @staticmethod
-    def _build_daily_overtime_summary(daily_records: List[Dict], cross_day_records: Dict[str, float]) -> defaultdict:
-        """建立每日加班時數統計"""
-        final_daily_overtime = defaultdict(float)
+    def calculate_range_overtime_summary(start: Tuple[int, int], end: Tuple[int, int],
+                                         personnel_list: Optional[List[str]] = None,
+                                         policy: Optional[str] = None) -> 'RangeQueryResult':
+        """
+        計算一段期間（季、年或任意月份區間）每個月份的團隊加班時數
         
-        # 加入當天加班時數
-        for record in daily_records:
-            date_str = record['date']
-            current_overtime = record['current_day_overtime']
-            if current_overtime > 0:
-                final_daily_overtime[date_str] += current_overtime
+        已登錄月份班表（RosterRegistry.periods）的月份使用該月班表，其餘使用目前班表。
+        需要 session 狀態的部分（班表、手動班次、自定義假日）在呼叫端執行緒準備，
+        各月份的時數計算以執行緒池平行處理。
         
-        # 加入跨天時數
-        for date_str, cross_hours in cross_day_records.items():
-            final_daily_overtime[date_str] += cross_hours
+        相鄰月份使用不同的月份班表時（RosterRegistry.carry_roster），月底跨日時段依序傳給下一個月份：
+        起始狀態取自前一個月份已取得的最後一日班次，只有第一個月份需要另外讀取上個月最後一日
+        （不重算之前的月份）。
         
-        return final_daily_overtime
-    
-    @staticmethod
-    def _calculate_weekday_weekend_hours(final_daily_overtime: Dict[str, float], year: int, month: int) -> Tuple[float, float]:
-        """計算平日和假日總時數"""
-        weekday_hours = 0.0
-        weekend_hours = 0.0
+        Args:
+            start: 起始 (年, 月)
+            end: 結束 (年, 月)（含）
+            personnel_list: 人事號列表（預設 Config.ALLOWED_PERSONNEL）
+            policy: 平日時數分配規則名稱（預設 Config.ALLOCATION_POLICY）
+            
+        Returns:
+            期間查詢結果物件
+        """
+        allocation_policy = AllocationEngine.get_policy(policy)
+        registry = RosterRegistry.instance()
+        periods = registry.periods()
+        session_roster = SessionStateManager.get_roster()
+        
+        sources = {}
+        futures = []
+        columns_by_roster = {}  # 同一份班表的匹配欄位只查一次
+        
+        def month_roster(year: int, month: int) -> Optional[RosterEntry]:
+            return registry.current(periods.get(f"{year}-{month:02d}")) or session_roster
+        
+        def match_columns(roster: RosterEntry) -> Tuple[Dict[str, List[int]], List[str]]:
+            if id(roster) not in columns_by_roster:
+                columns_by_roster[id(roster)] = OvertimeCalculator._match_team_columns(roster.df, personnel_list)
+            return columns_by_roster[id(roster)]
+        
+        # 第一個月份的起始狀態：上個月份班表最後一日的有效班次
+        carries = {}
+        previous_year, previous_month = (start[0] - 1, 12) if start[1] == 1 else (start[0], start[1] - 1)
+        previous_roster = registry.carry_roster(previous_year, previous_month, session_roster)
+        if previous_roster is not None:
+            carries = DataProcessor.resolve_team_month_carries(
+                previous_roster.df, previous_roster.shift_dict, match_columns(previous_roster)[0], previous_year, previous_month
+            )
         
-        for date_str, total_hours in final_daily_overtime.items():
-            try:
-                date_parts = date_str.split('/')
-                check_year = int(date_parts[0])
-                check_month = int(date_parts[1])
-                check_day = int(date_parts[2])
+        # 每準備好一個月份就送入執行緒池，與下一個月份的準備重疊
+        with ThreadPoolExecutor(max_workers=min(Config.RANGE_QUERY_MAX_WORKERS, os.cpu_count() or 1)) as executor:
+            for year, month in DateHelper.get_month_span(start, end):
+                roster = month_roster(year, month)
+                if roster is None:
+                    carries = {}
+                    continue
+                sources[(year, month)] = roster.sheet_id
                 
-                _, is_weekend = DateHelper.get_day_type(check_year, check_month, check_day)
+                team_columns, missing = match_columns(roster)
+                team_shifts = DataProcessor.resolve_team_month_shifts(roster.df, team_columns, year, month) if team_columns else {}
                 
-                if is_weekend:
-                    weekend_hours += total_hours
-                else:
-                    weekday_hours += total_hours
-            
-            except (ValueError, IndexError):
-                continue
-        
-        return weekday_hours, weekend_hours
+                carry_out = registry.carry_roster(year, month, session_roster) is not None
+                futures.append(executor.submit(
+                    OvertimeCalculator._compute_team_month, year, month, team_columns, missing, team_shifts,
+                    carries, carry_out, roster.shift_dict, DailyOvertime.for_month(year, month), allocation_policy
+                ))
+                
+                # 傳遞時 roster 即為該月份的月份班表（carry_roster 返回的班表）
+                carries = {
+                    personnel: MonthCarry.from_shift(month_shifts.effective[-1], roster.shift_dict)
+                    for personnel, month_shifts in team_shifts.items()
+                } if carry_out else {}
+        
+        months = {}
+        for future in futures:
+            team_result = future.result()
+            months[(team_result.year, team_result.month)] = team_result
+        
+        return RangeQueryResult(start=start, end=end, months=months, sources=sources,
+                                allocation_policy=allocation_policy.name)
     
     @staticmethod
-    def _adjust_weekday_hours(final_daily_overtime: defaultdict, weekday_hours: float, worked_weekdays: set, year: int, month: int) -> Tuple[defaultdict, float]:
-        """調整平日加班時數（46小時限制和自動補足）"""
-        # 超過46小時則減少
-        if weekday_hours > Config.MAX_WEEKDAY_HOURS:
-            final_daily_overtime, weekday_hours = OvertimeCalculator._reduce_excess_hours(
-                final_daily_overtime, weekday_hours, year, month
-            )
+    def _match_team_columns(df: pd.DataFrame, personnel_list: Optional[List[str]]) -> Tuple[Dict[str, List[int]], List[str]]:
+        """取得各人的匹配欄位，返回 ({人事號: 欄位列表}, 班表中找不到的人事號)"""
+        roster_columns = DataProcessor.get_roster_index(df).columns
+        team_columns = {}
+        missing = []
+        for personnel in (personnel_list if personnel_list is not None else Config.ALLOWED_PERSONNEL):
+            matching_columns = list(roster_columns.get(personnel, ()))
+            if matching_columns:
+                team_columns[personnel] = matching_columns
+            else:
+                missing.append(personnel)
+        return team_columns, missing
+    
+    @staticmethod
+    def _compute_team_month(year: int, month: int, team_columns: Dict[str, List[int]], missing: List[str],
+                            team_shifts: Dict[str, MonthShifts], carry_in: Dict[str, MonthCarry], carry_out: bool,
+                            shift_dict: Dict[str, ShiftInfo], template: DailyOvertime,
+                            allocation_policy: AllocationPolicy) -> TeamQueryResult:
+        """
+        以準備好的整月班次計算團隊結果（不讀取 session 狀態，可在背景執行緒執行）
         
-        # 少於46小時則自動補足
-        elif weekday_hours < Config.MAX_WEEKDAY_HOURS:
-            final_daily_overtime, weekday_hours = OvertimeCalculator._add_missing_hours(
-                final_daily_overtime, weekday_hours, worked_weekdays, year, month
+        Args:
+            year: 年份
+            month: 月份
+            team_columns: {人事號: 匹配的欄位列表}
+            missing: 班表中找不到的人事號
+            team_shifts: {人事號: 整月班次}
+            carry_in: {人事號: 上個月最後一日班次跨入第 1 日的時段}（沒有的人員不計）
+            carry_out: 月底跨到隔月 1 日的時段是否傳給隔月計算（見 RosterRegistry.carry_roster）
+            shift_dict: 班種字典
+            template: 該月份的空白時數表（提供日期類型）
+            allocation_policy: 分配規則
+            
+        Returns:
+            團隊查詢結果物件
+        """
+        if not team_shifts:
+            return TeamQueryResult(year=year, month=month, results={}, missing=missing,
+                                   allocation_policy=allocation_policy.name)
+        
+        days_in_month = template.days_in_month
+        
+        # 各人班次代碼統一到同一張代碼表（手動設定可能各自擴充代碼表）
+        code_ids = {}
+        remaps = {}
+        codes = np.zeros((len(team_shifts), days_in_month), dtype=np.intp)
+        for person_idx, month_shifts in enumerate(team_shifts.values()):
+            remap = remaps.get(id(month_shifts.code_table))
+            if remap is None:
+                remap = np.array([code_ids.setdefault(shift, len(code_ids)) for shift in month_shifts.code_table], dtype=np.intp)
+                remaps[id(month_shifts.code_table)] = remap
+            codes[person_idx] = remap[month_shifts.effective_codes]
+        code_table = list(code_ids)
+        
+        # 當日與前一日的班次代碼（最後一格為隔月 1 日，只有月底的跨日時段）
+        blank = code_ids.get("", -1)
+        padding = np.full((len(codes), 1), blank, dtype=np.intp)
+        current = np.hstack([codes, padding])
+        previous = np.hstack([padding, codes])
+        
+        hours, own_hours = OvertimeCalculator._build_pair_hours(code_table, shift_dict, previous, current)
+        has_own = own_hours[current] > 0
+        
+        # 第 1 日加入上個月最後一日的跨日時段（上個月的班種可能來自另一份班表，逐人合併）
+        carry_in_hours = np.zeros(len(codes))
+        for person_idx, personnel in enumerate(team_shifts):
+            carry = carry_in.get(personnel)
+            if carry is not None and carry.hours > 0:
+                first_shift = code_table[codes[person_idx, 0]]
+                hours[person_idx, 0] = OvertimeCalculator._pair_hours(
+                    carry.shift_info, shift_dict.get(first_shift) if first_shift else None
+                )
+                carry_in_hours[person_idx] = carry.hours
+        
+        # 月底跨到隔月 1 日的時數傳給隔月時，不列入本月統計
+        carry_out_hours = np.zeros(len(codes))
+        if carry_out:
+            carry_out_hours = hours[:, days_in_month].copy()
+            hours[:, days_in_month] = 0.0
+        
+        # 有上班的平日：有效班次非空白（不論是否在班種字典中）
+        worked = (codes != blank) & ~template.is_weekend[:days_in_month]
+        
+        # 記錄順序：當日有加班的日期在前，只有跨日時段的日期在後（與 build_month_timelines 相同）
+        rows, slots = np.nonzero(hours > 0)
+        sort_idx = np.lexsort((slots, ~has_own[rows, slots], rows))
+        orders = OvertimeCalculator._split_by_row(slots[sort_idx], rows[sort_idx], len(codes))
+        worked_lists = OvertimeCalculator._split_by_row(*np.nonzero(worked)[::-1], len(codes))
+        
+        # 每人的時數各自複製（結果放入共用快取，不可保留整張團隊時數表）
+        dailies = {}
+        worked_weekdays = {}
+        for person_idx, personnel in enumerate(team_shifts):
+            dailies[personnel] = DailyOvertime(
+                year=year,
+                month=month,
+                hours=hours[person_idx].copy(),
+                is_weekend=template.is_weekend,
+                weekdays=template.weekdays,
+                day_types=template.day_types,
+                order=orders[person_idx]
+            )
+            worked_weekdays[personnel] = set(worked_lists[person_idx])
+        
+        weekend_totals = np.where(template.is_weekend, hours, 0.0).sum(axis=1)
+        weekday_totals = AllocationEngine.rebalance_team(dailies, worked_weekdays, allocation_policy)
+        
+        results = {}
+        for person_idx, personnel in enumerate(team_shifts):
+            weekday_hours = weekday_totals[personnel]
+            weekend_hours = float(weekend_totals[person_idx])
+            results[personnel] = QueryResult(
+                target_personnel=personnel,
+                year=year,
+                month=month,
+                matching_columns=team_columns[personnel],
+                daily=dailies[personnel],
+                weekday_hours=weekday_hours,
+                weekend_hours=weekend_hours,
+                total_hours=weekday_hours + weekend_hours,
+                allocation_policy=allocation_policy.name,
+                carry_in_hours=float(carry_in_hours[person_idx]),
+                carry_out_hours=float(carry_out_hours[person_idx])
             )
         
-        return final_daily_overtime, weekday_hours
+        return TeamQueryResult(year=year, month=month, results=results, missing=missing,
+                               allocation_policy=allocation_policy.name)
     
     @staticmethod
-    def _reduce_excess_hours(final_daily_overtime: defaultdict, weekday_hours: float, year: int, month: int) -> Tuple[defaultdict, float]:
-        """減少超過46小時的部分"""
-        # 收集平日的時數資料
-        weekday_dates = []
-        for date_str, hours in final_daily_overtime.items():
-            if hours > 0:
-                try:
-                    date_parts = date_str.split('/')
-                    check_year = int(date_parts[0])
-                    check_month = int(date_parts[1])
-                    check_day = int(date_parts[2])
-                    
-                    _, is_weekend = DateHelper.get_day_type(check_year, check_month, check_day)
-                    
-                    if not is_weekend:
-                        weekday_dates.append((date_str, hours))
-                except (ValueError, IndexError):
-                    continue
+    def _split_by_row(values: np.ndarray, rows: np.ndarray, row_count: int) -> List[List[int]]:
+        """將依列排序的 (列, 值) 拆成每列一個列表"""
+        ends = np.cumsum(np.bincount(rows, minlength=row_count)).tolist()
+        values = values.tolist()
+        return [values[begin:end] for begin, end in zip([0] + ends[:-1], ends)]
+    
+    @staticmethod
+    def _build_pair_hours(code_table: List[str], shift_dict: Dict[str, ShiftInfo],
+                          previous: np.ndarray, current: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        以「前一日班次 × 當日班次」時數表查出每日時數
         
-        # 按時數排序，優先刪除較小的時數
-        weekday_dates.sort(key=lambda x: x[1])
+        只為實際出現的班次組合建立 DayTimeline（前一日跨日時段 + 當日兩個時段，重疊只計算一次）。
         
-        excess_hours = weekday_hours - Config.MAX_WEEKDAY_HOURS
-        removed_hours = 0.0
+        Args:
+            code_table: 代碼 -> 班次
+            shift_dict: 班種字典
+            previous: 前一日班次代碼（-1 表示無）
+            current: 當日班次代碼（-1 表示無）
+            
+        Returns:
+            (每日時數, 各代碼當日時段時數)
+        """
+        shift_infos = [shift_dict.get(shift) if shift else None for shift in code_table]
+        own_hours = np.array([OvertimeCalculator._own_hours(info) for info in shift_infos] + [0.0])
         
-        for date_str, hours in weekday_dates:
-            if removed_hours + hours <= excess_hours:
-                # 完全移除這一天
-                final_daily_overtime[date_str] = 0.0
-                removed_hours += hours
-                weekday_hours -= hours
-                
-                if removed_hours >= excess_hours:
-                    break
-            elif removed_hours < excess_hours:
-                # 部分移除
-                remaining_to_remove = excess_hours - removed_hours
-                final_daily_overtime[date_str] -= remaining_to_remove
-                weekday_hours -= remaining_to_remove
-                break
+        # 代碼 -1（無班次）對應到最後一格
+        width = len(code_table) + 1
+        pair_keys = np.where(previous < 0, width - 1, previous) * width + np.where(current < 0, width - 1, current)
+        unique_keys, inverse = np.unique(pair_keys, return_inverse=True)
         
-        return final_daily_overtime, weekday_hours
+        pair_hours = np.zeros(len(unique_keys))
+        for key_idx, key in enumerate(unique_keys.tolist()):
+            previous_info = shift_infos[key // width] if key // width < len(code_table) else None
+            current_info = shift_infos[key % width] if key % width < len(code_table) else None
+            pair_hours[key_idx] = OvertimeCalculator._pair_hours(previous_info, current_info)
+        
+        return pair_hours[inverse].reshape(pair_keys.shape), own_hours
+    
+    @staticmethod
+    def _own_hours(shift_info: Optional[ShiftInfo]) -> float:
+        """班次本身（不含跨日）的加班時數"""
+        return shift_info.hours_1 + shift_info.hours_2 if shift_info else 0.0
+    
+    @staticmethod
+    def _pair_hours(previous_info: Optional[ShiftInfo], current_info: Optional[ShiftInfo]) -> float:
+        """某日的合併時數：前一日班次的跨日時段 + 當日兩個時段（重疊只計算一次）"""
+        timeline = DayTimeline()
+        if previous_info and previous_info.cross_day_string:
+            timeline.add(previous_info.cross_day_string, previous_info.cross_day_interval, previous_info.cross_day_overtime)
+        if current_info:
+            for label, interval, hours in (
+                (current_info.time_string_1, current_info.interval_1, current_info.hours_1),
+                (current_info.time_string_2, current_info.interval_2, current_info.hours_2),
+            ):
+                if label:
+                    timeline.add(label, interval, hours)
+        return timeline.hours
     
     @staticmethod
-    def _add_missing_hours(final_daily_overtime: defaultdict, weekday_hours: float, worked_weekdays: set, year: int, month: int) -> Tuple[defaultdict, float]:
-        """自動補足平日加班時數到46小時"""
-        shortage = Config.MAX_WEEKDAY_HOURS - weekday_hours
+    def build_month_timelines(month_shifts: MonthShifts, shift_dict: Dict[str, ShiftInfo], year: int, month: int,
+                              carry_in: Optional[MonthCarry] = None) -> Dict[int, DayTimeline]:
+        """
+        建立整月各日的加班時段
         
-        # 找出可用的平日
-        available_weekdays = []
-        for day in DateHelper.get_month_date_range(year, month):
-            try:
-                check_date = date(year, month, day)
-                date_str = f"{year}/{month:02d}/{day:02d}"
-                day_type, is_weekend = DateHelper.get_day_type(year, month, day)
-                weekday_num = check_date.weekday()
-                
-                if not is_weekend and date_str not in worked_weekdays:
-                    # 設定優先級
-                    if weekday_num in Config.HIGH_PRIORITY_WEEKDAYS:
-                        priority = 1
-                    elif weekday_num in Config.MEDIUM_PRIORITY_WEEKDAYS:
-                        priority = 2
-                    else:
-                        priority = 3
-                    
-                    available_weekdays.append((date_str, day_type, weekday_num, priority))
-            except ValueError:
-                continue
+        當日兩個加班欄位歸入當天，跨日欄位歸入隔天（上個月最後一日的跨日欄位歸入第 1 日）；
+        同一天重疊或重複的時段合併後只計算一次。
+        
+        Args:
+            month_shifts: 整月有效班次
+            shift_dict: 班種字典
+            year: 年份
+            month: 月份
+            carry_in: 上個月最後一日班次跨入第 1 日的時段（None 表示不計）
+            
+        Returns:
+            日序索引（day - 1，月底跨日為當月天數）-> 當日時段
+            （當日有加班的日期在前，只有跨日時段的日期在後）
+        """
+        timelines = {}
+        own_slots = []
         
-        # 按優先順序排序
-        available_weekdays.sort(key=lambda x: (x[3], x[0]))
+        carry_info = carry_in.shift_info if carry_in else None
+        if carry_info and carry_info.cross_day_string:
+            timelines[0] = DayTimeline()
+            timelines[0].add(carry_info.cross_day_string, carry_info.cross_day_interval, carry_info.cross_day_overtime)
         
-        if available_weekdays:
-            days_needed = int(shortage / Config.AUTO_ADD_HOURS) + (1 if shortage % Config.AUTO_ADD_HOURS > 0 else 0)
+        for day in DateHelper.get_month_date_range(year, month):
+            effective_shift = month_shifts.effective[day - 1]
+            if not effective_shift or effective_shift not in shift_dict:
+                continue
+            
+            shift_info = shift_dict[effective_shift]
+            slot = day - 1
+            
+            for label, interval, hours in (
+                (shift_info.time_string_1, shift_info.interval_1, shift_info.hours_1),
+                (shift_info.time_string_2, shift_info.interval_2, shift_info.hours_2),
+            ):
+                if label:
+                    timelines.setdefault(slot, DayTimeline()).add(label, interval, hours)
+            if shift_info.hours_1 + shift_info.hours_2 > 0:
+                own_slots.append(slot)
             
-            for i, (date_str, day_type, weekday_num, priority) in enumerate(available_weekdays):
-                if i < days_needed:
-                    final_daily_overtime[date_str] += Config.AUTO_ADD_HOURS
-                    weekday_hours += Config.AUTO_ADD_HOURS
+            # 跨天時段歸入隔天
+            if shift_info.cross_day_string:
+                timelines.setdefault(slot + 1, DayTimeline()).add(
+                    shift_info.cross_day_string, shift_info.cross_day_interval, shift_info.cross_day_overtime
+                )
         
-        return final_daily_overtime, weekday_hours
+        # 維持原本的日期順序（刪減超額時數時，同時數的日期依此順序處理）
+        ordered = {slot: timelines[slot] for slot in own_slots}
+        ordered.update(timelines)
+        return ordered
+    
+    @staticmethod
+    def _calculate_weekday_weekend_hours(daily: 'DailyOvertime') -> Tuple[float, float]:
+        """計算平日和假日總時數"""
+        weekday_hours = float(AllocationEngine.weekday_totals(daily.hours, daily.is_weekend))
+        weekend_hours = float(np.where(daily.is_weekend, daily.hours, 0.0).sum())
+        return weekday_hours, weekend_hours
 
 class TextProcessor:
     """文字處理相關功能"""
@@ -953,23 +4095,22 @@ class SchedulePreview:
         Returns:
             預覽資料物件
         """
-        df = st.session_state.df
         preview_data = []
         
+        # 整月有效班次（優先使用手動設定）
+        month_shifts = SessionStateManager.get_month_shifts(target_personnel, year, month, matching_columns)
+        day_types = DateHelper.get_month_day_types(year, month)
+        
         for day in DateHelper.get_month_date_range(year, month):
             try:
                 current_date = date(year, month, day)
                 date_str = f"{year}/{month:02d}/{day:02d}"
-                day_type, is_weekend = DateHelper.get_day_type(year, month, day)
+                day_type, is_weekend = day_types[day - 1]
                 
-                # 取得有效班次（優先使用手動設定）
-                effective_shift = DataProcessor.get_effective_shift(
-                    df, target_personnel, year, month, day, matching_columns
-                )
+                effective_shift = month_shifts.effective[day - 1]
                 
                 # 檢查是否為手動修改的班次
-                manual_shift = SessionStateManager.get_manual_shift(target_personnel, year, month, day)
-                is_manual = manual_shift is not None
+                is_manual = bool(month_shifts.manual_mask[day - 1])
                 
                 # 正確處理班次顯示
                 shift_display = effective_shift if effective_shift else '休假'
@@ -1040,14 +4181,18 @@ class ShiftEditor:
         # 渲染編輯表格
         ShiftEditor._render_edit_table(preview_data, shift_options)
         
+        # 即時加班時數（只重算修改的日期）
+        ShiftEditor._render_live_totals(preview_data)
+        
         # 顯示修改統計
         ShiftEditor._render_modification_stats(preview_data)
     
     @staticmethod
     def _get_available_shifts() -> List[str]:
         """取得可用的班次選項"""
-        if 'shift_dict' in st.session_state and st.session_state.shift_dict:
-            return sorted(list(st.session_state.shift_dict.keys()))
+        shift_dict = SessionStateManager.get_shift_dict()
+        if shift_dict:
+            return sorted(list(shift_dict.keys()))
         return []
     
     @staticmethod
@@ -1055,8 +4200,11 @@ class ShiftEditor:
         """渲染編輯表格（修復版）"""
         st.subheader("📝 班次編輯表格")
         
-        df = st.session_state.df
+        df = SessionStateManager.get_df()
         matching_columns = DataProcessor.find_matching_personnel_columns(df, preview_data.personnel)
+        state = SessionStateManager.get_month_working_state(
+            preview_data.personnel, preview_data.year, preview_data.month, matching_columns
+        )
         
         # 分週顯示
         weeks = ShiftEditor._group_days_by_week(preview_data.data, preview_data.year, preview_data.month)
@@ -1073,28 +4221,10 @@ class ShiftEditor:
                         day = day_data['day']
                         
                         # 取得原始班次（從原始資料庫中）
-                        original_shift = ""
-                        for col_idx in matching_columns:
-                            column_data = df.iloc[:, col_idx]
-                            row_idx = day + 2
-                            
-                            if row_idx < len(column_data):
-                                value = column_data.iloc[row_idx]
-                                
-                                # 更嚴格的空值檢查
-                                if pd.isna(value) or value is None:
-                                    continue
-                                    
-                                shift_value = str(value).strip()
-                                
-                                if shift_value and shift_value.lower() not in ['nan', 'none', '']:
-                                    original_shift = shift_value
-                                    break
+                        original_shift = state.original[day - 1]
                         
                         # 取得目前有效的班次（可能是手動修改過的）
-                        effective_shift = DataProcessor.get_effective_shift(
-                            df, preview_data.personnel, preview_data.year, preview_data.month, day, matching_columns
-                        )
+                        effective_shift = state.effective[day - 1]
                         
                         # 處理顯示用的班次（空班次顯示為空，而不是"休假"）
                         display_shift = effective_shift if effective_shift else ""
@@ -1128,9 +4258,7 @@ class ShiftEditor:
                         )
                         
                         # 顯示修改標記（只檢查是否真的有手動修改）
-                        manual_shift = SessionStateManager.get_manual_shift(
-                            preview_data.personnel, preview_data.year, preview_data.month, day
-                        )
+                        manual_shift = state.overrides.get(f"{preview_data.year}/{preview_data.month:02d}/{day:02d}")
                         if manual_shift is not None:
                             # 進一步檢查手動設定的值是否真的與原始值不同
                             if manual_shift != original_shift:
@@ -1195,6 +4323,24 @@ class ShiftEditor:
         if key in st.session_state.manual_shifts:
             del st.session_state.manual_shifts[key]
     
+    @staticmethod
+    def _render_live_totals(preview_data: PreviewData):
+        """顯示套用目前修改後的加班時數（由整月計算中間結果重新套用 46 小時規則）"""
+        matching_columns = DataProcessor.find_matching_personnel_columns(SessionStateManager.get_df(), preview_data.personnel)
+        result = OvertimeCalculator.calculate_overtime_summary(
+            preview_data.personnel, preview_data.year, preview_data.month, matching_columns,
+            st.session_state.allocation_policy
+        )
+        
+        st.subheader("⏱️ 即時加班時數")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("平日加班時數", f"{result.weekday_hours:.1f} 小時")
+        with col2:
+            st.metric("假日加班時數", f"{result.weekend_hours:.1f} 小時")
+        with col3:
+            st.metric("總加班時數", f"{result.total_hours:.1f} 小時")
+    
     @staticmethod
     def _render_modification_stats(preview_data: PreviewData):
         """顯示修改統計資訊"""
@@ -1203,233 +4349,333 @@ class ShiftEditor:
         if key in st.session_state.manual_shifts:
             modifications = st.session_state.manual_shifts[key]
             
-            if modifications:
-                st.subheader("📊 修改統計")
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.metric("本月修改天數", f"{len(modifications)} 天")
-                
-                with col2:
-                    work_days = sum(1 for shift in modifications.values() if shift.strip())
-                    st.metric("修改為上班", f"{work_days} 天")
-                
-                # 顯示修改明細
-                with st.expander("📋 修改明細", expanded=False):
-                    for date_str, shift in sorted(modifications.items()):
-                        display_shift = shift if shift.strip() else "休假"
-                        st.write(f"• {date_str}: {display_shift}")
-
-class ExcelExporter:
-    """Excel 匯出功能"""
+            if modifications:
+                st.subheader("📊 修改統計")
+                
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.metric("本月修改天數", f"{len(modifications)} 天")
+                
+                with col2:
+                    work_days = sum(1 for shift in modifications.values() if shift.strip())
+                    st.metric("修改為上班", f"{work_days} 天")
+                
+                # 顯示修改明細
+                with st.expander("📋 修改明細", expanded=False):
+                    for date_str, shift in sorted(modifications.items()):
+                        display_shift = shift if shift.strip() else "休假"
+                        st.write(f"• {date_str}: {display_shift}")
+
+class ExcelExporter:
+    """Excel 匯出功能"""
+    
+    @staticmethod
+    def export_to_excel(query_result: QueryResult) -> Tuple[bool, Union[io.BytesIO, str], float, float, float, int]:
+        """
+        導出Excel報表（支援手動修改的班次）
+        
+        Args:
+            query_result: 查詢結果物件
+            
+        Returns:
+            (成功標誌, 檔案內容或錯誤訊息, 平日總時數, 假日總時數, 總時數, 資料行數)
+        """
+        try:
+            shift_dict = SessionStateManager.get_shift_dict()
+            
+            # 各日時段與原始時間字串（考慮手動修改）
+            month_shifts = SessionStateManager.get_month_shifts(
+                query_result.target_personnel, query_result.year, query_result.month, query_result.matching_columns
+            )
+            year, month = query_result.year, query_result.month
+            previous_year, previous_month = (year - 1, 12) if month == 1 else (year, month - 1)
+            carry_in = SessionStateManager.get_month_carries(
+                [query_result.target_personnel], previous_year, previous_month
+            )[query_result.target_personnel]
+            timelines = OvertimeCalculator.build_month_timelines(month_shifts, shift_dict, year, month, carry_in)
+            
+            # 建立Excel資料
+            excel_data = ExcelExporter._build_excel_data(
+                timelines, query_result.daily, query_result.year, query_result.month
+            )
+            
+            # 生成Excel檔案
+            output = ExcelExporter._create_excel_file(excel_data, query_result.target_personnel)
+            
+            # 計算統計資料
+            total_weekday = sum(row['平日時數'] for row in excel_data)
+            total_weekend = sum(row['假日時數'] for row in excel_data)
+            total_hours = total_weekday + total_weekend
+            
+            return True, output, total_weekday, total_weekend, total_hours, len(excel_data)
+            
+        except Exception as e:
+            return False, f"Excel匯出失敗: {str(e)}", 0, 0, 0, 0
+    
+    @staticmethod
+    def _build_excel_data(timelines: Dict[int, DayTimeline], daily: DailyOvertime, year: int, month: int) -> List[Dict]:
+        """建立Excel資料"""
+        excel_data = []
+        
+        for slot in range(daily.days_in_month):
+            timeline = timelines.get(slot) or DayTimeline()
+            original_time_str = ",".join(timeline.labels)
+            
+            weekday_hours = 0.0
+            weekend_hours = 0.0
+            
+            if daily.has(slot):
+                total_hours = float(daily.hours[slot])
+                
+                if daily.is_weekend[slot]:
+                    weekend_hours = total_hours
+                    # 應用修改後的假日邏輯
+                    original_time_str, weekend_hours = ExcelExporter._apply_weekend_logic(
+                        timeline, original_time_str, weekend_hours
+                    )
+                else:
+                    weekday_hours = total_hours
+            
+            # 處理工作類型
+            work_type = ""
+            if daily.has(slot) and not original_time_str:
+                original_time_str = "14:00-16:00(會議)"
+                work_type = "會議"
+            else:
+                work_type = TextProcessor.extract_chinese_note(original_time_str)
+            
+            # 只有有資料的日期才加入
+            if original_time_str or weekday_hours > 0 or weekend_hours > 0:
+                excel_data.append({
+                    '日期': f"{slot + 1:02d}",
+                    '原始時間字串': original_time_str,
+                    '平日時數': weekday_hours,
+                    '假日時數': weekend_hours,
+                    '工作類型': work_type
+                })
+        
+        return excel_data
+    
+    @staticmethod
+    def _apply_weekend_logic(timeline: DayTimeline, original_time_str: str, weekend_hours: float) -> Tuple[str, float]:
+        """應用修改後的假日加班邏輯（時數不足時補一段撰寫病歷時間）"""
+        if weekend_hours <= Config.WEEKEND_MIN_HOURS_THRESHOLD and weekend_hours > 0:
+            start_minute, end_minute = ExcelExporter._place_padding_block(timeline)
+            new_time_part = f"{DayTimeline.format_minutes(start_minute)}-{DayTimeline.format_minutes(end_minute)}(撰寫病歷)"
+            
+            anchor = timeline.anchor
+            if not original_time_str:
+                original_time_str = new_time_part
+            elif anchor is not None and start_minute >= anchor[1]:
+                original_time_str = original_time_str + "," + new_time_part
+            else:
+                original_time_str = new_time_part + "," + original_time_str
+            
+            weekend_hours += Config.AUTO_ADD_HOURS
+        
+        return original_time_str, weekend_hours
+    
+    @staticmethod
+    def _place_padding_block(timeline: DayTimeline) -> Tuple[int, int]:
+        """
+        決定補時段的位置
+        
+        第一個時段在 05:00 前結束時接在其後，否則放在其前；
+        無法定位時預設 12:00。優先位置與既有時段重疊時改放最近的空檔。
+        
+        Args:
+            timeline: 當日時段
+            
+        Returns:
+            (開始分鐘, 結束分鐘)
+        """
+        duration = int(Config.AUTO_ADD_HOURS * 60)
+        anchor = timeline.anchor
+        
+        if anchor is None:
+            preferred_start = 12 * 60
+        elif (anchor[1] % DayTimeline.MINUTES_PER_DAY) // 60 < Config.EARLY_MORNING_CUTOFF:
+            preferred_start = anchor[1]
+        else:
+            preferred_start = anchor[0] - duration
+        
+        start_minute = timeline.find_gap(duration, preferred_start)
+        if start_minute is None:
+            start_minute = preferred_start
+        
+        return start_minute, start_minute + duration
     
     @staticmethod
-    def export_to_excel(query_result: QueryResult) -> Tuple[bool, Union[io.BytesIO, str], float, float, float, int]:
+    def export_team_to_excel(team_result: TeamQueryResult) -> Tuple[bool, Union[io.BytesIO, str], int]:
         """
-        導出Excel報表（支援手動修改的班次）
+        導出團隊報表（第一頁為團隊總表，之後每人一頁明細）
         
         Args:
-            query_result: 查詢結果物件
+            team_result: 團隊查詢結果物件
             
         Returns:
-            (成功標誌, 檔案內容或錯誤訊息, 平日總時數, 假日總時數, 總時數, 資料行數)
+            (成功標誌, 檔案內容或錯誤訊息, 人數)
         """
         try:
-            df = st.session_state.df
-            shift_dict = st.session_state.shift_dict
-            
-            # 收集原始時間字串（考慮手動修改）
-            date_time_strings = ExcelExporter._collect_time_strings_with_manual(
-                df, shift_dict, query_result.matching_columns, query_result.year, query_result.month, query_result.target_personnel
+            shift_dict = SessionStateManager.get_shift_dict()
+            team_columns = {personnel: result.matching_columns for personnel, result in team_result.results.items()}
+            team_shifts = SessionStateManager.get_team_month_shifts(team_columns, team_result.year, team_result.month)
+            previous_year, previous_month = (
+                (team_result.year - 1, 12) if team_result.month == 1 else (team_result.year, team_result.month - 1)
             )
+            carry_in = SessionStateManager.get_month_carries(list(team_columns), previous_year, previous_month)
             
-            # 建立Excel資料
-            excel_data = ExcelExporter._build_excel_data(
-                date_time_strings, query_result.daily_breakdown, query_result.year, query_result.month
-            )
+            output = io.BytesIO()
+            wb = openpyxl.Workbook()
+            summary_ws = wb.active
+            summary_ws.title = "團隊總表"
+            ExcelExporter._write_team_summary_sheet(summary_ws, team_result)
             
-            # 生成Excel檔案
-            output = ExcelExporter._create_excel_file(excel_data, query_result.target_personnel)
+            for personnel, result in team_result.results.items():
+                timelines = OvertimeCalculator.build_month_timelines(
+                    team_shifts[personnel], shift_dict, team_result.year, team_result.month, carry_in[personnel]
+                )
+                excel_data = ExcelExporter._build_excel_data(timelines, result.daily, result.year, result.month)
+                ExcelExporter._write_detail_sheet(wb.create_sheet(f"{personnel}加班統計"), excel_data)
             
-            # 計算統計資料
-            total_weekday = sum(row['平日時數'] for row in excel_data)
-            total_weekend = sum(row['假日時數'] for row in excel_data)
-            total_hours = total_weekday + total_weekend
+            wb.save(output)
+            output.seek(0)
             
-            return True, output, total_weekday, total_weekend, total_hours, len(excel_data)
+            return True, output, len(team_result.results)
             
         except Exception as e:
-            return False, f"Excel匯出失敗: {str(e)}", 0, 0, 0, 0
+            return False, f"Excel匯出失敗: {str(e)}", 0
     
     @staticmethod
-    def _collect_time_strings_with_manual(df: pd.DataFrame, shift_dict: Dict, matching_columns: List[int], year: int, month: int, personnel: str) -> Dict[str, List[str]]:
-        """收集原始時間字串（支援手動修改的班次）"""
-        date_time_strings = defaultdict(list)
+    def export_range_to_excel(range_result: RangeQueryResult) -> Tuple[bool, Union[io.BytesIO, str], int]:
+        """
+        導出期間報表（期間總表與每人每月明細）
         
-        for day in DateHelper.get_month_date_range(year, month):
-            try:
-                current_date = date(year, month, day)
-                date_str = f"{year}/{month:02d}/{day:02d}"
-                
-                # 取得有效班次（優先使用手動設定）
-                effective_shift = DataProcessor.get_effective_shift(
-                    df, personnel, year, month, day, matching_columns
-                )
-                
-                if effective_shift in shift_dict and effective_shift:
-                    shift_info = shift_dict[effective_shift]
-                    
-                    # 收集當天時間字串
-                    current_day_strings = []
-                    
-                    if pd.notna(shift_info.overtime_hours_1) and str(shift_info.overtime_hours_1).strip():
-                        current_day_strings.append(str(shift_info.overtime_hours_1).strip())
-                    
-                    if pd.notna(shift_info.overtime_hours_2) and str(shift_info.overtime_hours_2).strip():
-                        current_day_strings.append(str(shift_info.overtime_hours_2).strip())
-                    
-                    if current_day_strings:
-                        date_time_strings[date_str].extend(current_day_strings)
-                    
-                    # 處理跨天時間字串
-                    if pd.notna(shift_info.cross_day_hours) and str(shift_info.cross_day_hours).strip():
-                        cross_day_str = str(shift_info.cross_day_hours).strip()
-                        next_date = current_date + timedelta(days=1)
-                        next_date_str = f"{next_date.year}/{next_date.month:02d}/{next_date.day:02d}"
-                        date_time_strings[next_date_str].append(cross_day_str)
+        Args:
+            range_result: 期間查詢結果物件
             
-            except ValueError:
-                continue
-        
-        return date_time_strings
+        Returns:
+            (成功標誌, 檔案內容或錯誤訊息, 資料行數)
+        """
+        try:
+            output = io.BytesIO()
+            wb = openpyxl.Workbook()
+            
+            totals = range_result.personnel_totals()
+            summary_rows = [[personnel, weekday, weekend, total] for personnel, (weekday, weekend, total) in totals.items()]
+            summary_ws = wb.active
+            summary_ws.title = "期間總表"
+            ExcelExporter._write_table_sheet(summary_ws, ['人事號', '平日時數', '假日時數', '總時數'], summary_rows, [2, 3, 4])
+            
+            monthly_rows = range_result.monthly_rows()
+            headers = list(monthly_rows[0]) if monthly_rows else ['月份', '人事號', '平日時數', '假日時數', '總時數', '上月跨入時數', '跨入次月時數', '累計總時數']
+            ExcelExporter._write_table_sheet(
+                wb.create_sheet("每月明細"), headers, [list(row.values()) for row in monthly_rows], [3, 4, 5, 6, 7]
+            )
+            
+            wb.save(output)
+            output.seek(0)
+            
+            return True, output, len(monthly_rows)
+            
+        except Exception as e:
+            return False, f"Excel匯出失敗: {str(e)}", 0
     
     @staticmethod
-    def _build_excel_data(date_time_strings: Dict[str, List[str]], daily_breakdown: Dict[str, float], year: int, month: int) -> List[Dict]:
-        """建立Excel資料"""
-        excel_data = []
+    def _write_table_sheet(ws, headers: List[str], rows: List[List[Any]], hour_columns: List[int]):
+        """寫入標題列與資料列（時數欄位靠右、一位小數）"""
+        for col, header in enumerate(headers, 1):
+            cell = ws.cell(row=1, column=col, value=header)
+            cell.alignment = Alignment(horizontal='center', vertical='center')
+            cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+            cell.font = Font(bold=True, color='FFFFFF', size=12)
         
-        for day in DateHelper.get_month_date_range(year, month):
-            try:
-                current_date = date(year, month, day)
-                date_str = f"{year}/{month:02d}/{day:02d}"
-                day_type, is_weekend = DateHelper.get_day_type(year, month, day)
-                
-                time_strings = date_time_strings.get(date_str, [])
-                original_time_str = ",".join(time_strings) if time_strings else ""
-                
-                weekday_hours = 0.0
-                weekend_hours = 0.0
-                
-                if date_str in daily_breakdown:
-                    total_hours = daily_breakdown[date_str]
-                    
-                    if is_weekend:
-                        weekend_hours = total_hours
-                        # 應用修改後的假日邏輯
-                        original_time_str, weekend_hours = ExcelExporter._apply_weekend_logic(
-                            original_time_str, weekend_hours
-                        )
-                    else:
-                        weekday_hours = total_hours
-                
-                # 處理工作類型
-                work_type = ""
-                if date_str in daily_breakdown and not original_time_str:
-                    original_time_str = "14:00-16:00(會議)"
-                    work_type = "會議"
+        thin_border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
+        
+        for row_idx, row_data in enumerate(rows, 2):
+            for col_idx, value in enumerate(row_data, 1):
+                cell = ws.cell(row=row_idx, column=col_idx, value=value)
+                cell.border = thin_border
+                if col_idx in hour_columns:
+                    cell.alignment = Alignment(horizontal='right', vertical='center')
+                    cell.number_format = '0.0'
                 else:
-                    work_type = TextProcessor.extract_chinese_note(original_time_str)
-                
-                # 只有有資料的日期才加入
-                if original_time_str or weekday_hours > 0 or weekend_hours > 0:
-                    excel_data.append({
-                        '日期': f"{day:02d}",
-                        '原始時間字串': original_time_str,
-                        '平日時數': weekday_hours,
-                        '假日時數': weekend_hours,
-                        '工作類型': work_type
-                    })
-            
-            except ValueError:
-                continue
+                    cell.alignment = Alignment(horizontal='center', vertical='center')
         
-        return excel_data
+        for col_idx in range(1, len(headers) + 1):
+            ws.column_dimensions[chr(64 + col_idx)].width = 12
     
     @staticmethod
-    def _apply_weekend_logic(original_time_str: str, weekend_hours: float) -> Tuple[str, float]:
-        """應用修改後的假日加班邏輯"""
-        if weekend_hours <= Config.WEEKEND_MIN_HOURS_THRESHOLD and weekend_hours > 0:
-            if original_time_str:
-                # 提取第一個時間的結束時間
-                first_time_part = original_time_str.split(',')[0]
-                if '-' in first_time_part:
-                    end_time = first_time_part.split('-')[1].strip()
-                    try:
-                        # 解析結束時間
-                        if ':' in end_time:
-                            end_hour = int(end_time.split(':')[0])
-                            end_minute = int(end_time.split(':')[1])
-                        else:
-                            end_hour = int(end_time[:2]) if len(end_time) >= 2 else int(end_time)
-                            end_minute = 0
-                        
-                        # 判斷是在前面加還是後面加
-                        if end_hour < Config.EARLY_MORNING_CUTOFF:
-                            # 結束時間在05:00之前，在後面加2小時
-                            new_start_hour = end_hour
-                            new_start_minute = end_minute
-                            new_end_hour = end_hour + 2
-                            if new_end_hour >= 24:
-                                new_end_hour -= 24
-                            
-                            new_time_part = f"{new_start_hour:02d}:{new_start_minute:02d}-{new_end_hour:02d}:{end_minute:02d}(撰寫病歷)"
-                            original_time_str = original_time_str + "," + new_time_part
-                        else:
-                            # 結束時間在05:00之後，在前面加2小時
-                            start_time = first_time_part.split('-')[0].strip()
-                            if ':' in start_time:
-                                start_hour = int(start_time.split(':')[0])
-                                start_minute = int(start_time.split(':')[1])
-                            else:
-                                start_hour = int(start_time[:2]) if len(start_time) >= 2 else int(start_time)
-                                start_minute = 0
-                            
-                            new_start_hour = start_hour - 2
-                            if new_start_hour < 0:
-                                new_start_hour += 24
-                            
-                            new_time_part = f"{new_start_hour:02d}:{start_minute:02d}-{start_hour:02d}:{start_minute:02d}(撰寫病歷)"
-                            original_time_str = new_time_part + "," + original_time_str
-                        
-                        weekend_hours += Config.AUTO_ADD_HOURS
-                        
-                    except (ValueError, IndexError):
-                        # 解析失敗，使用預設
-                        original_time_str = "12:00-14:00(撰寫病歷)," + original_time_str
-                        weekend_hours += Config.AUTO_ADD_HOURS
+    def _write_team_summary_sheet(ws, team_result: TeamQueryResult):
+        """寫入團隊總表"""
+        headers = ['人事號', '平日時數', '假日時數', '總時數', '加班天數']
+        for col, header in enumerate(headers, 1):
+            cell = ws.cell(row=1, column=col, value=header)
+            cell.alignment = Alignment(horizontal='center', vertical='center')
+            cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+            cell.font = Font(bold=True, color='FFFFFF', size=12)
+        
+        thin_border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
+        
+        rows = [
+            [personnel, result.weekday_hours, result.weekend_hours, result.total_hours, int((result.daily.hours > 0).sum())]
+            for personnel, result in team_result.results.items()
+        ]
+        rows.append(['合計', team_result.weekday_hours, team_result.weekend_hours, team_result.total_hours,
+                     sum(row[4] for row in rows)])
+        
+        for row_idx, row_data in enumerate(rows, 2):
+            for col_idx, value in enumerate(row_data, 1):
+                cell = ws.cell(row=row_idx, column=col_idx, value=value)
+                cell.border = thin_border
+                if col_idx in [2, 3, 4]:
+                    cell.alignment = Alignment(horizontal='right', vertical='center')
+                    cell.number_format = '0.0'
                 else:
-                    original_time_str = "12:00-14:00(撰寫病歷)," + original_time_str
-                    weekend_hours += Config.AUTO_ADD_HOURS
-            else:
-                original_time_str = "12:00-14:00(撰寫病歷)"
-                weekend_hours += Config.AUTO_ADD_HOURS
+                    cell.alignment = Alignment(horizontal='center', vertical='center')
+                if row_idx == len(rows) + 1:
+                    cell.font = Font(bold=True)
         
-        return original_time_str, weekend_hours
+        if team_result.missing:
+            ws.cell(row=len(rows) + 3, column=1, value=f"班表中找不到: {', '.join(team_result.missing)}")
+        
+        column_widths = [12, 12, 12, 12, 12]
+        for col_idx, width in enumerate(column_widths, 1):
+            ws.column_dimensions[chr(64 + col_idx)].width = width
     
     @staticmethod
     def _create_excel_file(excel_data: List[Dict], target_personnel: str) -> io.BytesIO:
         """創建Excel檔案"""
-        df_excel = pd.DataFrame(excel_data)
-        
         # 創建Excel內容到內存
         output = io.BytesIO()
         wb = openpyxl.Workbook()
         ws = wb.active
         ws.title = f"{target_personnel}加班統計"
+        ExcelExporter._write_detail_sheet(ws, excel_data)
         
-        # 設定標題
+        wb.save(output)
+        output.seek(0)
+        
+        return output
+    
+    @staticmethod
+    def _write_detail_sheet(ws, excel_data: List[Dict]):
+        """寫入個人每日明細與統計"""
         headers = ['日期', '原始時間字串', '平日時數', '假日時數', '工作類型']
+        df_excel = pd.DataFrame(excel_data, columns=headers)
+        
+        # 設定標題
         for col, header in enumerate(headers, 1):
             cell = ws.cell(row=1, column=col, value=header)
             cell.font = Font(bold=True, size=12)
@@ -1484,11 +4730,6 @@ class ExcelExporter:
         ws.cell(row=last_row + 3, column=1, value="總加班時數:")
         ws.cell(row=last_row + 3, column=2, value=f"{total_hours:.1f} 小時")
         ws.cell(row=last_row + 3, column=2).font = Font(bold=True)
-        
-        wb.save(output)
-        output.seek(0)
-        
-        return output
 
 # ===== 主要界面函數 =====
 def main():
@@ -1496,6 +4737,10 @@ def main():
     # 初始化 Session State
     SessionStateManager.initialize()
     
+    # 背景更新完成時切換到新版本班表
+    if SessionStateManager.sync_roster():
+        st.toast(f"🔄 班表已在背景更新為最新版本: {RosterDiff.describe(st.session_state.last_roster_change)}")
+    
     st.title("🏢 員工班表加班時數統計系統")
     st.caption("v2.2 新增手動編輯班次功能 - 指定人員專用 (修復版)")
     
@@ -1578,8 +4823,48 @@ def render_system_info():
     if st.session_state.data_load_time:
         st.caption(f"⏰ 資料載入時間: {st.session_state.data_load_time.strftime('%Y-%m-%d %H:%M:%S')}")
     
+    roster = SessionStateManager.get_roster()
+    if roster is not None:
+        checked_at, refresh_error = RosterRegistry.instance().refresh_status(roster.sheet_id)
+        st.caption(f"📡 資料更新於: {roster.loaded_at.strftime('%Y-%m-%d %H:%M:%S')}")
+        if checked_at:
+            st.caption(f"🔎 最後確認來源: {checked_at.strftime('%Y-%m-%d %H:%M:%S')}")
+        if refresh_error:
+            st.caption(f"⚠️ 背景更新失敗，繼續使用舊資料: {refresh_error}")
+    
     st.caption(f"🔄 快取版本: {st.session_state.cache_version}")
     
+    # 記憶體用量（共用班表只存一份，各 session 僅保存自己的修改）
+    registry_stats = RosterRegistry.instance().stats()
+    st.caption(f"🧠 共用班表: {registry_stats['memory_bytes'] / 1024:.1f} KB "
+               f"({registry_stats['entries']} 個版本, {registry_stats['handles']} 個 session 使用中)")
+    st.caption(f"🔢 班次代碼矩陣: {registry_stats['matrix_bytes'] / 1024:.1f} KB")
+    if registry_stats['periods']:
+        st.caption(f"📅 月份班表: {registry_stats['period_memory_bytes'] / 1024:.1f} KB "
+                   f"({registry_stats['periods']} 個月份，最多保留 {Config.ROSTER_REGISTRY_MAX_IDLE_PERIODS} 個未使用的月份)")
+    st.caption(f"👤 本 session 資料: {SessionStateManager.estimate_session_bytes() / 1024:.1f} KB")
+    
+    flight_stats = SingleFlight.instance().stats()
+    st.caption(f"🔀 載入請求: {flight_stats['calls']} 次 (實際下載 {flight_stats['executions']} 次, 合併 {flight_stats['coalesced']} 次)")
+    
+    hours_stats = TimeCalculator.hours_cache_stats()
+    lookups = hours_stats['hits'] + hours_stats['misses']
+    hit_rate = hours_stats['hits'] / lookups * 100 if lookups else 0.0
+    st.caption(f"⏱️ 時數解析快取: 命中 {hours_stats['hits']} / 未命中 {hours_stats['misses']} ({hit_rate:.0f}%), "
+               f"{hours_stats['size']}/{hours_stats['max_size']} 筆")
+    
+    result_stats = QueryResultCache.instance().stats()
+    lookups = result_stats['hits'] + result_stats['misses']
+    hit_rate = result_stats['hits'] / lookups * 100 if lookups else 0.0
+    st.caption(f"🗃️ 查詢結果快取: 命中 {result_stats['hits']} / 未命中 {result_stats['misses']} ({hit_rate:.0f}%), "
+               f"{result_stats['entries']} 筆, {result_stats['bytes'] / 1024:.1f}/{Config.QUERY_RESULT_CACHE_MAX_BYTES / 1024:.0f} KB")
+    
+    http_stats = sheet_http_client.get_stats()
+    if http_stats['requests']:
+        st.caption(f"🌐 下載傳輸: {http_stats['bytes_transferred'] / 1024:.1f} KB, "
+                   f"TTFB 平均 {http_stats['avg_ttfb'] * 1000:.0f} ms / 最近 {http_stats['last_ttfb'] * 1000:.0f} ms, "
+                   f"重試 {http_stats['retries']} 次")
+    
     # 清除快取按鈕
     if st.button("🗑️ 清除快取", type="secondary", help="清除所有快取資料，強制重新載入"):
         SessionStateManager.clear_cache()
@@ -1588,8 +4873,9 @@ def render_system_info():
 
 def render_system_status():
     """渲染系統狀態"""
-    if st.session_state.df is not None:
-        personnel_count = DataValidator.count_allowed_personnel(st.session_state.df)
+    df = SessionStateManager.get_df()
+    if df is not None:
+        personnel_count = DataValidator.count_allowed_personnel(df)
         
         # 顯示系統狀態資訊
         col1, col2, col3 = st.columns(3)
@@ -1662,45 +4948,142 @@ def load_data_page():
             return
         
         with st.spinner("🔄 正在載入班表資料..."):
-            df, shift_dict, message = DataLoader.load_data_from_urls(
-                main_sheet_url, st.session_state.cache_version
-            )
+            roster_handle, message = DataLoader.load_data_from_urls(main_sheet_url)
         
-        if df is not None:
-            # 更新 session state
-            st.session_state.df = df
-            st.session_state.shift_dict = shift_dict
-            SessionStateManager.clear_cache()
+        if roster_handle is not None:
+            # 更新 session state（只保存共用班表的參照）
+            SessionStateManager.switch_roster(roster_handle)
+            df = SessionStateManager.get_df()
+            shift_dict = SessionStateManager.get_shift_dict()
             
             st.success(message)
-            
-            # 顯示資料預覽
-            with st.expander("📊 資料預覽", expanded=False):
-                st.write("**班表前5行資料:**")
-                st.dataframe(df.head())
-                
-                st.write("**班種對照表:**")
-                shift_preview = []
-                for shift_type, shift_info in list(shift_dict.items())[:10]:
-                    shift_preview.append({
-                        '班種': shift_type,
-                        '加班時數1': shift_info.overtime_hours_1,
-                        '加班時數2': shift_info.overtime_hours_2,
-                        '跨日時數': shift_info.cross_day_hours
-                    })
-                st.dataframe(pd.DataFrame(shift_preview))
+            render_roster_change_summary()
+            render_data_preview(df, shift_dict)
         else:
             st.error(message)
+    
+    st.markdown("---")
+    render_local_ingest()
+
+def render_roster_change_summary():
+    """顯示與上次載入相比的班表變更摘要"""
+    change = st.session_state.last_roster_change
+    if change is None:
+        return
+    if change.structural or change.changed_cells:
+        st.info(f"🆕 自上次載入後變更: {RosterDiff.describe(change)}")
+    else:
+        st.caption("🆕 自上次載入後班表內容未變更，已保留查詢結果")
+
+def render_data_preview(df: pd.DataFrame, shift_dict: Dict[str, ShiftInfo]):
+    """顯示班表與班種對照表預覽"""
+    with st.expander("📊 資料預覽", expanded=False):
+        st.write("**班表前5行資料:**")
+        st.dataframe(df.head())
+        
+        st.write("**班種對照表:**")
+        shift_preview = []
+        for shift_type, shift_info in list(shift_dict.items())[:10]:
+            shift_preview.append({
+                '班種': shift_type,
+                '加班時數1': shift_info.overtime_hours_1,
+                '加班時數2': shift_info.overtime_hours_2,
+                '跨日時數': shift_info.cross_day_hours
+            })
+        st.dataframe(pd.DataFrame(shift_preview))
+
+def render_local_ingest():
+    """匯入本機班表檔案（離線，可一次匯入多個月份）"""
+    st.subheader("📂 匯入本機班表檔案")
+    st.caption("支援 CSV / XLSX。檔名含年月（如 2025-01、202501）時登錄為該月份班表；"
+               "檔名含「班種」的檔案作為班種對照表，未提供時使用上次下載的預設班種對照表。")
+    
+    with st.form("local_ingest_form"):
+        uploaded_files = st.file_uploader(
+            "上傳班表檔案",
+            type=["csv", "xlsx"],
+            accept_multiple_files=True
+        )
+        directory = st.text_input(
+            "或輸入伺服器上的資料夾路徑",
+            placeholder="例如 ./rosters",
+            help="匯入資料夾內所有 CSV / XLSX 檔案"
+        )
+        ingest_button = st.form_submit_button("📂 匯入本機班表", type="primary")
+    
+    if ingest_button:
+        sources = [(uploaded.name, uploaded.getvalue) for uploaded in uploaded_files or []]
+        directory = directory.strip()
+        if directory:
+            if not os.path.isdir(directory):
+                st.error(f"❌ 找不到資料夾: {directory}")
+                return
+            sources.extend(LocalRosterIngest.directory_sources(directory))
+        
+        if not sources:
+            st.error("❌ 請上傳檔案或輸入資料夾路徑")
+            return
+        
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        results, message = LocalRosterIngest.ingest(sources, progress_bar, status_text)
+        progress_bar.empty()
+        status_text.empty()
+        
+        if not results:
+            st.error(message)
+            return
+        
+        st.success(message)
+        st.dataframe(pd.DataFrame([{
+            '檔案': result.name,
+            '月份': result.period or '-',
+            '班表': f"{result.shape[0]} x {result.shape[1]}" if result.shape else '-',
+            '耗時': f"{result.elapsed:.2f}s",
+            '狀態': f"❌ {result.error}" if result.error else "✅",
+        } for result in results]), hide_index=True)
+        
+        for result in results:
+            if result.error is None:
+                st.session_state.local_rosters[result.period or result.name] = result.sheet_id
+    
+    if st.session_state.local_rosters:
+        labels = list(st.session_state.local_rosters)
+        selected_label = st.selectbox("選擇要使用的本機班表", labels, index=len(labels) - 1)
+        col1, col2 = st.columns(2)
+        with col1:
+            use_button = st.button("✅ 使用此班表")
+        with col2:
+            remove_button = st.button("🗑️ 移除此班表", help="釋放記憶體；該月份的查詢改用目前班表")
+        
+        if remove_button:
+            RosterRegistry.instance().unregister(st.session_state.local_rosters.pop(selected_label))
+            # 查詢結果可能使用了此月份班表（期間查詢的月份或跨入第 1 日的時段），重新查詢
+            st.session_state.last_query_result = None
+            st.session_state.last_team_result = None
+            st.session_state.last_range_result = None
+            st.rerun()
+        
+        if use_button:
+            registry = RosterRegistry.instance()
+            entry = registry.current(st.session_state.local_rosters[selected_label])
+            if entry is None:
+                st.error("❌ 班表已不在記憶體中，請重新匯入")
+                return
+            
+            SessionStateManager.switch_roster(registry.acquire(entry))
+            st.success(DataLoader._loaded_message(entry.df, f"✅ 已使用本機班表 {selected_label}"))
+            render_roster_change_summary()
+            render_data_preview(entry.df, entry.shift_dict)
 
 def query_page():
     """查詢頁面"""
     st.header("🔍 員工加班時數查詢")
     
-    if st.session_state.df is None:
+    df = SessionStateManager.get_df()
+    if df is None:
         st.warning("⚠️ 請先載入班表資料")
         return
-    
-    df = st.session_state.df
     personnel_options = DataProcessor.get_personnel_options(df)
     
     if not personnel_options:
@@ -1725,13 +5108,22 @@ def query_page():
                                index=datetime.now().month-1,
                                format_func=lambda x: x[1])
         
-        col_query, col_preview, col_edit = st.columns(3)
+        policy_names = list(AllocationEngine.POLICIES)
+        allocation_policy = st.selectbox(
+            "平日時數分配規則", policy_names,
+            index=policy_names.index(AllocationEngine.get_policy(st.session_state.allocation_policy).name),
+            format_func=lambda name: AllocationEngine.POLICIES[name].label
+        )
+        
+        col_query, col_preview, col_edit, col_team = st.columns(4)
         with col_query:
             submit_query = st.form_submit_button("🔍 查詢加班時數", type="primary")
         with col_preview:
             preview_schedule = st.form_submit_button("👁️ 預覽班表", type="secondary")
         with col_edit:
             edit_schedule = st.form_submit_button("✏️ 編輯班表", type="secondary")
+        with col_team:
+            team_query = st.form_submit_button("👥 全部人員總表", type="secondary")
     
     # 處理班表預覽
     if preview_schedule:
@@ -1751,11 +5143,22 @@ def query_page():
     
     # 處理查詢
     if submit_query:
+        st.session_state.allocation_policy = allocation_policy
         handle_overtime_query(selected_personnel, year, month[0], df)
     
     # Excel 匯出功能
     if st.session_state.last_query_result is not None:
         render_excel_export()
+    
+    # 處理團隊查詢
+    if team_query:
+        st.session_state.allocation_policy = allocation_policy
+        handle_team_query(year, month[0])
+    
+    if st.session_state.last_team_result is not None:
+        render_team_results()
+    
+    render_range_query()
 
 def handle_schedule_preview(selected_personnel: str, year: int, month: int, df: pd.DataFrame, editable: bool = False):
     """處理班表預覽"""
@@ -1826,8 +5229,14 @@ def render_schedule_preview():
                 st.success("✅ 已清除本月所有手動修改")
                 st.rerun()
 
+def render_roster_warnings():
+    """顯示目前班表版本建立時的警告（每個 session 每個版本只顯示一次）"""
+    for warning in SessionStateManager.take_roster_warnings():
+        st.warning(warning)
+
 def handle_overtime_query(selected_personnel: str, year: int, month: int, df: pd.DataFrame):
     """處理加班時數查詢（支援手動修改的班次）"""
+    render_roster_warnings()
     target_personnel = selected_personnel.split(' (')[0]
     
     # 驗證參數
@@ -1846,7 +5255,7 @@ def handle_overtime_query(selected_personnel: str, year: int, month: int, df: pd
         
         # 計算加班時數（會自動使用手動修改的班次）
         query_result = OvertimeCalculator.calculate_overtime_summary(
-            target_personnel, year, month, matching_columns
+            target_personnel, year, month, matching_columns, st.session_state.allocation_policy
         )
         
         # 儲存查詢結果
@@ -1855,6 +5264,153 @@ def handle_overtime_query(selected_personnel: str, year: int, month: int, df: pd
     # 顯示查詢結果
     render_query_results(query_result)
 
+def handle_team_query(year: int, month: int):
+    """處理全部人員的加班時數查詢（一次計算所有 Config.ALLOWED_PERSONNEL）"""
+    render_roster_warnings()
+    is_valid, error_msg = DataValidator.validate_year_month(year, month)
+    if not is_valid:
+        st.error(f"❌ {error_msg}")
+        return
+    
+    with st.spinner(f"👥 正在計算全部人員 {year}年{month}月 加班時數..."):
+        st.session_state.last_team_result = OvertimeCalculator.calculate_team_overtime_summary(
+            year, month, policy=st.session_state.allocation_policy
+        )
+
+def render_team_results():
+    """渲染團隊總表與匯出"""
+    team_result = st.session_state.last_team_result
+    
+    st.subheader(f"👥 {team_result.year}年{team_result.month:02d}月 全部人員加班總表")
+    if team_result.missing:
+        st.warning(f"⚠️ 班表中找不到: {', '.join(team_result.missing)}")
+    if not team_result.results:
+        return
+    
+    table_data = [
+        {
+            '人事號': personnel,
+            '平日時數': f"{result.weekday_hours:.1f}",
+            '假日時數': f"{result.weekend_hours:.1f}",
+            '總時數': f"{result.total_hours:.1f}",
+            '加班天數': int((result.daily.hours > 0).sum())
+        }
+        for personnel, result in team_result.results.items()
+    ]
+    st.dataframe(pd.DataFrame(table_data), use_container_width=True, hide_index=True)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("平日加班時數合計", f"{team_result.weekday_hours:.1f} 小時")
+    with col2:
+        st.metric("假日加班時數合計", f"{team_result.weekend_hours:.1f} 小時")
+    with col3:
+        st.metric("總加班時數合計", f"{team_result.total_hours:.1f} 小時")
+    
+    if st.button("📊 產生團隊Excel報表", type="secondary", key="export_team_excel_btn"):
+        with st.spinner("📊 正在產生團隊Excel報表..."):
+            success, file_content_or_error, person_count = ExcelExporter.export_team_to_excel(team_result)
+            
+            if success:
+                st.success(f"✅ 團隊Excel報表產生成功！（{person_count} 人）")
+                st.download_button(
+                    label="📥 下載團隊Excel檔案",
+                    data=file_content_or_error.getvalue(),
+                    file_name=f"全部人員_{team_result.year}年{team_result.month:02d}月_加班時數統計.xlsx",
+                    mime="application/vnd.openxmlformats-officeedocument.spreadsheetml.sheet",
+                    key="download_team_excel_btn"
+                )
+            else:
+                st.error(f"❌ {file_content_or_error}")
+
+def render_range_query():
+    """渲染期間查詢（季、年或任意月份區間）"""
+    st.markdown("---")
+    st.subheader("📆 期間查詢")
+    
+    with st.form("range_query_form"):
+        col1, col2, col3, col4 = st.columns(4)
+        current_year = datetime.now().year
+        with col1:
+            start_year = st.number_input("起始年", min_value=Config.MIN_YEAR, max_value=Config.MAX_YEAR, value=current_year)
+        with col2:
+            start_month = st.selectbox("起始月", list(range(1, 13)), index=0, format_func=lambda m: f"{m}月")
+        with col3:
+            end_year = st.number_input("結束年", min_value=Config.MIN_YEAR, max_value=Config.MAX_YEAR, value=current_year)
+        with col4:
+            end_month = st.selectbox("結束月", list(range(1, 13)), index=datetime.now().month - 1, format_func=lambda m: f"{m}月")
+        
+        personnel_list = st.multiselect("人員", Config.ALLOWED_PERSONNEL, default=Config.ALLOWED_PERSONNEL)
+        submit_range = st.form_submit_button("📆 查詢期間加班時數", type="secondary")
+    
+    if submit_range:
+        handle_range_query((int(start_year), start_month), (int(end_year), end_month), personnel_list)
+    
+    if st.session_state.last_range_result is not None:
+        render_range_results()
+
+def handle_range_query(start: Tuple[int, int], end: Tuple[int, int], personnel_list: List[str]):
+    """處理期間查詢"""
+    render_roster_warnings()
+    months = DateHelper.get_month_span(start, end)
+    if not months:
+        st.error("❌ 結束月份不可早於起始月份")
+        return
+    if len(months) > Config.RANGE_QUERY_MAX_MONTHS:
+        st.error(f"❌ 期間最多 {Config.RANGE_QUERY_MAX_MONTHS} 個月")
+        return
+    if not personnel_list:
+        st.error("❌ 請選擇人員")
+        return
+    
+    with st.spinner(f"📆 正在計算 {len(months)} 個月份的加班時數..."):
+        st.session_state.last_range_result = OvertimeCalculator.calculate_range_overtime_summary(
+            start, end, personnel_list, policy=st.session_state.allocation_policy
+        )
+
+def render_range_results():
+    """渲染期間查詢結果與匯出"""
+    range_result = st.session_state.last_range_result
+    (start_year, start_month), (end_year, end_month) = range_result.start, range_result.end
+    st.write(f"**{start_year}年{start_month}月 至 {end_year}年{end_month}月（{len(range_result.months)} 個月份）**")
+    
+    session_roster = SessionStateManager.get_roster()
+    archived = sorted(set(range_result.sources.values()) - {session_roster.sheet_id if session_roster else None})
+    if archived:
+        st.caption(f"使用月份班表: {', '.join(archived)}")
+    
+    totals = range_result.personnel_totals()
+    if not totals:
+        st.warning("⚠️ 期間內沒有可計算的資料")
+        return
+    
+    st.dataframe(pd.DataFrame([
+        {'人事號': personnel, '平日時數': f"{weekday:.1f}", '假日時數': f"{weekend:.1f}", '總時數': f"{total:.1f}"}
+        for personnel, (weekday, weekend, total) in totals.items()
+    ]), use_container_width=True, hide_index=True)
+    
+    with st.expander("每月明細（含累計）"):
+        st.dataframe(pd.DataFrame([
+            {column: f"{value:.1f}" if isinstance(value, float) else value for column, value in row.items()}
+            for row in range_result.monthly_rows()
+        ]), use_container_width=True, hide_index=True)
+    
+    if st.button("📊 產生期間Excel報表", type="secondary", key="export_range_excel_btn"):
+        with st.spinner("📊 正在產生期間Excel報表..."):
+            success, file_content_or_error, row_count = ExcelExporter.export_range_to_excel(range_result)
+            
+            if success:
+                st.success(f"✅ 期間Excel報表產生成功！（{row_count} 筆）")
+                st.download_button(
+                    label="📥 下載期間Excel檔案",
+                    data=file_content_or_error.getvalue(),
+                    file_name=f"{start_year}年{start_month:02d}月至{end_year}年{end_month:02d}月_加班時數統計.xlsx",
+                    mime="application/vnd.openxmlformats-officeedocument.spreadsheetml.sheet",
+                    key="download_range_excel_btn"
+                )
+            else:
+                st.error(f"❌ {file_content_or_error}")
+
 def render_query_results(query_result: QueryResult):
     """渲染查詢結果"""
     st.success("✅ 查詢完成！")
@@ -1865,6 +5421,12 @@ def render_query_results(query_result: QueryResult):
         manual_count = len(st.session_state.manual_shifts[manual_key])
         st.info(f"ℹ️ 本次查詢使用了 {manual_count} 天手動修改的班次資料")
     
+    # 跨月時段：上月跨入計入 1 日，月底跨出計入隔月
+    if query_result.carry_in_hours > 0:
+        st.caption(f"↘️ 含上月最後一日班次跨入 1 日的 {query_result.carry_in_hours:.1f} 小時")
+    if query_result.carry_out_hours > 0:
+        st.caption(f"↗️ 月底班次跨到隔月 1 日的 {query_result.carry_out_hours:.1f} 小時計入隔月")
+    
     # 顯示自定義假日資訊
     render_custom_holidays_info(query_result.year, query_result.month)
     
@@ -1879,8 +5441,8 @@ def render_query_results(query_result: QueryResult):
         st.metric("總加班時數", f"{query_result.total_hours:.1f} 小時")
     
     # 詳細每日資料
-    if query_result.daily_breakdown:
-        render_daily_breakdown(query_result.daily_breakdown, query_result.year, query_result.month)
+    if query_result.daily.order:
+        render_daily_breakdown(query_result.daily)
 
 def render_custom_holidays_info(year: int, month: int):
     """渲染自定義假日資訊"""
@@ -1894,29 +5456,22 @@ def render_custom_holidays_info(year: int, month: int):
                 holiday_list.append(f"• {date_key}: {desc}")
             st.markdown("\n".join(holiday_list))
 
-def render_daily_breakdown(daily_breakdown: Dict[str, float], year: int, month: int):
+def render_daily_breakdown(daily: DailyOvertime):
     """渲染每日明細"""
     st.subheader("📅 詳細每日加班記錄")
     
-    # 創建表格數據
+    # 創建表格數據（日期字串只在顯示時產生）
     table_data = []
-    for date_str, hours in sorted(daily_breakdown.items()):
+    for slot in sorted(daily.order):
+        hours = daily.hours[slot]
         if hours > 0:
-            try:
-                date_parts = date_str.split('/')
-                check_year = int(date_parts[0])
-                check_month = int(date_parts[1])
-                check_day = int(date_parts[2])
-                day_type, is_weekend = DateHelper.get_day_type(check_year, check_month, check_day)
-                
-                table_data.append({
-                    '日期': date_str,
-                    '星期': day_type,
-                    '加班時數': f"{hours:.1f}小時",
-                    '類型': '假日' if is_weekend else '平日'
-                })
-            except (ValueError, IndexError):
-                continue
+            is_weekend = bool(daily.is_weekend[slot])
+            table_data.append({
+                '日期': daily.date_string(slot),
+                '星期': daily.day_types[slot],
+                '加班時數': f"{hours:.1f}小時",
+                '類型': '假日' if is_weekend else '平日'
+            })
     
     if table_data:
         df_display = pd.DataFrame(table_data)
@@ -2044,8 +5599,8 @@ def render_add_holiday_form():
         day_val = holiday_day
         date_key = f"{year_val}-{month_val:02d}-{day_val:02d}"
         
-        if date_key in st.session_state.custom_holidays:
-            removed = st.session_state.custom_holidays.pop(date_key)
+        removed = SessionStateManager.remove_custom_holiday(date_key)
+        if removed is not None:
             st.success(f"✅ 已移除自定義假日: {date_key} ({removed})")
             st.rerun()
         else:
@@ -2060,7 +5615,7 @@ def add_holiday_to_session(year: int, month: int, day: int, reason: str):
         weekdays = ['一', '二', '三', '四', '五', '六', '日']
         weekday = weekdays[test_date.weekday()]
         
-        st.session_state.custom_holidays[date_key] = f"{reason}({weekday})"
+        SessionStateManager.set_custom_holiday(date_key, f"{reason}({weekday})")
         st.success(f"✅ 已新增假日: {date_key} {reason}({weekday})")
         st.rerun()
     except ValueError:
@@ -2075,7 +5630,7 @@ def render_existing_holidays():
     with col1:
         if st.button("🗑️ 清除所有假日", type="secondary"):
             if st.session_state.custom_holidays:
-                st.session_state.custom_holidays.clear()
+                SessionStateManager.clear_custom_holidays()
                 st.success("✅ 已清除所有自定義假日")
                 st.rerun()
             else:
@@ -0,0 +1,212 @@
+# Google Sheets 資料下載共用 HTTP 用戶端
+"""
+班表資料下載共用 HTTP 用戶端
+====================
+
+各版本班表系統下載 Google Sheets CSV 時共用此模組：
+- 共用 requests.Session，保持連線（keep-alive）並使用連線池
+- 要求 gzip 壓縮傳輸（requests 會自動解壓）
+- 連線錯誤、429/5xx 回應與讀取內容時的中斷或逾時以指數退避加隨機抖動重試，次數有上限
+- 所有請求都有連線與讀取逾時
+- 統計實際傳輸位元組數與首位元組時間（TTFB）
+"""
+
+import io
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, TypeVar
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# ===== 設定常數 =====
+CONNECT_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = 30
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 讀取回應內容時的錯誤（傳輸中斷、讀取逾時）；重新下載整份內容
+BODY_RETRY_ERRORS = (requests.exceptions.ChunkedEncodingError, requests.ConnectionError, requests.Timeout)
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+DEFAULT_HEADERS = {
+    'Accept-Encoding': 'gzip, deflate',
+    'User-Agent': 'roster-overtime-system',
+}
+
+T = TypeVar('T')
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {'requests': 0, 'retries': 0, 'bytes_transferred': 0, 'ttfb_total': 0.0, 'last_ttfb': 0.0}
+
+
+def get_session() -> requests.Session:
+    """
+    取得共用的 HTTP Session（整個行程只建立一次）
+
+    Returns:
+        已設定連線池與預設標頭的 Session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _session = session
+        return _session
+
+
+def _backoff_delay(attempt: int) -> float:
+    """第 attempt 次重試前的等待秒數（指數退避加全範圍隨機抖動）"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def open_stream(url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    """
+    以串流方式開啟下載（只讀取到回應標頭），失敗時自動重試
+
+    呼叫端讀取內容後須呼叫 close_stream() 以歸還連線並記錄傳輸量。
+    304 等非錯誤狀態直接返回，由呼叫端判斷。
+    
+    只重試取得回應標頭之前的錯誤；讀取內容時的中斷或逾時會直接拋給呼叫端，
+    需要重試時改用 stream_body()。
+
+    Args:
+        url: 下載連結
+        headers: 額外的請求標頭（如條件式請求的 If-None-Match）
+
+    Returns:
+        requests 回應物件
+
+    Raises:
+        requests.RequestException: 重試次數用盡仍失敗
+    """
+    session = get_session()
+    last_error: Optional[Exception] = None
+
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt > 0:
+            with _stats_lock:
+                _stats['retries'] += 1
+            time.sleep(_backoff_delay(attempt - 1))
+
+        try:
+            response = session.get(
+                url, headers=headers, stream=True,
+                timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            last_error = e
+            continue
+
+        with _stats_lock:
+            _stats['requests'] += 1
+            _stats['last_ttfb'] = response.elapsed.total_seconds()
+            _stats['ttfb_total'] += _stats['last_ttfb']
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+            close_stream(response)
+            last_error = requests.HTTPError(f"HTTP {response.status_code}", response=response)
+            continue
+
+        if response.status_code >= 400:
+            close_stream(response)
+            response.raise_for_status()
+        return response
+
+    raise last_error
+
+
+def stream_body(url: str, read_body: Callable[[requests.Response], T], headers: Optional[Dict[str, str]] = None) -> T:
+    """
+    開啟下載並以 read_body 讀取內容，讀取中途中斷或逾時時重新下載
+
+    每次重試都重新呼叫 read_body，呼叫端累計的狀態（如已下載位元組數）需在 read_body 內重設。
+
+    Args:
+        url: 下載連結
+        read_body: 讀取回應內容的函數（回應關閉前呼叫）
+        headers: 額外的請求標頭
+
+    Returns:
+        read_body 的返回值
+
+    Raises:
+        requests.RequestException: 重試次數用盡仍失敗
+    """
+    last_error: Optional[Exception] = None
+
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt > 0:
+            with _stats_lock:
+                _stats['retries'] += 1
+            time.sleep(_backoff_delay(attempt - 1))
+
+        response = open_stream(url, headers=headers)
+        try:
+            return read_body(response)
+        except BODY_RETRY_ERRORS as e:
+            last_error = e
+        finally:
+            close_stream(response)
+
+    raise last_error
+
+
+def close_stream(response: requests.Response):
+    """關閉串流回應並累計實際傳輸的（壓縮後）位元組數"""
+    try:
+        transferred = response.raw.tell()
+    except (AttributeError, OSError, ValueError):
+        transferred = 0
+    response.close()
+    with _stats_lock:
+        _stats['bytes_transferred'] += transferred
+
+
+def fetch_bytes(url: str) -> bytes:
+    """
+    下載完整內容（已解壓）
+
+    Args:
+        url: 下載連結
+
+    Returns:
+        回應內容
+    """
+    return stream_body(url, lambda response: response.content)
+
+
+def read_csv(url: str, **kwargs) -> pd.DataFrame:
+    """
+    下載 CSV 並以 pandas 解析（可直接取代 pd.read_csv(url)）
+
+    Args:
+        url: CSV 下載連結
+        **kwargs: 傳給 pd.read_csv 的參數
+
+    Returns:
+        解析後的 DataFrame
+    """
+    return pd.read_csv(io.BytesIO(fetch_bytes(url)), **kwargs)
+
+
+def get_stats() -> Dict[str, float]:
+    """
+    取得下載統計
+
+    Returns:
+        請求次數、重試次數、傳輸位元組數、平均與最近一次首位元組時間（秒）
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['avg_ttfb'] = stats['ttfb_total'] / stats['requests'] if stats['requests'] else 0.0
+    return stats
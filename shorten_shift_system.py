@@ -1,5 +1,6 @@
 # 互動式員工班表加班時數統計系統 (精簡優化版)
 import pandas as pd
+import sheet_http_client
 from datetime import datetime, date, timedelta
 from collections import defaultdict
 import openpyxl
@@ -11,6 +12,7 @@ import io
 import re
 from typing import Dict, List, Tuple, Optional, Any
 from dataclasses import dataclass
+from functools import lru_cache
 
 warnings.filterwarnings('ignore')
 
@@ -24,6 +26,7 @@ class Config:
     MAX_WEEKDAY_HOURS = 46.0
     AUTO_ADD_HOURS = 2.0
     WEEKEND_MIN_THRESHOLD = 3.0
+    HOURS_CACHE_SIZE = 1024
 
 @dataclass
 class QueryResult:
@@ -60,18 +63,19 @@ class DataManager:
             status.text("📊 載入班表資料...")
             progress.progress(30)
             main_csv = DataManager.convert_url(main_url)
-            df = pd.read_csv(main_csv).iloc[:36, :83]
+            df = sheet_http_client.read_csv(main_csv).iloc[:36, :83]
             
             # 載入班種對照表
             status.text("🔢 載入班種資料...")
             progress.progress(60)
             shift_csv = DataManager.convert_url(Config.DEFAULT_SHIFT_URL)
-            shift_df = pd.read_csv(shift_csv)
+            shift_df = sheet_http_client.read_csv(shift_csv)
             
             # 建立班種字典
             status.text("🔨 建立字典...")
             progress.progress(90)
             shift_dict = {}
+            TimeCalculator._calculate_hours_cached.cache_clear()
             for _, row in shift_df.iterrows():
                 if pd.notna(row.iloc[0]):
                     shift_dict[str(row.iloc[0]).strip()] = {
@@ -98,8 +102,12 @@ class TimeCalculator:
         if not time_range or pd.isna(time_range):
             return None
         
-        time_str = str(time_range).strip()
-        
+        return TimeCalculator._calculate_hours_cached(str(time_range).strip())
+    
+    @staticmethod
+    @lru_cache(maxsize=Config.HOURS_CACHE_SIZE)
+    def _calculate_hours_cached(time_str: str) -> Optional[float]:
+        """計算正規化後時間字串的小時數（相同字串只解析一次）"""
         # 處理純數字
         if '-' not in time_str:
             try:
@@ -355,6 +363,11 @@ class ExcelExporter:
         """建立Excel資料"""
         excel_data = []
         
+        # 人事號欄位只需找一次，各日共用
+        personnel_row = df.iloc[1, :]
+        matching_cols = [i for i, num in enumerate(personnel_row) 
+                        if pd.notna(num) and str(num).strip() == result.personnel]
+        
         for day in range(1, calendar.monthrange(result.year, result.month)[1] + 1):
             date_str = f"{result.year}/{result.month:02d}/{day:02d}"
             
@@ -363,7 +376,7 @@ class ExcelExporter:
                 is_weekend = OvertimeCalculator._is_date_weekend(date_str)
                 
                 # 簡化的時間字串收集
-                time_strings = ExcelExporter._get_time_strings(df, shift_dict, result.personnel, day, result.year, result.month)
+                time_strings = ExcelExporter._get_time_strings(df, shift_dict, matching_cols, day)
                 
                 weekday_hours = 0 if is_weekend else hours
                 weekend_hours = hours if is_weekend else 0
@@ -386,12 +399,8 @@ class ExcelExporter:
         return excel_data
     
     @staticmethod
-    def _get_time_strings(df: pd.DataFrame, shift_dict: Dict, personnel: str, day: int, year: int, month: int) -> str:
+    def _get_time_strings(df: pd.DataFrame, shift_dict: Dict, matching_cols: List[int], day: int) -> str:
         """獲取時間字串"""
-        personnel_row = df.iloc[1, :]
-        matching_cols = [i for i, num in enumerate(personnel_row) 
-                        if pd.notna(num) and str(num).strip() == personnel]
-        
         time_strings = []
         for col_idx in matching_cols:
             row_idx = day + 2
@@ -442,6 +451,7 @@ def main():
         
         if st.button("🗑️ 清除快取"):
             st.cache_data.clear()
+            TimeCalculator._calculate_hours_cached.cache_clear()
             st.success("快取已清除")
     
     # 主要內容區域
@@ -0,0 +1,80 @@
+"""
+測試共用設定
+
+以 Streamlit 的 bare mode 匯入 finale_post_fixed（不啟動伺服器），
+每個測試使用全新的 session 狀態。
+"""
+
+import logging
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import streamlit as st
+
+import finale_post_fixed as app
+
+
+@pytest.fixture
+def session():
+    """清空 session 狀態與行程內共用快取後初始化"""
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    st.cache_resource.clear()
+    app.SessionStateManager.initialize()
+    yield st.session_state
+
+
+@pytest.fixture
+def shift_df():
+    """班種對照表（含跨日、純數字與小數格式）"""
+    return pd.DataFrame(
+        [["D", "08:00-10:00", "17:00-18:30", None],
+         ["E", "1700-2000", "19:00-21:00", None],
+         ["N", "20:00-24:00", None, "00:00-02:00"],
+         ["L", "2", None, None],
+         ["M", "8-12", "10:00-11:00", None],
+         ["X1", "22:00-01:00", None, "01:00-03:00"],
+         ["W", "13:00-15:00", "13:00-15:00", None],
+         ["OFF", None, None, None]],
+        columns=["班種", "加班時數1", "加班時數2", "跨日時數"]
+    )
+
+
+@pytest.fixture
+def roster_df():
+    """指定人事號的班表（固定亂數種子；部分人員佔兩欄，含班種表沒有的班次 Z9）"""
+    rng = np.random.default_rng(20250)
+    codes = ["D", "E", "N", "L", "M", "X1", "W", "OFF", "Z9", None, None, None]
+    personnel = app.Config.ALLOWED_PERSONNEL[:6] + app.Config.ALLOWED_PERSONNEL[:2]
+    df = pd.DataFrame([[None] * (len(personnel) + 1) for _ in range(app.Config.MAX_ROWS)])
+    for col, person in enumerate(personnel, start=1):
+        df.iloc[app.Config.PERSONNEL_ROW, col] = person
+        for day in range(1, app.Config.MAX_DAYS_IN_MONTH + 1):
+            df.iloc[app.Config.DAY_ROW_OFFSET + day, col] = codes[rng.integers(len(codes))]
+    return df
+
+
+@pytest.fixture
+def publish_roster(session, shift_df):
+    """
+    登錄班表的函式：publish_roster(df, sheet_id, version, period, use_in_session)
+    
+    use_in_session 時以 SessionStateManager.switch_roster 換用為本 session 的班表。
+    """
+    def publish(df, sheet_id="roster", version="v1", period=None, use_in_session=True):
+        shift_dict, _ = app.DataProcessor.build_shift_dictionary(shift_df)
+        registry = app.RosterRegistry.instance()
+        entry = registry.publish(app.RosterSnapshot(sheet_id=sheet_id, content_hash=version, df=df,
+                                                    shift_dict=shift_dict, saved_at=datetime.now()), period=period)
+        if use_in_session:
+            app.SessionStateManager.switch_roster(registry.acquire(entry))
+        return entry
+    return publish
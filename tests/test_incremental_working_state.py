@@ -0,0 +1,99 @@
+"""手動修改時逐日更新的計算中間結果，與整月重建的結果相同"""
+
+import calendar
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+import streamlit as st
+
+from finale_post_fixed import (Config, DataProcessor, OvertimeCalculator, QueryResultCache, SessionStateManager,
+                               ShiftEditor)
+
+SESSION_CACHES = ('month_shifts_cache', 'month_working_states', 'month_carries')
+
+
+def summarize(personnel, year, month):
+    columns = DataProcessor.find_matching_personnel_columns(SessionStateManager.get_df(), personnel)
+    QueryResultCache.instance().clear()  # 不使用快取的查詢結果，直接由計算中間結果產生
+    return OvertimeCalculator.calculate_overtime_summary(personnel, year, month, columns)
+
+
+def summarize_fresh(personnel, year, month):
+    """以全新的 session 快取整月重建（完成後還原原本的計算中間結果）"""
+    saved = {name: st.session_state[name] for name in SESSION_CACHES}
+    for name in SESSION_CACHES:
+        st.session_state[name] = OrderedDict()
+    try:
+        return summarize(personnel, year, month)
+    finally:
+        for name, cache in saved.items():
+            st.session_state[name] = cache
+
+
+def revert(personnel, year, month, day):
+    """以班次編輯器改回原始班次（復原該日的手動設定）"""
+    columns = DataProcessor.find_matching_personnel_columns(SessionStateManager.get_df(), personnel)
+    original = SessionStateManager.get_month_shifts(personnel, year, month, columns).original[day - 1]
+    st.session_state[f"shift_edit_{personnel}_{year}_{month}_{day}"] = original
+    ShiftEditor._on_shift_change(personnel, year, month, day, original)
+
+
+def edit_steps(personnel, year, month):
+    """依序套用的修改（名稱, 動作, 是否應沿用同一份計算中間結果）"""
+    last_day = calendar.monthrange(year, month)[1]
+    previous_year, previous_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    previous_last_day = calendar.monthrange(previous_year, previous_month)[1]
+    set_shift = SessionStateManager.set_manual_shift
+    return [
+        ("day 1", lambda: set_shift(personnel, year, month, 1, "N"), True),
+        ("last day", lambda: set_shift(personnel, year, month, last_day, "X1"), True),
+        ("shift not in table", lambda: set_shift(personnel, year, month, 15, "Z9"), True),
+        ("rest day", lambda: set_shift(personnel, year, month, 16, ""), True),
+        ("cross-day before edited day", lambda: set_shift(personnel, year, month, 14, "N"), True),
+        ("undo", lambda: revert(personnel, year, month, 15), True),
+        ("previous month's last day", lambda: set_shift(personnel, previous_year, previous_month, previous_last_day, "X1"), True),
+        ("clear", lambda: ShiftEditor._clear_month_modifications(personnel, year, month), True),
+        ("holiday", lambda: SessionStateManager.set_custom_holiday(f"{year}-{month:02d}-10", "補假"), False),
+        ("edit after holiday", lambda: set_shift(personnel, year, month, 10, "D"), True),
+        ("undo after holiday", lambda: revert(personnel, year, month, 10), True),
+        ("holiday removed", lambda: SessionStateManager.remove_custom_holiday(f"{year}-{month:02d}-10"), False),
+    ]
+
+
+def assert_same_result(actual, expected):
+    assert np.array_equal(actual.daily.hours, expected.daily.hours)
+    assert actual.daily.order == expected.daily.order
+    assert actual.weekday_hours == expected.weekday_hours
+    assert actual.weekend_hours == expected.weekend_hours
+    assert actual.total_hours == expected.total_hours
+    assert actual.carry_in_hours == expected.carry_in_hours
+    assert actual.carry_out_hours == expected.carry_out_hours
+
+
+@pytest.mark.parametrize("period_rosters", [False, True], ids=["single roster", "period rosters"])
+@pytest.mark.parametrize("personnel", Config.ALLOWED_PERSONNEL[:3])
+@pytest.mark.parametrize("year, month", [(2025, 3), (2025, 2), (2025, 1)])
+def test_incremental_updates_match_full_rebuild(publish_roster, roster_df, personnel, year, month, period_rosters):
+    if period_rosters:
+        # 上個月份另有月份班表時，上月最後一日的修改經由跨入時段更新第 1 日
+        previous = f"{year - 1}-12" if month == 1 else f"{year}-{month - 1:02d}"
+        previous_df = roster_df.copy()
+        day_rows = slice(Config.DAY_ROW_OFFSET + 1, None)
+        previous_df.iloc[day_rows] = roster_df.iloc[day_rows].iloc[::-1].to_numpy()
+        publish_roster(previous_df, sheet_id=f"local-{previous}", period=previous, use_in_session=False)
+        publish_roster(roster_df, sheet_id=f"local-{year}-{month:02d}", period=f"{year}-{month:02d}")
+    else:
+        publish_roster(roster_df)
+    
+    assert_same_result(summarize(personnel, year, month), summarize_fresh(personnel, year, month))
+    state_key = (personnel, year, month)
+    
+    for name, apply, incremental in edit_steps(personnel, year, month):
+        state = st.session_state.month_working_states[state_key]
+        apply()
+        actual = summarize(personnel, year, month)
+        assert (st.session_state.month_working_states[state_key] is state) == incremental, name
+        assert_same_result(actual, summarize_fresh(personnel, year, month))
+        if period_rosters and name == "previous month's last day":
+            assert actual.carry_in_hours == 2.0  # X1 的跨日時段 01:00-03:00
@@ -0,0 +1,112 @@
+"""月底跨日時段在相鄰月份之間只計算一次（RosterRegistry.carry_roster）"""
+
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from finale_post_fixed import (Config, DataProcessor, OvertimeCalculator, RosterRegistry, RosterSnapshot,
+                               SessionStateManager)
+
+PERSONNEL = "A30825"
+# 2025/02/28 為週五（平日），跨日時段落在 2025/03/01 週六（假日），以假日時數追蹤這段時數
+N_SHIFT_CROSS_HOURS = 2.0
+
+
+def build_roster(shifts_by_day):
+    """單一人員（第 2 欄）的班表，shifts_by_day 為 {日期: 班次}"""
+    df = pd.DataFrame([[None, None] for _ in range(Config.MAX_ROWS)])
+    df.iloc[Config.PERSONNEL_ROW, 1] = PERSONNEL
+    for day, shift in shifts_by_day.items():
+        df.iloc[Config.DAY_ROW_OFFSET + day, 1] = shift
+    return df
+
+
+def build_shift_dict():
+    shift_df = pd.DataFrame(
+        [["N", "17:00-20:00", None, "00:00-02:00"]],
+        columns=["班種", "加班時數1", "加班時數2", "跨日時數"]
+    )
+    shift_dict, warnings = DataProcessor.build_shift_dictionary(shift_df)
+    assert not warnings
+    return shift_dict
+
+
+def publish(sheet_id, df, period=None, use_in_session=False):
+    """登錄班表（可指定月份），use_in_session 時作為本 session 的班表"""
+    registry = RosterRegistry.instance()
+    snapshot = RosterSnapshot(sheet_id=sheet_id, content_hash=f"{sheet_id}-v1", df=df,
+                              shift_dict=build_shift_dict(), saved_at=datetime.now())
+    entry = registry.publish(snapshot, period=period)
+    if use_in_session:
+        SessionStateManager.switch_roster(registry.acquire(entry))
+    return entry
+
+
+def single(year, month):
+    columns = DataProcessor.find_matching_personnel_columns(SessionStateManager.get_df(), PERSONNEL)
+    return OvertimeCalculator.calculate_overtime_summary(PERSONNEL, year, month, columns)
+
+
+def team(year, month):
+    return OvertimeCalculator.calculate_team_overtime_summary(year, month, [PERSONNEL]).results[PERSONNEL]
+
+
+def ranged(start, end):
+    range_result = OvertimeCalculator.calculate_range_overtime_summary(start, end, [PERSONNEL])
+    return [team_result.results[PERSONNEL] for team_result in range_result.months.values()]
+
+
+def test_same_roster_keeps_spill_in_its_own_month(session):
+    # 同一份班表涵蓋兩個月份：第 28 列是 2/28 也是 3/28，2/28 的跨日時段不可再跨入 3/1
+    publish("roster", build_roster({28: "N"}), use_in_session=True)
+    
+    for february, march in ((single(2025, 2), single(2025, 3)),
+                            (team(2025, 2), team(2025, 3)),
+                            tuple(ranged((2025, 2), (2025, 3)))):
+        assert february.daily.hours[february.daily.days_in_month] == N_SHIFT_CROSS_HOURS  # 留在 2 月
+        assert february.weekend_hours == N_SHIFT_CROSS_HOURS
+        assert february.carry_out_hours == 0.0
+        assert march.carry_in_hours == 0.0
+        assert not march.daily.has(0)
+        assert march.weekend_hours == N_SHIFT_CROSS_HOURS  # 3/28 週五的跨日時段落在 3/29 週六
+        assert march.daily.hours[28] == N_SHIFT_CROSS_HOURS
+
+
+def test_distinct_period_rosters_carry_spill_once(session):
+    # 2 月與 3 月各有月份班表：2/28 的跨日時段計入 3/1，2 月不再計算
+    publish("local-2025-02", build_roster({28: "N"}), period="2025-02")
+    publish("local-2025-03", build_roster({}), period="2025-03", use_in_session=True)
+    
+    february, march = ranged((2025, 2), (2025, 3))
+    assert february.carry_out_hours == N_SHIFT_CROSS_HOURS
+    assert february.weekend_hours == 0.0
+    assert march.carry_in_hours == N_SHIFT_CROSS_HOURS
+    assert march.daily.hours[0] == N_SHIFT_CROSS_HOURS
+    assert february.weekend_hours + march.weekend_hours == N_SHIFT_CROSS_HOURS
+    
+    # 單月與團隊查詢 3 月（本 session 使用 3 月班表）也由 2 月班表的最後一日跨入
+    for result in (single(2025, 3), team(2025, 3)):
+        assert result.carry_in_hours == N_SHIFT_CROSS_HOURS
+        assert result.weekend_hours == march.weekend_hours
+
+
+def test_previous_month_override_updates_carry_in(session):
+    publish("local-2025-02", build_roster({28: "N"}), period="2025-02")
+    publish("local-2025-03", build_roster({}), period="2025-03", use_in_session=True)
+    assert single(2025, 3).carry_in_hours == N_SHIFT_CROSS_HOURS
+    
+    # 2/28 手動改為休假：3 月的快取結果與計算中間結果都需更新
+    SessionStateManager.set_manual_shift(PERSONNEL, 2025, 2, 28, "")
+    result = single(2025, 3)
+    assert result.carry_in_hours == 0.0
+    assert not result.daily.has(0)
+    assert team(2025, 3).weekend_hours == result.weekend_hours == 0.0
+
+
+@pytest.mark.parametrize("period", [None, "2025-03"])
+def test_no_carry_without_previous_period_roster(session, period):
+    # 2 月沒有月份班表：不論 3 月是否有，3 月都沒有跨入時段
+    publish("local-2025-03", build_roster({28: "N"}), period=period, use_in_session=True)
+    assert single(2025, 3).carry_in_hours == 0.0
+    assert single(2025, 2).carry_out_hours == 0.0
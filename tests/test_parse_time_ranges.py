@@ -0,0 +1,87 @@
+"""TimeCalculator.parse_time_ranges 與逐筆解析（calculate_hours / parse_interval）的一致性"""
+
+import math
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from finale_post_fixed import TimeCalculator
+
+# 各種寫法：HH:MM、HHMM、HH、小數、純時數、跨午夜與格式錯誤
+TIME_STRINGS = [
+    # HH:MM
+    "17:30-20:00", "08:00-12:00", "23:30-01:30", " 17:30 - 20:00 ", "7:05-9:5", "00:00-00:00",
+    # HHMM
+    "1730-2000", "0800-1200", "2330-0130", "1730-20:00",
+    # HH
+    "17-20", "8-12", "23-2", "0-24", "9-9",
+    # 小數
+    "17.5-20", "2.5", "0.5", ".5", "3.", "1,5", "24.0", "24.5",
+    # 純時數
+    "2", "4", "0", "24", "25", "007",
+    # 含中文註記
+    "17:30-20:00(值班)", "臨床業務",
+    # 格式錯誤
+    "", "   ", "-", "17:30-", "-20:00", "17:30-20:00-21:00", "25:00-26:00", "17:60-18:00",
+    "abc", "17:30~20:00", "12345-2000", "1:2:3-4", "１７:３０-２０:００", "17:30\t-20:00", "nan",
+]
+
+# 非字串輸入（試算表讀入時的型態）
+OTHER_VALUES = [None, np.nan, 0, 0.0, 2, 2.5, 24, 30, True, False]
+
+
+def scalar_parse(value):
+    """逐筆解析的結果 (開始分鐘, 結束分鐘, 時數)，無法解析為 None"""
+    interval = TimeCalculator.parse_interval(value)
+    start, end = interval if interval is not None else (None, None)
+    return start, end, TimeCalculator.calculate_hours(value)
+
+
+def as_optional(value):
+    """NaN 轉為 None（與逐筆解析的無結果相同）"""
+    return None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+
+
+def assert_parity(values):
+    """整欄批次解析與逐筆解析的每個欄位都相同"""
+    batch = TimeCalculator.parse_time_ranges(pd.Series(values, dtype=object))
+    assert len(batch) == len(values)
+    for position, value in enumerate(values):
+        row = batch.iloc[position]
+        expected = scalar_parse(value)
+        actual = tuple(as_optional(row[column]) for column in ("start_minutes", "end_minutes", "hours"))
+        assert actual == expected, f"{value!r}: batch {actual} != scalar {expected}"
+
+
+@pytest.mark.parametrize("value", TIME_STRINGS + OTHER_VALUES)
+def test_single_value_matches_scalar_parser(value):
+    assert_parity([value])
+
+
+def test_whole_column_matches_scalar_parser():
+    # 重複值與混合型態放在同一欄，確認去重後的結果對回原位置
+    values = (TIME_STRINGS + OTHER_VALUES) * 3
+    random.Random(0).shuffle(values)
+    assert_parity(values)
+
+
+def test_generated_strings_match_scalar_parser():
+    rng = random.Random(15)
+    pieces = ["0", "1", "2", "3", "5", "9", ":", ":", "-", ".", ",", " ", "a", "30", "17", "23", "24", "60"]
+    values = ["".join(rng.choice(pieces) for _ in range(rng.randint(1, 8))) for _ in range(3000)]
+    assert_parity(values)
+
+
+def test_keeps_index_and_accepts_list():
+    series = pd.Series(["17:30-20:00", None, "2"], index=[10, 20, 30], dtype=object)
+    batch = TimeCalculator.parse_time_ranges(series)
+    assert list(batch.index) == [10, 20, 30]
+    assert list(batch.columns) == ["start_minutes", "end_minutes", "hours"]
+    assert TimeCalculator.parse_time_ranges(["17:30-20:00"])["hours"].tolist() == [2.5]
+
+
+def test_empty_input():
+    batch = TimeCalculator.parse_time_ranges(pd.Series([], dtype=object))
+    assert batch.empty
@@ -0,0 +1,94 @@
+"""跨 session 查詢結果快取：鍵包含所有影響結果的輸入"""
+
+import pytest
+import streamlit as st
+
+from finale_post_fixed import (AllocationEngine, Config, DataProcessor, OvertimeCalculator, QueryResultCache,
+                               SessionStateManager, ShiftEditor)
+
+PERSONNEL = Config.ALLOWED_PERSONNEL[0]
+YEAR, MONTH = 2025, 3
+
+
+def query(policy=None):
+    columns = DataProcessor.find_matching_personnel_columns(SessionStateManager.get_df(), PERSONNEL)
+    return OvertimeCalculator.calculate_overtime_summary(PERSONNEL, YEAR, MONTH, columns, policy)
+
+
+def revert_edit(personnel, year, month, day):
+    """以班次編輯器改回原始班次（移除手動設定）"""
+    columns = DataProcessor.find_matching_personnel_columns(SessionStateManager.get_df(), personnel)
+    original = SessionStateManager.get_month_shifts(personnel, year, month, columns).original[day - 1]
+    SessionStateManager.set_manual_shift(personnel, year, month, day, "W" if original != "W" else "D")
+    st.session_state[f"shift_edit_{personnel}_{year}_{month}_{day}"] = original
+    ShiftEditor._on_shift_change(personnel, year, month, day, original)
+
+
+HITS = {
+    "repeat": lambda publish: None,
+    "holiday in another month": lambda publish: SessionStateManager.set_custom_holiday("2025-05-05", "補假(一)"),
+    "holiday on previous month's last day": lambda publish: SessionStateManager.set_custom_holiday("2025-02-28", "補假(五)"),
+    "edit in another month": lambda publish: SessionStateManager.set_manual_shift(PERSONNEL, 2025, 5, 10, "N"),
+    "edit on previous month's last day (same roster)": lambda publish: SessionStateManager.set_manual_shift(PERSONNEL, 2025, 2, 28, "N"),
+    "edit for another person": lambda publish: SessionStateManager.set_manual_shift(Config.ALLOWED_PERSONNEL[1], YEAR, MONTH, 10, "N"),
+    "reverted edit": lambda publish: revert_edit(PERSONNEL, YEAR, MONTH, 10),
+}
+
+MISSES = {
+    "holiday in this month": lambda publish: SessionStateManager.set_custom_holiday("2025-03-10", "補假(一)"),
+    "holiday on next month's 1st": lambda publish: SessionStateManager.set_custom_holiday("2025-04-01", "補假(二)"),
+    "edit in this month": lambda publish: SessionStateManager.set_manual_shift(PERSONNEL, YEAR, MONTH, 10, "N"),
+    "edit on this month's last day": lambda publish: SessionStateManager.set_manual_shift(PERSONNEL, YEAR, MONTH, 31, "N"),
+    "new roster version": lambda publish: publish(version="v2"),
+}
+
+
+@pytest.fixture
+def publish(publish_roster, roster_df):
+    def publish_version(version="v1"):
+        df = roster_df.copy()
+        if version != "v1":
+            df.iloc[Config.DAY_ROW_OFFSET + 20, 1] = "X1"
+        return publish_roster(df, version=version)
+    publish_version()
+    return publish_version
+
+
+@pytest.mark.parametrize("change", HITS.values(), ids=list(HITS))
+def test_unrelated_inputs_hit(publish, change):
+    cached = query()
+    change(publish)
+    stats = QueryResultCache.instance().stats()
+    assert query() is cached
+    assert QueryResultCache.instance().stats()['hits'] == stats['hits'] + 1
+
+
+@pytest.mark.parametrize("change", MISSES.values(), ids=list(MISSES))
+def test_relevant_inputs_miss(publish, change):
+    cached = query()
+    change(publish)
+    assert query() is not cached
+
+
+@pytest.mark.parametrize("policy", [name for name in AllocationEngine.POLICIES if name != Config.ALLOCATION_POLICY])
+def test_policy_change_misses(publish, policy):
+    cached = query()
+    assert query(policy) is not cached
+    assert query() is cached
+
+
+def test_carry_in_edit_misses_across_period_rosters(publish_roster, roster_df):
+    # 2 月另有月份班表時，其最後一日的手動設定影響 3 月第 1 日
+    publish_roster(roster_df.copy(), sheet_id="local-2025-02", period="2025-02", use_in_session=False)
+    publish_roster(roster_df.copy(), sheet_id="local-2025-03", period="2025-03")
+    cached = query()
+    SessionStateManager.set_manual_shift(PERSONNEL, 2025, 2, 28, "N")
+    assert query() is not cached
+
+
+def test_team_results_do_not_keep_the_team_matrix(publish):
+    team_result = OvertimeCalculator.calculate_team_overtime_summary(YEAR, MONTH, Config.ALLOWED_PERSONNEL[:6])
+    # 快取以每人時數的大小估算記憶體，時數不可是團隊時數表的檢視
+    for result in team_result.results.values():
+        assert result.daily.hours.base is None
+    assert query() is team_result.results[PERSONNEL]
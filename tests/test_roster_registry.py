@@ -0,0 +1,75 @@
+"""跨 session 共用班表庫：版本切換與共用快取"""
+
+import gc
+
+from finale_post_fixed import Config, DataProcessor, RosterRegistry, SessionStateManager, TimeCalculator
+
+
+def test_switching_roster_version_clears_hours_cache(publish_roster, roster_df, shift_df):
+    publish_roster(roster_df, version="v1")
+    TimeCalculator.calculate_hours("10:00-12:00")
+    assert TimeCalculator.hours_cache_stats()['size'] > 0
+    
+    # 建立班種字典不清除共用快取（可能在背景執行緒執行）
+    DataProcessor.build_shift_dictionary(shift_df)
+    assert TimeCalculator.hours_cache_stats()['size'] > 0
+    
+    # 再次換用同一版本不清除
+    SessionStateManager.switch_roster(RosterRegistry.instance().acquire(SessionStateManager.get_roster()))
+    assert TimeCalculator.hours_cache_stats()['size'] > 0
+    
+    # 背景更新登錄新版本後，session 換用時清除
+    publish_roster(roster_df.copy(), version="v2", use_in_session=False)
+    assert TimeCalculator.hours_cache_stats()['size'] > 0
+    assert SessionStateManager.sync_roster()
+    assert TimeCalculator.hours_cache_stats()['size'] == 0
+
+
+def publish_periods(publish_roster, roster_df, periods):
+    return {period: publish_roster(roster_df.copy(), sheet_id=f"local-{period}", period=period, use_in_session=False)
+            for period in periods}
+
+
+def test_unregister_releases_period_roster(publish_roster, roster_df):
+    publish_periods(publish_roster, roster_df, ["2025-01", "2025-02"])
+    registry = RosterRegistry.instance()
+    stats = registry.stats()
+    assert stats['periods'] == 2
+    assert stats['period_memory_bytes'] > 0
+    
+    assert registry.unregister("local-2025-01")
+    assert not registry.unregister("local-2025-01")
+    assert list(registry.periods()) == ["2025-02"]
+    assert registry.current("local-2025-01") is None
+    assert registry.stats()['entries'] == stats['entries'] - 1
+    assert registry.stats()['period_memory_bytes'] == stats['period_memory_bytes'] // 2
+    assert registry.carry_roster(2025, 1, None) is None
+
+
+def test_unregistered_roster_in_use_is_released_with_its_handle(publish_roster, roster_df, monkeypatch):
+    monkeypatch.setattr(Config, "ROSTER_REGISTRY_MAX_IDLE", 0)
+    entry = publish_roster(roster_df, sheet_id="local-2025-01", period="2025-01")
+    registry = RosterRegistry.instance()
+    registry.unregister("local-2025-01")
+    
+    # 本 session 仍在使用：保留到換用其他班表後，依一般規則淘汰
+    assert SessionStateManager.get_roster() is entry
+    assert registry.periods() == {}
+    publish_roster(roster_df.copy(), sheet_id="cloud")
+    gc.collect()
+    assert registry.entry_for(entry.df) is None
+
+
+def test_idle_period_rosters_are_capped(publish_roster, roster_df, monkeypatch):
+    monkeypatch.setattr(Config, "ROSTER_REGISTRY_MAX_IDLE_PERIODS", 3)
+    registry = RosterRegistry.instance()
+    entries = publish_periods(publish_roster, roster_df, ["2025-01", "2025-02", "2025-03"])
+    held = registry.acquire(entries["2025-01"])  # 使用中的月份班表不淘汰
+    registry.current("local-2025-02")  # 最近使用
+    
+    publish_periods(publish_roster, roster_df, ["2025-04", "2025-05"])
+    assert list(registry.periods()) == ["2025-01", "2025-02", "2025-04", "2025-05"]
+    assert registry.current("local-2025-03") is None
+    stats = registry.stats()
+    assert stats['entries'] == stats['periods'] == 4
+    assert held.sheet_id == "local-2025-01"
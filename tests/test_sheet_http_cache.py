@@ -0,0 +1,164 @@
+"""條件式 HTTP 下載：以本機 HTTP 伺服器代替 Google Sheets"""
+
+import http.server
+import socketserver
+import threading
+
+import pytest
+
+from finale_post_fixed import Config, DataLoader, DataProcessor, RosterRegistry, SheetHttpCache, SourceFetchStatus
+
+LAST_MODIFIED = "Mon, 03 Mar 2025 08:00:00 GMT"
+
+
+class SheetServer:
+    """
+    回傳固定內容並帶 ETag / Last-Modified 的 HTTP 伺服器
+    
+    honor_conditional 為 False 時忽略條件式標頭，每次回應 200（內容不變但 ETag 改變）。
+    """
+    
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.requests = []  # (路徑, 請求標頭, 回應狀態碼)
+        self.honor_conditional = True
+        self.etag_version = 1
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+    
+    def _handler(self):
+        sheet_server = self
+        
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+            
+            def log_message(self, *args):
+                pass
+            
+            def do_GET(self):
+                etag = f'"{self.path}-{sheet_server.etag_version}"'
+                not_modified = sheet_server.honor_conditional and self.headers.get("If-None-Match") == etag
+                sheet_server.requests.append((self.path, dict(self.headers), 304 if not_modified else 200))
+                if not_modified:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                body = sheet_server.bodies[self.path]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", LAST_MODIFIED)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 範圍讀取提早關閉連線
+        
+        return Handler
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def sheet_server(session, roster_df, shift_df, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "HTTP_CACHE_DIR", str(tmp_path / "http"))
+    monkeypatch.setattr(Config, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    server = SheetServer({
+        "/roster.csv": roster_df.to_csv(index=False).encode("utf-8"),
+        "/shift.csv": shift_df.to_csv(index=False).encode("utf-8"),
+    })
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def build_calls(monkeypatch):
+    """記錄實際的 CSV 解析（尚未有 DataFrame 時）與 build_shift_dictionary 的呼叫次數"""
+    calls = {'parse': 0, 'build': 0}
+    parse_source = DataLoader.parse_source
+    build_shift_dictionary = DataProcessor.build_shift_dictionary
+    
+    def counting_parse(status):
+        calls['parse'] += status.frame is None
+        return parse_source(status)
+    
+    def counting_build(shift_df):
+        calls['build'] += 1
+        return build_shift_dictionary(shift_df)
+    
+    monkeypatch.setattr(DataLoader, "parse_source", staticmethod(counting_parse))
+    monkeypatch.setattr(DataProcessor, "build_shift_dictionary", staticmethod(counting_build))
+    return calls
+
+
+def roster_status(server):
+    return SourceFetchStatus(name="員工班表", url=server.url("/roster.csv"), max_rows=Config.MAX_ROWS, max_cols=Config.MAX_COLS)
+
+
+def test_second_fetch_sends_validators_and_reuses_body_on_304(sheet_server):
+    first = roster_status(sheet_server)
+    SheetHttpCache.fetch(first)
+    assert not first.unchanged
+    assert "If-None-Match" not in sheet_server.requests[0][1]
+    
+    second = roster_status(sheet_server)
+    SheetHttpCache.fetch(second)
+    _, headers, status_code = sheet_server.requests[1]
+    assert headers["If-None-Match"] == '"/roster.csv-1"'
+    assert headers["If-Modified-Since"] == LAST_MODIFIED
+    assert status_code == 304
+    assert second.unchanged
+    assert second.body == first.body
+    assert second.content_hash == first.content_hash
+
+
+def test_identical_200_is_detected_by_hash(sheet_server):
+    first = roster_status(sheet_server)
+    SheetHttpCache.fetch(first)
+    
+    sheet_server.honor_conditional = False
+    sheet_server.etag_version = 2
+    second = roster_status(sheet_server)
+    SheetHttpCache.fetch(second)
+    assert sheet_server.requests[-1][2] == 200
+    assert second.unchanged
+    assert second.content_hash == first.content_hash
+
+
+def test_changed_body_is_not_unchanged(sheet_server):
+    first = roster_status(sheet_server)
+    SheetHttpCache.fetch(first)
+    
+    sheet_server.bodies["/roster.csv"] = sheet_server.bodies["/roster.csv"].replace(b"OFF", b"D", 1)
+    sheet_server.etag_version = 2
+    second = roster_status(sheet_server)
+    SheetHttpCache.fetch(second)
+    assert not second.unchanged
+    assert second.content_hash != first.content_hash
+
+
+@pytest.mark.parametrize("honor_conditional", [True, False], ids=["304", "identical 200"])
+def test_unchanged_sources_skip_parsing_and_shift_dictionary(sheet_server, build_calls, honor_conditional):
+    registry = RosterRegistry.instance()
+    roster_url, shift_url = sheet_server.url("/roster.csv"), sheet_server.url("/shift.csv")
+    entry, changed = DataLoader._revalidate(registry, "sheet", roster_url, shift_url)
+    assert changed
+    assert build_calls == {'parse': 2, 'build': 1}
+    
+    sheet_server.honor_conditional = honor_conditional
+    sheet_server.etag_version = 1 if honor_conditional else 2
+    build_calls.update(parse=0, build=0)
+    again, changed = DataLoader._revalidate(registry, "sheet", roster_url, shift_url)
+    assert not changed
+    assert again is entry
+    assert {status_code for _, _, status_code in sheet_server.requests[-2:]} == {304 if honor_conditional else 200}
+    assert build_calls == {'parse': 0, 'build': 0}
@@ -0,0 +1,62 @@
+"""團隊查詢（整批計算）與逐人單月查詢的結果相同"""
+
+import numpy as np
+import pytest
+
+from finale_post_fixed import (AllocationEngine, Config, DataProcessor, DataValidator, OvertimeCalculator,
+                               QueryResultCache, SessionStateManager)
+
+TEAM = Config.ALLOWED_PERSONNEL[:6] + ["Z99999"]
+
+
+def apply_overrides(year, month):
+    """手動設定：第 1 日、最後一日、班種表沒有的班次、休假，以及上個月最後一日"""
+    set_shift = SessionStateManager.set_manual_shift
+    set_shift(TEAM[0], year, month, 1, "N")
+    set_shift(TEAM[0], year, month, 31 if month in (1, 3) else 28, "X1")
+    set_shift(TEAM[1], year, month, 5, "Z9")
+    set_shift(TEAM[1], year, month, 6, "")
+    set_shift(TEAM[2], year, month, 12, "W")
+    previous_year, previous_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    set_shift(TEAM[3], previous_year, previous_month, 28 if previous_month == 2 else 31, "N")
+    SessionStateManager.set_custom_holiday(f"{year}-{month:02d}-10", "補假")
+
+
+@pytest.mark.parametrize("policy", list(AllocationEngine.POLICIES))
+@pytest.mark.parametrize("year, month", [(2025, 1), (2025, 3)])
+@pytest.mark.parametrize("period_rosters", [False, True], ids=["single roster", "period rosters"])
+def test_team_matches_single_queries(publish_roster, roster_df, policy, year, month, period_rosters):
+    if period_rosters:
+        previous = f"{year - 1}-12" if month == 1 else f"{year}-{month - 1:02d}"
+        previous_df = roster_df.copy()
+        day_rows = slice(Config.DAY_ROW_OFFSET + 1, None)
+        previous_df.iloc[day_rows] = roster_df.iloc[day_rows].iloc[::-1].to_numpy()
+        publish_roster(previous_df, sheet_id=f"local-{previous}", period=previous, use_in_session=False)
+        publish_roster(roster_df, sheet_id=f"local-{year}-{month:02d}", period=f"{year}-{month:02d}")
+    else:
+        publish_roster(roster_df)
+    apply_overrides(year, month)
+    
+    team_result = OvertimeCalculator.calculate_team_overtime_summary(year, month, TEAM, policy)
+    assert team_result.missing == ["Z99999"]
+    assert list(team_result.results) == TEAM[:6]
+    
+    # 團隊查詢的個人結果已放入快取，清除後單人查詢才會重新計算
+    QueryResultCache.instance().clear()
+    for personnel, team in team_result.results.items():
+        columns = DataProcessor.find_matching_personnel_columns(SessionStateManager.get_df(), personnel)
+        single = OvertimeCalculator.calculate_overtime_summary(personnel, year, month, columns, policy)
+        assert single is not team
+        assert team.matching_columns == single.matching_columns
+        assert np.array_equal(team.daily.hours, single.daily.hours), personnel
+        assert team.daily.order == single.daily.order, personnel
+        assert team.weekday_hours == single.weekday_hours, personnel
+        assert team.weekend_hours == single.weekend_hours, personnel
+        assert team.total_hours == single.total_hours, personnel
+        assert team.carry_in_hours == single.carry_in_hours, personnel
+        assert team.carry_out_hours == single.carry_out_hours, personnel
+
+
+@pytest.mark.parametrize("year, month, valid", [(2025, 3, True), (Config.MIN_YEAR - 1, 3, False), (2025, 13, False)])
+def test_validate_year_month(year, month, valid):
+    assert DataValidator.validate_year_month(year, month)[0] == valid